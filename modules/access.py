@@ -20,11 +20,17 @@ is this file's parent directory.
 ###############################################################################
 
 import os
+import shutil
 from pathlib import Path
 import logging
 
+import numpy as np
+
 from manifest import Manifest
-from chunk import create_chunks
+from chunk import create_chunks, decode_scale, PixelChunk
+from store import FrameStore
+from catalog import FrameCatalog
+import image
 
 
 ###############################################################################
@@ -41,13 +47,26 @@ LOG_FILENAME = "pathfinder.log"
 JOBS_DIR = "jobs"
 DATA_DIR = "data"
 IMAGES_DIR = "images"
+STORE_DIR = "store"
 HEATMAPS_DIR = "heatmaps"
 SERIES_DIR = "heatmaps/series"
 OUT_DIR = "out"
+TILES_DIR = "tiles"
 WEB_DIR = "web/client/src/data"
 ASSETS_DIR = "assets"
+PROJECTION_CACHE_DIR = "cache/projection"
 
 MANIFEST_FILENAME = "manifest.json"
+CATALOG_FILENAME = "catalog.txt"
+
+# chunk store attributes
+CHUNK_WIDTH = "chunk_width"
+CHUNK_HEIGHT = "chunk_height"
+STRIDE_X = "stride_x"
+STRIDE_Y = "stride_y"
+SCALE = "scale"
+
+FRAMES_STORE = "frames"
 
 
 ###############################################################################
@@ -74,14 +93,220 @@ def save_new_data(jobid, old_data_filepath, manifest):
 
     # Create chunks
     chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    chunk_json = chunk_image(old_data_filepath, new_data_filepath, manifest)
+
+    # Index the new frame by the time it was taken
+    taken = image.parse_datetime(chunk_json.file_datetime())
+    FrameCatalog.append(catalog_filepath(jobid), taken, new_data_filepath)
+
+    # Append to the job's chunk stores: the manifest's own chunk layout
+    # plus a pyramid of square chunk sizes, all from the same decode
+    store = open_chunk_store(jobid, manifest)
+    store.append(taken, chunk_json.luminosity_grid(stride_x, stride_y))
+
+    # Optionally keep the decoded frame itself for pixel level recording
+    if manifest.frame_store():
+        frames = open_frame_store(jobid,
+                                  chunk_json.image.shape,
+                                  chunk_json.scale)
+        frames.append(taken, chunk_json.image)
+
+    levels = chunk_json.pyramid(manifest.chunk_pyramid())
+    for chunk_size, (averages, _) in levels.items():
+        level = (chunk_size, chunk_size, chunk_size, chunk_size)
+        if level == (chunk_width, chunk_height, stride_x, stride_y):
+            continue
+        level_store = open_chunk_level(jobid, manifest.dimensions(), *level)
+        level_store.append(taken, averages)
+
+
+def chunk_image(image_filepath, data_filepath, manifest):
+    '''chunk an image with the manifest's chunk layout'''
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    scale = chunk_decode_scale(manifest)
 
-    msg = "Calling create_chunks with dim: {}".format(chunk_width,
-                                                      chunk_height)
+    msg = "Calling create_chunks with dim: {}, stride: {}, scale: {}"\
+        .format((chunk_width, chunk_height), (stride_x, stride_y), scale)
     logger.debug(msg)
-    create_chunks(old_data_filepath,
-                  new_data_filepath,
-                  chunk_width,
-                  chunk_height)
+    return create_chunks(image_filepath,
+                         data_filepath,
+                         chunk_width,
+                         chunk_height,
+                         stride_x,
+                         stride_y,
+                         scale)
+
+
+def chunk_decode_scale(manifest):
+    '''decode at reduced resolution if every chunk layout allows it'''
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    layout = [chunk_width, chunk_height, stride_x, stride_y]
+    layout += manifest.chunk_pyramid()
+    return decode_scale(manifest.decode_scale(), layout)
+
+
+def chunk_store(jobid, manifest):
+    '''chunk store holding every frame in the frame catalog
+
+    Recording reads frames from the store by time, so it never lists
+    the data dir. A store that does not match the catalog (e.g. a job
+    that predates the store, or whose manifest changed its chunk
+    layout) is rebuilt once from the catalog's chunk files, in the
+    order they were taken.
+    '''
+    store = open_chunk_store(jobid, manifest)
+    filepath = catalog_filepath(jobid)
+    if not os.path.isfile(filepath) or \
+            len(store) != FrameCatalog.num_added(filepath):
+        logger.info("Rebuilding chunk store for job {}".format(jobid))
+        catalog = frame_catalog(jobid, manifest)
+        catalog.rewrite()
+        shutil.rmtree(store.dirpath)
+        store = open_chunk_store(jobid, manifest)
+        fill_chunk_store(jobid, store, manifest, catalog.filepaths())
+    return store
+
+
+def frame_catalog(jobid, manifest):
+    '''catalog indexing every frame of the job
+
+    Jobs that predate the catalog get it built once from the data dir.
+    '''
+    filepath = catalog_filepath(jobid)
+    if os.path.isfile(filepath):
+        return FrameCatalog.load(filepath)
+    logger.info("Building frame catalog for job {}".format(jobid))
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    frames = []
+    for fp in image_filepaths(jobid):
+        chunk_obj = PixelChunk.of(fp, chunk_width, chunk_height)
+        frames.append((image.parse_datetime(chunk_obj.file_datetime()), fp))
+    return FrameCatalog.build(filepath, frames)
+
+
+def fill_chunk_store(jobid, store, manifest, data_filepaths):
+    stride_x, stride_y = manifest.chunk_stride()
+    for fp in data_filepaths:
+        chunk_obj = layout_chunks(jobid, fp, manifest)
+        taken = image.parse_datetime(chunk_obj.file_datetime())
+        store.append(taken, chunk_obj.luminosity_grid(stride_x, stride_y))
+
+
+def layout_chunks(jobid, data_filepath, manifest):
+    '''chunks of a data file, cut with the manifest's chunk layout
+
+    Chunk files cut with another layout are re-chunked from the
+    job's copy of their image, replacing the file in the data dir.
+    '''
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    layout = (chunk_width, chunk_height, stride_x, stride_y)
+
+    chunk_obj = PixelChunk.of(data_filepath, chunk_width, chunk_height)
+    stored_layout = chunk_obj.layout()
+    if stored_layout == layout:
+        return chunk_obj
+    if stored_layout is None:
+        # written before chunk files recorded their layout
+        try:
+            chunk_obj.luminosity_grid(stride_x, stride_y)
+            return chunk_obj
+        except ValueError:
+            pass
+
+    image_filepath = data_image_filepath(jobid, data_filepath)
+    if not os.path.isfile(image_filepath):
+        msg = "{} was chunked with layout {}, not {}, and its image {} "\
+            "is missing".format(data_filepath, stored_layout,
+                                layout, image_filepath)
+        raise ValueError(msg)
+    logger.debug("Re-chunking {} with layout {}".format(image_filepath,
+                                                        layout))
+    return chunk_image(image_filepath, data_filepath, manifest)
+
+
+def open_chunk_store(jobid, manifest):
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    return open_chunk_level(jobid,
+                            manifest.dimensions(),
+                            chunk_width,
+                            chunk_height,
+                            stride_x,
+                            stride_y)
+
+
+def frame_store(jobid, manifest):
+    '''frame store holding every frame in the frame catalog
+
+    A store that does not match the catalog (e.g. frame_store was
+    turned on partway through the job, or an append failed) is
+    rebuilt from the job's copies of the images. Without them there
+    is no frame store to record from, and None is returned.
+    '''
+    dirpath = frame_store_dir(jobid)
+    filepath = catalog_filepath(jobid)
+    if FrameStore.exists(dirpath) and os.path.isfile(filepath):
+        store = FrameStore.load(dirpath)
+        if len(store) == FrameCatalog.num_added(filepath):
+            return store
+
+    catalog = frame_catalog(jobid, manifest)
+    image_fps = [data_image_filepath(jobid, fp)
+                 for fp in catalog.filepaths()]
+    missing = [fp for fp in image_fps if not os.path.isfile(fp)]
+    if missing:
+        msg = "Frame store for job {} is missing frames and {} images "\
+            "are gone, recording from chunks instead"\
+            .format(jobid, len(missing))
+        logger.warning(msg)
+        return None
+
+    logger.info("Rebuilding frame store for job {}".format(jobid))
+    catalog.rewrite()
+    if os.path.isdir(dirpath):
+        shutil.rmtree(dirpath)
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    scale = chunk_decode_scale(manifest)
+    store = None
+    for fp in image_fps:
+        chunk_obj = PixelChunk.new(fp, chunk_width, chunk_height, scale)
+        if store is None:
+            store = open_frame_store(jobid,
+                                     chunk_obj.image.shape,
+                                     chunk_obj.scale)
+        taken = image.parse_datetime(chunk_obj.file_datetime())
+        store.append(taken, chunk_obj.image)
+    return store
+
+
+def open_frame_store(jobid, frame_shape, scale):
+    attrs = {SCALE: scale}
+    return FrameStore.open_or_new(frame_store_dir(jobid),
+                                  frame_shape,
+                                  np.uint8,
+                                  attrs)
+
+
+def open_chunk_level(jobid, dim, chunk_width, chunk_height,
+                     stride_x, stride_y):
+    width, height = dim
+    grid_shape = (-(-height // stride_y), -(-width // stride_x))
+    attrs = {
+        CHUNK_WIDTH: chunk_width,
+        CHUNK_HEIGHT: chunk_height,
+        STRIDE_X: stride_x,
+        STRIDE_Y: stride_y
+    }
+    dirpath = chunk_level_dir(jobid,
+                              chunk_width,
+                              chunk_height,
+                              stride_x,
+                              stride_y)
+    return FrameStore.open_or_new(dirpath, grid_shape, np.float32, attrs)
 
 
 def new_job_root():
@@ -104,6 +329,27 @@ def series_heatmap_filepath(jobid, timestamp):
     return join(series_dir, timestamp, ".heatmap")
 
 
+def frame_store_dir(jobid):
+    return join(sub_dir(jobid, STORE_DIR), FRAMES_STORE)
+
+
+def chunk_store_dir(jobid, manifest):
+    chunk_width, chunk_height = manifest.chunk_dimensions()
+    stride_x, stride_y = manifest.chunk_stride()
+    return chunk_level_dir(jobid,
+                           chunk_width,
+                           chunk_height,
+                           stride_x,
+                           stride_y)
+
+
+def chunk_level_dir(jobid, chunk_width, chunk_height, stride_x, stride_y):
+    store_name = "chunks_{}x{}".format(chunk_width, chunk_height)
+    if (stride_x, stride_y) != (chunk_width, chunk_height):
+        store_name += "_stride_{}x{}".format(stride_x, stride_y)
+    return join(sub_dir(jobid, STORE_DIR), store_name)
+
+
 def series_dir(jobid):
     return sub_dir(jobid, SERIES_DIR)
 
@@ -119,6 +365,11 @@ def manifest_filepath(jobid):
     return join(root, MANIFEST_FILENAME)
 
 
+def catalog_filepath(jobid):
+    root = job_root(jobid)
+    return join(root, CATALOG_FILENAME)
+
+
 def out_filepath(jobid, filename):
     out_dir = sub_dir(jobid, OUT_DIR)
     return join(out_dir, filename)
@@ -139,6 +390,12 @@ def heatmap_filepath(jobid):
     return join(heatmap_dir, heatmap_filename)
 
 
+def live_heatmap_filepath(jobid):
+    heatmap_dir = sub_dir(jobid, HEATMAPS_DIR)
+    heatmap_filename = "{}.live.heatmap".format(jobid)
+    return join(heatmap_dir, heatmap_filename)
+
+
 def image_filepaths(jobid):
     data_dir = sub_dir(jobid, DATA_DIR)
     filenames = [f for f in os.listdir(data_dir)
@@ -147,10 +404,21 @@ def image_filepaths(jobid):
     return filepaths
 
 
+def data_image_filepath(jobid, data_filepath):
+    '''the job's copy of the image a data file was chunked from'''
+    filename, _ = os.path.splitext(os.path.basename(data_filepath))
+    return specific_image(jobid, filename)
+
+
 def out_dir_filepath(jobid):
     return sub_dir(jobid, OUT_DIR)
 
 
+def tiles_filepath(jobid, name):
+    '''directory of the tile pyramid for output image name'''
+    return join(out_dir_filepath(jobid), TILES_DIR, name)
+
+
 def web_filepath(jobid):
     return pathfinder_filepath(WEB_DIR)
 
@@ -167,6 +435,9 @@ def log_filepath():
     log_dir = pathfinder_filepath(LOGS_DIR)
     return join(log_dir, LOG_FILENAME)
 
+def projection_cache_filepath():
+    return pathfinder_filepath(PROJECTION_CACHE_DIR)
+
 def assets_filepath():
     return pathfinder_filepath(ASSETS_DIR)
 
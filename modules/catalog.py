@@ -0,0 +1,149 @@
+'''catalog module
+
+A FrameCatalog maps the time each frame of a job was taken to the file
+holding it, so code that only needs the frames in a time period can
+find them without opening every file.
+
+The catalog is an append-only text file with one frame per line:
+
+    2018:05:08 14:12:15<TAB>data/0.txt
+
+Paths are stored relative to the catalog's directory. If a path is
+added more than once, the last entry wins.
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import bisect
+import os
+
+import image
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+SEPARATOR = "\t"
+
+READ_BYTES = 1 << 16
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class FrameCatalog(object):
+
+    @staticmethod
+    def load(filepath):
+        entries = {}
+        if os.path.isfile(filepath):
+            with open(filepath) as f:
+                for line in f:
+                    dt_str, rel_path = line.rstrip("\n").split(SEPARATOR)
+                    entries[rel_path] = image.parse_datetime(dt_str)
+        return FrameCatalog(filepath, entries)
+
+    @staticmethod
+    def build(filepath, frames):
+        '''new catalog of (time taken, filepath) frames'''
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+        catalog = FrameCatalog(filepath, {})
+        for dt, fp in frames:
+            catalog.add(dt, fp)
+        return catalog
+
+    @staticmethod
+    def append(filepath, dt, fp):
+        '''add a frame to the catalog at filepath without loading it'''
+        FrameCatalog(filepath, {}).add(dt, fp)
+
+    @staticmethod
+    def num_added(filepath):
+        '''number of frames added to the catalog at filepath
+
+        Counts a file once for every time it was added, without
+        parsing the catalog.
+        '''
+        if not os.path.isfile(filepath):
+            return 0
+        with open(filepath, 'rb') as f:
+            return sum(block.count(b"\n")
+                       for block in iter(lambda: f.read(READ_BYTES), b""))
+
+    def __init__(self, filepath, entries):
+        super().__init__()
+        self.filepath = filepath
+        self._entries = entries
+        self._index = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _root(self):
+        return os.path.dirname(os.path.abspath(self.filepath))
+
+    def _relative(self, fp):
+        return os.path.relpath(os.path.abspath(fp), self._root())
+
+    def _absolute(self, rel_path):
+        return os.path.join(self._root(), rel_path)
+
+    def add(self, dt, fp):
+        rel_path = self._relative(fp)
+        with open(self.filepath, 'a') as f:
+            f.write(line(dt, rel_path))
+        self._entries[rel_path] = dt
+        self._index = None
+
+    def rewrite(self):
+        '''rewrite the catalog file with one line per file, in time order'''
+        tmp_filepath = self.filepath + ".tmp"
+        with open(tmp_filepath, 'w') as f:
+            for dt, rel_path in self._sorted():
+                f.write(line(dt, rel_path))
+        os.replace(tmp_filepath, self.filepath)
+
+    def time_taken(self, fp):
+        return self._entries.get(self._relative(fp), None)
+
+    def _sorted(self):
+        if self._index is None:
+            self._index = sorted((dt, rel_path)
+                                 for rel_path, dt in self._entries.items())
+        return self._index
+
+    def filepaths(self, period=None):
+        '''files of frames taken within period, or all, in time order'''
+        index = self._sorted()
+        if period is None:
+            return [self._absolute(rel_path) for _, rel_path in index]
+        times = [dt for dt, _ in index]
+        lo = bisect.bisect_left(times, period.start)
+        hi = bisect.bisect_right(times, period.end)
+        return [self._absolute(rel_path) for _, rel_path in index[lo:hi]]
+
+    def trim(self, filepaths, period):
+        '''drop files the catalog knows were taken outside of period
+
+        Files the catalog does not know about are kept, so callers
+        still check their dates.
+        '''
+        trimmed = []
+        for fp in filepaths:
+            dt = self.time_taken(fp)
+            if dt is None or period.contains(dt):
+                trimmed.append(fp)
+        return trimmed
+
+
+###############################################################################
+# Helpers                                                                     #
+###############################################################################
+
+def line(dt, rel_path):
+    return "{}{}{}\n".format(image.unparse_datetime(dt), SEPARATOR, rel_path)
@@ -8,9 +8,15 @@ of that chunk of the image.
 '''
 
 # Imports
+import os
 import json
+import glob
+import time
 import argparse
 import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from PIL import Image
 
 # Constants
@@ -18,6 +24,13 @@ from PIL import Image
 DEFAULT_CHUNK_WIDTH = 40
 DEFAULT_CHUNK_HEIGHT = 40
 
+# libjpeg can scale the DCT by 1/8, 1/4 and 1/2 while decoding
+DECODE_SCALES = (8, 4, 2, 1)
+
+# Batch chunking
+IMAGE_EXTENSION = '.jpg'
+BATCH_CHUNKSIZE = 8
+
 # Values for analyzing RGB values
 RED_INDEX = 0
 GREEN_INDEX = 1
@@ -34,6 +47,11 @@ CHUNK = 'chunks'
 COORDINATES = 'coordinates'
 RGB_AVERAGE = 'rgb'
 RGB_VARIANCE = 'variance'
+CHUNK_WIDTH = 'chunk-width'
+CHUNK_HEIGHT = 'chunk-height'
+STRIDE_X = 'stride-x'
+STRIDE_Y = 'stride-y'
+LAYOUT = (CHUNK_WIDTH, CHUNK_HEIGHT, STRIDE_X, STRIDE_Y)
 
 # pillow
 DATETIME_EXIF = 36867
@@ -45,15 +63,17 @@ DIM_HEIGHT = 257
 class PixelChunk(object):
 
     @staticmethod
-    def new(image_filepath, chunk_width, chunk_height):
+    def new(image_filepath, chunk_width, chunk_height, scale=1):
         image = Image.open(image_filepath)
         output_json = image_filepath.replace('.jpg', '.txt')
         exif_date = image._getexif()
         width = exif_date[DIM_WIDTH]
         height = exif_date[DIM_HEIGHT]
         file_date = exif_date[DATETIME_EXIF]
-        return PixelChunk(image.load(), output_json, width, height,
-                          chunk_width, chunk_height, file_date)
+        pixels, scale = reduced_pixel_array(image, scale)
+        return PixelChunk(pixels, output_json, width, height,
+                          chunk_width, chunk_height, file_date,
+                          scale=scale)
 
     @staticmethod
     def of(filepath, chunk_width, chunk_height):
@@ -65,17 +85,23 @@ class PixelChunk(object):
         image = filepath
         output_json = filepath
         chunks = chunk_json[CHUNK]
-        return PixelChunk(image, output_json,
-                          width, height,
-                          chunk_width, chunk_height,
-                          file_date,
-                          chunks)
+        chunk_obj = PixelChunk(image, output_json,
+                               width, height,
+                               chunk_width, chunk_height,
+                               file_date,
+                               chunks)
+        for key in LAYOUT:
+            if key in chunk_json:
+                chunk_obj.json_data[key] = chunk_json[key]
+        return chunk_obj
 
     def __init__(self, image, output_json,
                  width, height, chunk_width, chunk_height,
-                 file_date, chunks=None):
+                 file_date, chunks=None, scale=1):
         super(PixelChunk, self).__init__()
         self.image = image
+        self.scale = scale
+        self._integral = None
         self.output_json = output_json
         self.width = width
         self.height = height
@@ -88,19 +114,85 @@ class PixelChunk(object):
         self.json_data[CHUNK] = chunks if chunks else []
 
     def add_chunk(self, coordinate):
-        total_coordinates = total_chunk_coordinates(coordinate,
-                                                    self.chunk_width,
-                                                    self.chunk_height)
-        color_average, color_variance = color_values(self.image, total_coordinates)
+        x, y = (c // self.scale for c in coordinate)
+        chunk_width, chunk_height = self._scaled(self.chunk_width,
+                                                 self.chunk_height)
+        tile = self.image[y:y + chunk_height, x:x + chunk_width]
+        color_average, color_variance = chunk_color_values(tile,
+                                                           chunk_width,
+                                                           chunk_height)
+        self._append_chunk(coordinate,
+                           color_average[0, 0],
+                           color_variance[0, 0])
+
+    def add_all_chunks(self, stride_x=None, stride_y=None):
+        stride_x = stride_x or self.chunk_width
+        stride_y = stride_y or self.chunk_height
+        self.json_data[CHUNK_WIDTH] = self.chunk_width
+        self.json_data[CHUNK_HEIGHT] = self.chunk_height
+        self.json_data[STRIDE_X] = stride_x
+        self.json_data[STRIDE_Y] = stride_y
+        chunk_width, chunk_height = self._scaled(self.chunk_width,
+                                                 self.chunk_height)
+        if (stride_x, stride_y) == (self.chunk_width, self.chunk_height):
+            color_averages, color_variances = \
+                chunk_color_values(self.image,
+                                   chunk_width,
+                                   chunk_height)
+        else:
+            color_averages, color_variances = \
+                self.integral().chunk_color_values(chunk_width,
+                                                   chunk_height,
+                                                   *self._scaled(stride_x,
+                                                                 stride_y))
+        for row, col in np.ndindex(color_averages.shape):
+            coordinate = [col * stride_x, row * stride_y]
+            self._append_chunk(coordinate,
+                               color_averages[row, col],
+                               color_variances[row, col])
+
+    def _scaled(self, *lengths):
+        """full resolution lengths in pixels of the decoded image"""
+        if any(x % self.scale for x in lengths):
+            msg = "Chunk layout {} is not a multiple of decode scale {}"\
+                .format(lengths, self.scale)
+            raise ValueError(msg)
+        return tuple(x // self.scale for x in lengths)
+
+    def integral(self):
+        if self._integral is None:
+            self._integral = IntegralImage.new(self.image)
+        return self._integral
+
+    def with_chunk_dimensions(self, chunk_width, chunk_height):
+        """new, empty PixelChunk sharing this one's decoded image"""
+        other = PixelChunk(self.image, self.output_json,
+                           self.width, self.height,
+                           chunk_width, chunk_height,
+                           self.file_datetime(),
+                           scale=self.scale)
+        other._integral = self._integral
+        return other
+
+    def _append_chunk(self, coordinate, color_average, color_variance):
         self.json_data[CHUNK].append({
-            COORDINATES: coordinate,
-            RGB_AVERAGE: color_average,
-            RGB_VARIANCE: color_variance
+            COORDINATES: [int(c) for c in coordinate],
+            RGB_AVERAGE: float(color_average),
+            RGB_VARIANCE: float(color_variance)
         })
 
     def file_datetime(self):
         return self.json_data[FILE_DATETIME]
 
+    def layout(self):
+        '''(chunk width, chunk height, stride x, stride y) of the chunks
+
+        None for chunk files written before the layout was recorded.
+        '''
+        if not all(key in self.json_data for key in LAYOUT):
+            return None
+        return tuple(self.json_data[key] for key in LAYOUT)
+
     def rgb_chunks(self):
         chunks = {}
         for chunk in self.json_data[CHUNK]:
@@ -108,6 +200,34 @@ class PixelChunk(object):
             chunks[coord] = chunk[RGB_AVERAGE]
         return chunks
 
+    def luminosity_grid(self, stride_x=None, stride_y=None):
+        '''chunk luminosities as a (rows, cols) array
+
+        Row and column are the chunk's y and x coordinate divided by
+        the stride the chunks were laid out with.
+        '''
+        stride_x = stride_x or self.chunk_width
+        stride_y = stride_y or self.chunk_height
+        rows = -(-self.height // stride_y)
+        cols = -(-self.width // stride_x)
+        grid = np.full((rows, cols), np.nan)
+        for chunk in self.json_data[CHUNK]:
+            x, y = chunk[COORDINATES]
+            if x % stride_x or y % stride_y:
+                msg = "Chunk at {} is not on a {}x{} grid"\
+                    .format((x, y), stride_x, stride_y)
+                raise ValueError(msg)
+            grid[y // stride_y, x // stride_x] = chunk[RGB_AVERAGE]
+        if np.isnan(grid).any():
+            msg = "Chunks do not cover a {}x{} grid".format(stride_x, stride_y)
+            raise ValueError(msg)
+        return grid
+
+    def pyramid(self, chunk_sizes):
+        levels = chunk_pyramid(self.image, self._scaled(*chunk_sizes))
+        return {chunk_size * self.scale: values
+                for chunk_size, values in levels.items()}
+
     def write(self, new_filepath):
         with open(new_filepath, 'w') as outfile:
             json.dump(self.json_data, outfile)
@@ -116,32 +236,226 @@ class PixelChunk(object):
         return self.width, self.height
 
 
-# Helpers
-def color_values(image, coordinates):
-    average_red, average_green, average_blue = average_rgb_values(image, coordinates)
-    average_rgb = rgb_luminosity_average(image, average_red, average_green, average_blue)
-    average_variance = rgb_variance(image, coordinates, average_red, average_green, average_blue)
-    return average_rgb, average_variance
+class IntegralImage(object):
+    """Per-channel summed-area tables of an image
 
+    Built once per frame, an IntegralImage answers the sum and sum of
+    squares of any rectangle with four lookups, so chunk statistics
+    for any chunk size, stride or overlap come from a single decode.
+    """
 
-def average_rgb_values(image, coordinates):
-    average_red = 0
-    average_green = 0
-    average_blue = 0
-    for point in coordinates:
-        rgb = image[point]
-        average_red = average_red + rgb[RED_INDEX]
-        average_green = average_green + rgb[GREEN_INDEX]
-        average_blue = average_blue + rgb[BLUE_INDEX]
-    average_red = average_red / len(coordinates)
-    average_green = average_green / len(coordinates)
-    average_blue = average_blue / len(coordinates)
-    return average_red, average_green, average_blue
+    @staticmethod
+    def new(pixels):
+        height, width = pixels.shape[0:2]
+        sums = np.zeros((height + 1, width + 1, 3), dtype=np.int64)
+        squares = np.zeros((height + 1, width + 1, 3), dtype=np.int64)
+        values = pixels.astype(np.int64)
+        sums[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+        squares[1:, 1:] = (values ** 2).cumsum(axis=0).cumsum(axis=1)
+        return IntegralImage(sums, squares)
+
+    def __init__(self, sums, squares):
+        super(IntegralImage, self).__init__()
+        self._sums = sums
+        self._squares = squares
+
+    def dimensions(self):
+        height, width = self._sums.shape[0:2]
+        return width - 1, height - 1
+
+    def rect_sums(self, xs, ys, widths, heights):
+        '''channel sums, sums of squares and pixel counts of rectangles
+
+        Rectangles are clipped to the image, so partial edge chunks
+        only count the pixels they cover.
+        '''
+        width, height = self.dimensions()
+        x0 = np.clip(xs, 0, width)
+        y0 = np.clip(ys, 0, height)
+        x1 = np.clip(np.add(xs, widths), 0, width)
+        y1 = np.clip(np.add(ys, heights), 0, height)
+
+        sums = box_total(self._sums, x0, y0, x1, y1)
+        squares = box_total(self._squares, x0, y0, x1, y1)
+        counts = (x1 - x0) * (y1 - y0)
+        return sums, squares, counts
+
+    def color_values(self, xs, ys, chunk_width, chunk_height):
+        sums, squares, counts = self.rect_sums(xs, ys,
+                                               chunk_width,
+                                               chunk_height)
+        counts = counts[..., np.newaxis]
+        averages = sums / counts
+        variances = np.maximum(squares / counts - averages ** 2, 0)
+        return color_values(averages, variances)
+
+    def chunk_color_values(self, chunk_width, chunk_height,
+                           stride_x=None, stride_y=None):
+        '''luminosity average and variance on a (possibly strided) grid
+
+        Chunks start every stride_x, stride_y pixels, so strides smaller
+        than the chunk give overlapping chunks. Returns (rows, cols)
+        arrays like chunk_color_values.
+        '''
+        stride_x = stride_x or chunk_width
+        stride_y = stride_y or chunk_height
+        width, height = self.dimensions()
+        xs = np.arange(0, width, stride_x)
+        ys = np.arange(0, height, stride_y)
+        grid_ys, grid_xs = np.meshgrid(ys, xs, indexing='ij')
+        return self.color_values(grid_xs, grid_ys, chunk_width, chunk_height)
+
+
+class BatchReport(object):
+
+    def __init__(self, chunked, skipped, seconds):
+        super(BatchReport, self).__init__()
+        self.chunked = chunked
+        self.skipped = skipped
+        self.seconds = seconds
+
+    def frames_per_sec(self):
+        return self.chunked / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return "chunked {} frames in {:.1f}s ({:.1f} frames/sec), " \
+               "skipped {} up to date"\
+            .format(self.chunked,
+                    self.seconds,
+                    self.frames_per_sec(),
+                    self.skipped)
+
+
+# Helpers
+def box_total(table, x0, y0, x1, y1):
+    return (table[y1, x1] - table[y0, x1] -
+            table[y1, x0] + table[y0, x0]).astype(np.float64)
+
+
+def pixel_array(image):
+    return np.asarray(image.convert('RGB'), dtype=np.uint8)
+
+
+def reduced_pixel_array(image, scale):
+    scale = draft_image(image, scale)
+    return pixel_array(image), scale
+
+
+def draft_image(image, scale):
+    '''have an image decode at 1/scale of its size where the format allows
+
+    For JPEGs, Image.draft has libjpeg scale the DCT while decoding
+    (1/2, 1/4 or 1/8), so the full resolution image is never built.
+    Must be called before the image is loaded. Returns the scale
+    actually used.
+    '''
+    if scale > 1:
+        width, height = image.size
+        image.draft('RGB', (-(-width // scale), -(-height // scale)))
+        scale = int(round(width / image.size[0]))
+    return scale
+
+
+def decode_scale(requested, lengths):
+    '''largest DCT scale no bigger than requested dividing all lengths'''
+    for scale in DECODE_SCALES:
+        if scale <= requested and not any(x % scale for x in lengths):
+            return scale
+    return 1
+
+
+def chunk_color_values(pixels, chunk_width, chunk_height):
+    '''luminosity average and variance of every chunk in an image
+
+    pixels is a (height, width, 3) uint8 array. Returns two
+    (rows, cols) arrays indexed by chunk row and column. Chunks on
+    the right and bottom edges may be smaller than chunk_width by
+    chunk_height; they are averaged over the pixels they cover.
+    '''
+    sums, squares, counts = tile_sums(pixels, chunk_width, chunk_height)
+    counts = counts[..., np.newaxis]
+    averages = sums / counts
+    variances = np.maximum(squares / counts - averages ** 2, 0)
+    return color_values(averages, variances)
+
+
+def chunk_pyramid(pixels, chunk_sizes):
+    '''luminosity average and variance for several square chunk sizes
+
+    Tile sums are computed once at the smallest size; every size that
+    is a multiple of it is built by adding up those tiles, so the
+    frame is only reduced once. Returns {chunk_size: (averages,
+    variances)}.
+    '''
+    base_size = min(chunk_sizes)
+    base = tile_sums(pixels, base_size, base_size)
+
+    levels = {}
+    for chunk_size in sorted(set(chunk_sizes)):
+        factor, remainder = divmod(chunk_size, base_size)
+        if remainder:
+            sums, squares, counts = tile_sums(pixels, chunk_size, chunk_size)
+        else:
+            sums, squares, counts = (merge_tiles(x, factor) for x in base)
+        counts = counts[..., np.newaxis]
+        averages = sums / counts
+        variances = np.maximum(squares / counts - averages ** 2, 0)
+        levels[chunk_size] = color_values(averages, variances)
+    return levels
+
+
+def merge_tiles(tiles, factor):
+    rows, cols = tiles.shape[0:2]
+    merged_rows = -(-rows // factor)
+    merged_cols = -(-cols // factor)
+    pad = [(0, merged_rows * factor - rows),
+           (0, merged_cols * factor - cols)]
+    pad += [(0, 0)] * (tiles.ndim - 2)
+    padded = np.pad(tiles, pad, mode='constant')
+    shape = (merged_rows, factor, merged_cols, factor) + tiles.shape[2:]
+    return padded.reshape(shape).sum(axis=(1, 3))
+
+
+def tile_sums(pixels, chunk_width, chunk_height):
+    height, width = pixels.shape[0:2]
+    rows = -(-height // chunk_height)
+    cols = -(-width // chunk_width)
+
+    pad = ((0, rows * chunk_height - height),
+           (0, cols * chunk_width - width),
+           (0, 0))
+    padded = np.pad(pixels, pad, mode='constant')
+    tiles = padded.reshape(rows, chunk_height, cols, chunk_width, 3)
+
+    sums = tiles.sum(axis=(1, 3), dtype=np.float64)
+    squares = np.square(tiles, dtype=np.uint32).sum(axis=(1, 3),
+                                                    dtype=np.float64)
+
+    row_heights = np.minimum(chunk_height,
+                             height - np.arange(rows) * chunk_height)
+    col_widths = np.minimum(chunk_width,
+                            width - np.arange(cols) * chunk_width)
+    counts = np.outer(row_heights, col_widths)
+    return sums, squares, counts
+
+
+def color_values(averages, variances):
+    average_red = averages[..., RED_INDEX]
+    average_green = averages[..., GREEN_INDEX]
+    average_blue = averages[..., BLUE_INDEX]
+    average_rgb = rgb_luminosity_average(average_red,
+                                         average_green,
+                                         average_blue)
+    average_variance = rgb_variance(variances,
+                                    average_red,
+                                    average_green,
+                                    average_blue)
+    return average_rgb, average_variance
 
 
 # Why use this algorithm over a normal average
 # https://bit.ly/2E8XGPn
-def rgb_luminosity_average(image, average_red, average_green, average_blue):
+def rgb_luminosity_average(average_red, average_green, average_blue):
     red_value = average_red * LUMINOSITY_RED_VALUE
     green_value = average_green * LUMINOSITY_GREEN_VALUE
     blue_value = average_blue * LUMINOSITY_BLUE_VALUE
@@ -150,33 +464,16 @@ def rgb_luminosity_average(image, average_red, average_green, average_blue):
 
 # why using a classic rgb average instead of luminosity
 # https://bit.ly/2E8XGPn (same link as rbg lumonisty)
-def rgb_variance(image, coordinates, average_red, average_green, average_blue):
-    var_red, var_green, var_blue = rgb_variance_values(image,
-                                                       coordinates,
-                                                       average_red,
-                                                       average_green,
-                                                       average_blue)
+def rgb_variance(variances, average_red, average_green, average_blue):
+    var_red = variances[..., RED_INDEX]
+    var_green = variances[..., GREEN_INDEX]
+    var_blue = variances[..., BLUE_INDEX]
     variance = (1.0 / 3.0) * (var_red + var_green + var_blue)
     return variance + rgb_variance_rough_covariance_term(average_red,
                                                          average_green,
                                                          average_blue)
 
 
-def rgb_variance_values(image, coordinates, average_red, average_green, average_blue):
-    var_red = 0
-    var_green = 0
-    var_blue = 0
-    for point in coordinates:
-        rgb = image[point]
-        var_red = (average_red - rgb[RED_INDEX]) ** 2
-        var_green = (average_green - rgb[GREEN_INDEX]) ** 2
-        var_blue = (average_blue - rgb[BLUE_INDEX]) ** 2
-    var_red = var_red / len(coordinates)
-    var_green = var_green / len(coordinates)
-    var_blue = var_blue / len(coordinates)
-    return var_red, var_green, var_blue
-
-
 def rgb_variance_rough_covariance_term(average_red, average_green, average_blue):
     value_one = (2.0 / 9.0) * ((average_red**2) + (average_green**2) +
                                (average_blue**2))
@@ -185,49 +482,212 @@ def rgb_variance_rough_covariance_term(average_red, average_green, average_blue)
     return value_one - value_two
 
 
-def total_chunk_coordinates(coordinate,
-                            chunk_width,
-                            chunk_height):
-    x = coordinate[0]
-    x_end = x + chunk_width
-    y = coordinate[1]
-    y_end = y + chunk_height
-    xs, ys = range(x, x_end), range(y, y_end)
-    return set(itertools.product(xs, ys))
-
-
 # Main functions
 def main():
     args = get_args()
     if args.op == "create_chunks":
-        create_chunks(args.image_filepath, DEFAULT_CHUNK_WIDTH, DEFAULT_CHUNK_HEIGHT)
+        new_filepath = chunk_output_filepath(args.image_filepath)
+        create_chunks(args.image_filepath,
+                      new_filepath,
+                      args.chunk_width,
+                      args.chunk_height)
+    elif args.op == "batch_chunks":
+        image_filepaths = expand_image_filepaths(args.images)
+        scale = decode_scale(args.scale,
+                             [args.chunk_width, args.chunk_height])
+        report = batch_chunks(image_filepaths,
+                              args.chunk_width,
+                              args.chunk_height,
+                              args.output_dir,
+                              args.workers,
+                              args.force,
+                              scale)
+        print(report)
+    elif args.op == "decode_accuracy":
+        image_filepaths = expand_image_filepaths(args.images)
+        results = decode_accuracy(image_filepaths,
+                                  args.chunk_width,
+                                  args.chunk_height)
+        print("scale  mean abs err  max abs err  sec/frame")
+        for scale, (mean_err, max_err, seconds) in sorted(results.items()):
+            print("1/{:<4} {:<12.4f} {:<12.4f} {:.4f}"
+                  .format(scale, mean_err, max_err, seconds))
 
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("op",
-                        choices=["create_chunks"])
-    parser.add_argument("image_filepath",
-                        help="Image files")
-    return parser.parse_args()
+    subparsers = parser.add_subparsers(dest="op")
+
+    create_parser = subparsers.add_parser("create_chunks",
+                                          help="chunk a single image")
+    create_parser.add_argument("image_filepath",
+                               help="Image files")
+    add_chunk_dim_args(create_parser)
+
+    batch_parser = subparsers.add_parser("batch_chunks",
+                                         help="chunk many images")
+    batch_parser.add_argument("images",
+                              nargs="+",
+                              help="image files, directories or globs")
+    batch_parser.add_argument("-o", "--output-dir",
+                              help="directory for chunk files")
+    batch_parser.add_argument("-j", "--workers",
+                              type=int,
+                              help="number of worker processes")
+    batch_parser.add_argument("-f", "--force",
+                              action="store_true",
+                              help="rechunk up to date images")
+    batch_parser.add_argument("-s", "--scale",
+                              type=int,
+                              default=1,
+                              help="decode at 1/scale resolution")
+    add_chunk_dim_args(batch_parser)
+
+    accuracy_parser = subparsers.add_parser("decode_accuracy",
+                                            help="compare decode scales")
+    accuracy_parser.add_argument("images",
+                                 nargs="+",
+                                 help="image files, directories or globs")
+    add_chunk_dim_args(accuracy_parser)
 
+    return parser.parse_args()
 
-def create_chunks(image_filepath, new_filepath, chunk_width, chunk_height):
-    chunk_json = PixelChunk.new(image_filepath, chunk_width, chunk_height)
 
-    dimensions = chunk_json.dimensions()
-    all_coordinates = coordinates(dimensions,
-                                  chunk_width,
-                                  chunk_height)
-    for coordinate in all_coordinates:
-        chunk_json.add_chunk(coordinate)
+def add_chunk_dim_args(parser):
+    parser.add_argument("--chunk-width",
+                        type=int,
+                        default=DEFAULT_CHUNK_WIDTH,
+                        help="chunk width in pixels")
+    parser.add_argument("--chunk-height",
+                        type=int,
+                        default=DEFAULT_CHUNK_HEIGHT,
+                        help="chunk height in pixels")
+
+
+def create_chunks(image_filepath, new_filepath, chunk_width, chunk_height,
+                  stride_x=None, stride_y=None, scale=1):
+    chunk_json = PixelChunk.new(image_filepath,
+                                chunk_width,
+                                chunk_height,
+                                scale)
+    chunk_json.add_all_chunks(stride_x, stride_y)
     chunk_json.write(new_filepath)
+    return chunk_json
+
+
+def batch_chunks(image_filepaths, chunk_width, chunk_height,
+                 output_dir=None, workers=None, force=False, scale=1):
+    '''chunk many images with a pool of worker processes
+
+    Images whose chunk file is newer than the image, and was cut with
+    the same chunk dimensions, are skipped unless force is set.
+    '''
+    tasks = [(fp, chunk_output_filepath(fp, output_dir),
+              chunk_width, chunk_height, scale)
+             for fp in image_filepaths]
+    check_output_collisions(tasks)
+    layout = (chunk_width, chunk_height, chunk_width, chunk_height)
+    stale = [task for task in tasks
+             if force or not is_up_to_date(task[0], task[1], layout)]
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    start = time.time()
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(chunk_task, stale, chunksize=BATCH_CHUNKSIZE))
+    seconds = time.time() - start
+
+    return BatchReport(len(stale), len(tasks) - len(stale), seconds)
+
+
+def decode_accuracy(image_filepaths, chunk_width, chunk_height,
+                    scales=DECODE_SCALES):
+    '''compare reduced resolution chunk luminosity to full resolution
+
+    Returns {scale: (mean abs error, max abs error, seconds per frame)}
+    over all chunks of all images.
+    '''
+    full = {fp: image_luminosity_grid(fp, chunk_width, chunk_height)
+            for fp in image_filepaths}
+    results = {}
+    for scale in sorted(scales):
+        errors = []
+        start = time.time()
+        for fp in image_filepaths:
+            grid = image_luminosity_grid(fp, chunk_width, chunk_height,
+                                         scale)
+            errors.append(np.abs(grid - full[fp]).ravel())
+        seconds = (time.time() - start) / max(len(image_filepaths), 1)
+        errors = np.concatenate(errors) if errors else np.zeros(1)
+        results[scale] = (errors.mean(), errors.max(), seconds)
+    return results
+
+
+def image_luminosity_grid(image_filepath, chunk_width, chunk_height,
+                          scale=1):
+    chunk_obj = PixelChunk.new(image_filepath, chunk_width, chunk_height,
+                               scale)
+    chunk_obj.add_all_chunks()
+    return chunk_obj.luminosity_grid()
+
+
+def chunk_task(task):
+    image_filepath, new_filepath, chunk_width, chunk_height, scale = task
+    create_chunks(image_filepath, new_filepath, chunk_width, chunk_height,
+                  scale=scale)
+    return new_filepath
+
+
+def is_up_to_date(image_filepath, chunk_filepath, layout=None):
+    '''chunk file is newer than the image, and cut with layout if given'''
+    if not os.path.isfile(chunk_filepath):
+        return False
+    if os.path.getmtime(chunk_filepath) < os.path.getmtime(image_filepath):
+        return False
+    if layout is None:
+        return True
+    with open(chunk_filepath) as f:
+        chunk_json = json.load(f)
+    return layout == tuple(chunk_json.get(key) for key in LAYOUT)
+
+
+def check_output_collisions(tasks):
+    '''fail if two images would be chunked to the same file'''
+    sources = {}
+    for image_filepath, chunk_filepath, *_ in tasks:
+        other = sources.setdefault(os.path.abspath(chunk_filepath),
+                                   image_filepath)
+        if os.path.abspath(other) != os.path.abspath(image_filepath):
+            msg = "{} and {} would both be chunked to {}"\
+                .format(other, image_filepath, chunk_filepath)
+            raise ValueError(msg)
+
+
+def chunk_output_filepath(image_filepath, output_dir=None):
+    filename, _ = os.path.splitext(os.path.basename(image_filepath))
+    directory = output_dir or os.path.dirname(image_filepath)
+    return os.path.join(directory, filename + '.txt')
+
+
+def expand_image_filepaths(patterns):
+    filepaths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*' + IMAGE_EXTENSION)
+        filepaths.extend(sorted(glob.glob(pattern)))
+    return filepaths
 
 
 def coordinates(dim,
                 chunk_width,
-                chunk_height):
-    xs, ys = range(0, dim[0], chunk_width), range(0, dim[1], chunk_height)
+                chunk_height,
+                stride_x=None,
+                stride_y=None):
+    stride_x = stride_x or chunk_width
+    stride_y = stride_y or chunk_height
+    xs, ys = range(0, dim[0], stride_x), range(0, dim[1], stride_y)
     return set(itertools.product(xs, ys))
 
 
@@ -7,7 +7,7 @@
 import argparse
 import json
 
-from heatmap import Heatmap, HeatmapSeries, TimePeriod
+from heatmap import HeatmapHeader, HeatmapSeries, TimePeriod
 from enum import Enum
 
 
@@ -71,13 +71,13 @@ def write_frequency(series_heatmap_fp,
 ###############################################################################
 
 def estimate_total(heatmap_filepath):
-    hm = Heatmap.load(heatmap_filepath)
+    hm = HeatmapHeader.load(heatmap_filepath)
     return estimate_total_hm(hm)
 
 
 def estimate_frequency(series_heatmap_fp, units, aggregate):
     series = HeatmapSeries.load(series_heatmap_fp)
-    heatmaps = series.subheatmaps()
+    heatmaps = series.subheatmap_headers()
 
     obj_per_sec = {}
 
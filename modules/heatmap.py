@@ -18,14 +18,52 @@ record_heatmap(...)
 view_heatmap(...)
 project_heatmap(...)
 overlay_heatmap(...)
+range_heatmap(...)
 
 The heatmap API can also be access by the command line interface
 defined in this file.
 
 The module makes use of a Python Heatmap object for most of these
-operations. The Heatmap object can be saved and loaded as a binary
-file using pickle. Users of the heatmap API should consider the
-Heatmap object to be an implementation detail.
+operations. Users of the heatmap API should consider the Heatmap
+object to be an implementation detail.
+
+Heatmap files have the layout:
+
+    b"PFHM"        magic
+    uint32 (LE)    length of the JSON header that follows
+    JSON header    format version, count, period, project_period,
+                   watermark, manifest and manifest_hash, cell size,
+                   and an "arrays" table of name -> dtype, shape and offset
+    payload        raw C order arrays, each at its offset from the
+                   start of the payload (64 byte aligned)
+
+The header is padded with spaces so the payload is 64 byte aligned
+too, letting the arrays be memory-mapped. HeatmapHeader reads the
+header alone, so count and periods cost a few hundred bytes of I/O.
+A series is a JSON file pointing at a SeriesStore directory, which
+keeps every interval's counts as one frame of a memory-mapped
+FrameStore, alongside each interval's count and period:
+
+    counts/        FrameStore of cell grids, timestamped by interval start
+    cumulative/    FrameStore of running sums of those cell grids
+    intervals/     FrameStore of [count, period start, period end]
+    states/        {start}.state, the watermark and trailing frames
+                   recording an interval resumes from
+
+Starting an interval appends to each, and reading one interval does
+not touch the others. The running sums let range_heatmap() answer
+any run of intervals with the difference of two of them. The
+interval being recorded is also kept as an ordinary heatmap file,
+which is copied into the store, with its recording state, after
+each update. Heatmaps and series saved with pickle, and series
+listing one heatmap file per interval, still load; their intervals
+are imported into a store.
+
+A LiveHeatmap is a heatmap whose float32 counts halve every half_life
+seconds, so it shows recent activity rather than all of it. Each
+window's motion is added after decaying the counts to the window's
+time, which is one pass over the grid. Its file also records
+half_life and the time it was last decayed to.
 
 Further descriptions of the heatmapping algorithms used can be
 found in the Pathfinder design document.
@@ -37,9 +75,13 @@ found in the Pathfinder design document.
 ###############################################################################
 
 import argparse
+import functools
+import hashlib
 import json
 import pickle
 import os
+import struct
+import sys
 import logging
 
 from datetime import datetime, timedelta
@@ -51,7 +93,12 @@ from PIL import ImageOps
 
 from manifest import Manifest
 from mapping import Geometry
-import mapping
+from store import FrameStore, to_timestamp, from_timestamp
+from catalog import FrameCatalog
+from projection import CoordRange
+import projection
+import render
+import output
 import cli
 import image
 import log
@@ -64,9 +111,63 @@ import log
 DEFAULT_WINDOW_SIZE = 2
 DEFAULT_COLOR_THRESH = 50
 
+# counts start small and are promoted as they grow, see counts_dtype
+COUNT_DTYPES = [np.uint16, np.uint32, np.uint64]
+LIVE_DTYPE = np.float32
+
 PROJECT_BG = (105, 180, 234)
 PROJECT_FG = (255, 193, 119)
 
+# heatmap file format, see module docstring
+MAGIC = b"PFHM"
+PREAMBLE = struct.Struct("<4sI")
+FORMAT_VERSION = 1
+PAYLOAD_ALIGN = 64
+
+SERIES_FORMAT = "pathfinder-heatmap-series"
+SERIES_VERSION = 2
+
+VERSION = "version"
+COUNT = "count"
+PERIOD = "period"
+PROJECT_PERIOD = "project_period"
+WATERMARK = "watermark"
+MANIFEST = "manifest"
+MANIFEST_HASH = "manifest_hash"
+ARRAYS = "arrays"
+TRAILING = "trailing"
+CELL = "cell"
+HALF_LIFE = "half_life"
+DECAYED_AT = "decayed_at"
+DTYPE = "dtype"
+SHAPE = "shape"
+OFFSET = "offset"
+KIND = "kind"
+TAKEN = "taken"
+SCALE = "scale"
+FORMAT = "format"
+INTERVAL = "interval"
+START = "start"
+HEATMAPS = "heatmaps"
+STORE = "store"
+CURRENT = "current"
+
+SERIES_STORE_DIRNAME = "store"
+CURRENT_HEATMAP_FILENAME = "current.heatmap"
+SERIES_COUNTS_DIR = "counts"
+SERIES_CUMULATIVE_DIR = "cumulative"
+SERIES_INTERVALS_DIR = "intervals"
+SERIES_STATES_DIR = "states"
+STATE_EXTENSION = ".state"
+SERIES_COUNT_DTYPE = np.uint32
+SERIES_CUMULATIVE_DTYPE = np.uint64
+
+# stands in for the ends of a NullTimePeriod in a SeriesStore
+NULL_TIMESTAMP = np.iinfo(np.int64).min
+
+POINTS_ARRAY = "points"
+TRAILING_ARRAY = "trailing_{}"
+
 
 ###############################################################################
 # Classes                                                                     #
@@ -122,88 +223,211 @@ class NullTimePeriod(object):
         return timedelta(seconds=0)
 
 
-class CoordRange(object):
-
-    def __init__(self, image_corners):
-        self._min_x = min(x for x, y in image_corners)
-        self._max_x = max(x for x, y in image_corners)
-        self._min_y = min(y for x, y in image_corners)
-        self._max_y = max(y for x, y in image_corners)
-
-    def contains(self, coord):
-        x, y = coord
-        return self._min_x <= x and x <= self._max_x and \
-            self._min_y <= y and y <= self._max_y
-
-    def coordinates(self):
-        for x in range(self._min_x, self._max_x + 1):
-            for y in range(self._min_y, self._max_y + 1):
-                yield (x, y)
-
-
 class Heatmap(object):
 
     @staticmethod
     def new(manifest):
-        width, height = manifest.dimensions()
-        points = np.zeros((height, width))
-        return Heatmap(manifest, points)
+        points = np.zeros(cell_grid_shape(manifest), dtype=COUNT_DTYPES[0])
+        return Heatmap(manifest, points, manifest.heatmap_cell())
 
     @staticmethod
     def load(filepath):
-        with open(filepath, 'rb') as f:
-            return pickle.load(f)
-
-    def __init__(self, manifest, points):
+        '''heatmap in filepath, arrays memory-mapped copy-on-write'''
+        header, payload_start = read_header(filepath)
+        if header is None:
+            return load_pickle(filepath)
+
+        manifest = Manifest(header[MANIFEST])
+        arrays = header[ARRAYS]
+
+        def array(name):
+            return read_array(filepath, payload_start, arrays[name])
+
+        cell = tuple(header.get(CELL, (1, 1)))
+        if HALF_LIFE in header:
+            hm = LiveHeatmap(manifest,
+                             array(POINTS_ARRAY),
+                             cell,
+                             header[HALF_LIFE])
+            hm.decayed_at = parse_optional_datetime(header[DECAYED_AT])
+        else:
+            hm = Heatmap(manifest, array(POINTS_ARRAY), cell)
+        hm.count = header[COUNT]
+        hm.period = parse_period(header[PERIOD])
+        hm.project_period = parse_period(header[PROJECT_PERIOD])
+        hm.watermark = parse_optional_datetime(header[WATERMARK])
+        hm._trailing = parse_trailing(manifest, header[TRAILING], array)
+        return hm
+
+    def __init__(self, manifest, points, cell=(1, 1)):
         super(Heatmap, self).__init__()
         self.manifest = manifest
         self.size = manifest.dimensions()
+        self.cell = cell
         self.geom = Geometry.from_manifest(manifest)
         self.field = CoordRange(manifest.image_corners())
         self.count = 0
-        self._points = points
-        self._rgb = np.zeros((points.shape[0], points.shape[1], 3))
+        self._points = self._counts_array(points)
         self.period = NullTimePeriod()
         self.project_period = NullTimePeriod()
+        self.watermark = None
+        self._trailing = []
+
+    def __setstate__(self, state):
+        # heatmaps saved before incremental recording
+        state.setdefault("watermark", None)
+        state.setdefault("_trailing", [])
+        state.setdefault("cell", (1, 1))
+        # and before compact counts
+        state.pop("_rgb", None)
+        state["_points"] = compact_counts(state["_points"])
+        # and before homographies
+        state["geom"] = Geometry.from_manifest(state["manifest"])
+        self.__dict__.update(state)
 
     def add(self, coord):
+        self._check_pixel_cells()
         self.count += 1
-        self.set(coord, self.at(coord) + 1)
+        self.set(coord, int(self.at(coord)) + 1)
+
+    def add_counts(self, counts, pixel_count=None):
+        '''add an array of per cell counts, shaped like the cell grid
+
+        pixel_count is how many pixel registrations the counts stand
+        for; it defaults to their sum, which is right for pixel cells.
+        '''
+        if not np.any(counts):
+            return
+        if pixel_count is None:
+            pixel_count = np.sum(counts)
+        self.count += int(pixel_count)
+        self._fit(int(np.max(self._points)) + int(np.max(counts)))
+        np.add(self._points, counts, out=self._points, casting='unsafe')
 
     def set(self, coord, val):
-        x, y = coord
-        self._points[y, x] = val
-        self._rgb[y, x, 0] = val
+        self._check_pixel_cells()
+        self._fit(val)
+        self._points[self._flip(coord)] = val
+
+    def _check_pixel_cells(self):
+        if self.cell != (1, 1):
+            msg = "Cannot set single pixels of a heatmap with {}x{} cells"\
+                .format(*self.cell)
+            raise ValueError(msg)
+
+    def _counts_array(self, points):
+        return compact_counts(points)
+
+    def _fit(self, max_count):
+        '''promote the counts' dtype if it cannot hold max_count'''
+        if not np.issubdtype(self._points.dtype, np.integer):
+            return
+        dtype = counts_dtype(max_count)
+        if np.dtype(dtype).itemsize > self._points.dtype.itemsize:
+            self._points = self._points.astype(dtype)
 
     def at(self, coord):
         return self._points[self._flip(coord)]
 
     def _flip(self, coord):
         x, y = coord
-        return y, x
+        cell_width, cell_height = self.cell
+        return y // cell_height, x // cell_width
+
+    def cell_shape(self):
+        return self._points.shape
+
+    def cell_counts(self):
+        return self._points
+
+    def pixel_counts(self):
+        '''counts at pixel resolution, upsampling cells (nearest)'''
+        if self.cell == (1, 1):
+            return self._points
+        return render.upsample(self._points, self.cell, self.size)
+
+    def version(self):
+        '''digest of the counts, which changes whenever they do'''
+        counts = np.ascontiguousarray(self._points)
+        digest = hashlib.sha1(str(counts.dtype).encode())
+        digest.update(counts.data)
+        return digest.hexdigest()
 
     def record(self,
                img_files,
                period,
                window_size=DEFAULT_WINDOW_SIZE,
-               color_thresh=DEFAULT_COLOR_THRESH):
+               color_thresh=DEFAULT_COLOR_THRESH,
+               catalog=None):
         data_type = image.ImageData.sub_type(img_files)
 
         images = image_obj_sequence(self.manifest,
                                     img_files,
-                                    period)
+                                    period,
+                                    catalog)
+
+        self.record_images(data_type, images, window_size, color_thresh)
+
+    def record_store(self,
+                     store,
+                     period,
+                     window_size=DEFAULT_WINDOW_SIZE,
+                     color_thresh=DEFAULT_COLOR_THRESH):
+        data_type = image.store_data_type(store)
+        images = data_type.sequence_from_store(self.manifest,
+                                               store,
+                                               period)
+        self.record_images(data_type,
+                           images,
+                           window_size,
+                           color_thresh)
+
+    def record_images(self,
+                      data_type,
+                      images,
+                      window_size=DEFAULT_WINDOW_SIZE,
+                      color_thresh=DEFAULT_COLOR_THRESH):
+
+        images = self._unconsumed(images, window_size)
 
         image_sets = windows(images, window_size)
+        value_sets = windows([img.values() for img in images], window_size)
+
+        for image_set, value_set in zip(image_sets, value_sets):
+            self.include_in_period(image_set)
+            self.decay_to(image_set[-1].time_taken())
+            mask = movement_mask(value_set, color_thresh)
+            image_set[0].register_mask(self, mask)
+
+        self._consume(images, window_size)
+
+    def _unconsumed(self, images, window_size):
+        '''images newer than the watermark, after the trailing frames
+
+        Windows made from the result are exactly the ones not yet
+        recorded. Images taken at or before the watermark have already
+        been consumed (or arrived too late) and are skipped.
+        '''
+        if self.watermark is not None:
+            images = [img for img in images
+                      if img.time_taken() > self.watermark]
+        if not images:
+            return []
+        return self._trailing[len(self._trailing) - window_size + 1:] + images
+
+    def _consume(self, images, window_size):
+        if not images:
+            return
+        self.watermark = images[-1].time_taken()
+        if window_size > 1:
+            self._trailing = [img.detached()
+                              for img in images[-(window_size - 1):]]
+        else:
+            self._trailing = []
 
-        for idx, image_set in enumerate(image_sets):
-
-            all_coordinates = data_type.coordinates(self.manifest,
-                                                    self.size)
-            for coord in all_coordinates:
-
-                self.include_in_period(image_set)
-                if is_movement(image_set, coord, color_thresh):
-                    image_set[0].register(self, coord)
+    def decay_to(self, dt):
+        '''age the counts to dt; counts of a Heatmap never age'''
+        pass
 
     def include_in_period(self, image_set):
         first_dt = image_set[0].time_taken()
@@ -218,22 +442,21 @@ class Heatmap(object):
         return self.project_period.end
 
     def points(self):
-        m = np.max(self._points)
+        counts = self.pixel_counts()
+        m = np.max(counts)
         if m == 0:
-            return self._points
+            return counts
         else:
-            return self._points / m
+            return counts / m
 
     def project_point(self, coord, scale):
-        logger.debug("projecting coord {} at size {}".format(coord, self.size))
-        raw = mapping.image_to_blueprint(coord,
-                                         self.geom,
-                                         self.size)
-
-        projected = tuple(int(round(x * scale)) for x in raw)
-        return projected
+        return projection.project_point(coord, self.geom, self.size, scale)
 
-    def project(self, filepath, desired_width, moment=None):
+    def project(self,
+                filepath,
+                desired_width,
+                moment=None,
+                method=projection.SPLAT):
 
         self.project_period = \
             self.project_period\
@@ -241,28 +464,10 @@ class Heatmap(object):
 
         logger.debug("Project: filepath = {}".format(filepath))
 
-        image_corners = self.manifest.image_corners()
-        lower_right = image_corners[3]
-        b_x, b_y = self.project_point(lower_right, 1)
-
-        scale = desired_width / b_x
-        new_size = (int(b_y * scale), int(b_x * scale))
-        blueprint_values = np.zeros(new_size)
-
-        logger.debug("Project: new size = {}".format)
-
-        def valid_coord(coord, shape):
-            return all(c >= 0 and c < s
-                       for c, s in zip(coord, shape))
+        table = projection.table(self.manifest, desired_width, method)
+        logger.debug("Project: new size = {}".format(table.shape))
 
-        for x, y in self.field.coordinates():
-
-            val = self.at((x, y))
-
-            p_x, p_y = self.project_point((x, y), scale)
-
-            if valid_coord((p_y, p_x), blueprint_values.shape):
-                blueprint_values[p_y, p_x] += val
+        blueprint_values = table.render(self.at)
 
         maximum = np.max(blueprint_values)
         div = maximum if maximum else 1
@@ -270,38 +475,57 @@ class Heatmap(object):
         self.write_project_binary(normalized, filepath)
 
     def overlay(self, img, filepath, scale, blur):
-
-        maximum = np.max(self._rgb)
-        div = maximum if maximum else 1
-        points = self._rgb / div
-
-        # scale redshift by specified degree
-        scaled_points = points * scale
-
-        # convert to Image for blurring
-        red_points_8bit = scaled_points.astype('uint8')
-        red_img = Image.fromarray(red_points_8bit)
-        filtered_red_img = red_img.filter(ImageFilter.GaussianBlur(blur))
-
-        # convert backto float64 numpy arrays
-        # numpy arrays: so we can add
-        # float64: to avoid 8bit overflow
-        red_points = np.asarray(filtered_red_img, dtype='float64')
-        img_points = np.asarray(img, dtype='float64')
-
-        combined_points = img_points + red_points
-
-        # must clip red values outside of range
-        # these might occur because of the redshifting
-        clipped_points = np.clip(combined_points, 0, 255)
-        clipped_points_8bit = clipped_points.astype('uint8')
-
-        overlaid = Image.fromarray(clipped_points_8bit)
-        overlaid.save(filepath)
+        img_points = np.asarray(img.convert("RGB"))
+        overlaid = render.shared_renderer().overlay(self,
+                                                    img_points,
+                                                    scale,
+                                                    blur)
+        output.save(Image.fromarray(overlaid), filepath)
 
     def save(self, filepath):
-        with open(filepath, 'wb') as f:
-            pickle.dump(self, f)
+        trailing, arrays = unparse_trailing(self._trailing)
+        arrays[POINTS_ARRAY] = self._points
+
+        header = {
+            COUNT: self.count,
+            PERIOD: unparse_period(self.period),
+            PROJECT_PERIOD: unparse_period(self.project_period),
+            WATERMARK: unparse_optional_datetime(self.watermark),
+            MANIFEST: self.manifest.json,
+            MANIFEST_HASH: manifest_hash(self.manifest),
+            CELL: list(self.cell),
+            TRAILING: trailing
+        }
+        header.update(self._extra_header())
+        write_heatmap_file(filepath, header, arrays)
+
+    def _extra_header(self):
+        return {}
+
+    def save_state(self, filepath):
+        '''save only what recording resumes from, see load_state
+
+        That is the watermark and the trailing frames, in the heatmap
+        file format.
+        '''
+        trailing, arrays = unparse_trailing(self._trailing)
+        header = {
+            WATERMARK: unparse_optional_datetime(self.watermark),
+            TRAILING: trailing
+        }
+        write_heatmap_file(filepath, header, arrays)
+
+    def load_state(self, filepath):
+        '''resume recording from a file written by save_state'''
+        header, payload_start = read_header(filepath)
+
+        def array(name):
+            return read_array(filepath, payload_start, header[ARRAYS][name])
+
+        self.watermark = parse_optional_datetime(header[WATERMARK])
+        self._trailing = parse_trailing(self.manifest,
+                                        header[TRAILING],
+                                        array)
 
     def write(self, filepath):
         self.write_bw_binary(self.points(), filepath)
@@ -311,7 +535,7 @@ class Heatmap(object):
         write_points = arr * 255
         uint_points = write_points.astype('uint8')
         im = Image.fromarray(uint_points, 'L')
-        im.save(filepath)
+        output.save(im, filepath)
 
     @staticmethod
     def write_project_binary(arr, filepath):
@@ -321,9 +545,8 @@ class Heatmap(object):
         rgb_im = ImageOps.colorize(im,
                                    PROJECT_BG,
                                    PROJECT_FG)
-        rgb_im.save(filepath)
         filter_im = rgb_im.filter(ImageFilter.GaussianBlur(10))
-        filter_im.save(filepath)
+        output.save(filter_im, filepath)
 
     def __str__(self):
         attrs = [self.size[0],
@@ -336,6 +559,232 @@ class Heatmap(object):
         return string
 
 
+class LiveHeatmap(Heatmap):
+    """Heatmap of recent activity, see the module docstring"""
+
+    @staticmethod
+    def new(manifest, half_life):
+        points = np.zeros(cell_grid_shape(manifest), dtype=LIVE_DTYPE)
+        return LiveHeatmap(manifest,
+                           points,
+                           manifest.heatmap_cell(),
+                           half_life)
+
+    def __init__(self, manifest, points, cell=(1, 1), half_life=60):
+        if half_life <= 0:
+            raise ValueError("half_life must be positive")
+        self.half_life = half_life
+        self.decayed_at = None
+        super().__init__(manifest, points, cell)
+
+    def _counts_array(self, points):
+        return np.asarray(points).astype(LIVE_DTYPE, copy=False)
+
+    def decay_to(self, dt):
+        '''halve the counts for every half_life seconds since decayed_at'''
+        if self.decayed_at is not None and dt > self.decayed_at:
+            elapsed = (dt - self.decayed_at).total_seconds()
+            factor = 0.5 ** (elapsed / self.half_life)
+            np.multiply(self._points, LIVE_DTYPE(factor), out=self._points)
+        if self.decayed_at is None or dt > self.decayed_at:
+            self.decayed_at = dt
+
+    def _extra_header(self):
+        return {
+            HALF_LIFE: self.half_life,
+            DECAYED_AT: unparse_optional_datetime(self.decayed_at)
+        }
+
+
+class HeatmapHeader(object):
+    """what a heatmap file says about itself, read without its arrays"""
+
+    @staticmethod
+    def load(filepath):
+        header, _ = read_header(filepath)
+        if header is None:
+            return HeatmapHeader.of(load_pickle(filepath))
+        return HeatmapHeader(header[COUNT],
+                             parse_period(header[PERIOD]),
+                             parse_period(header[PROJECT_PERIOD]),
+                             parse_optional_datetime(header[WATERMARK]),
+                             header[MANIFEST_HASH])
+
+    @staticmethod
+    def of(hm):
+        return HeatmapHeader(hm.count,
+                             hm.period,
+                             hm.project_period,
+                             hm.watermark,
+                             manifest_hash(hm.manifest))
+
+    def __init__(self, count, period, project_period, watermark,
+                 manifest_hash):
+        super().__init__()
+        self.count = count
+        self.period = period
+        self.project_period = project_period
+        self.watermark = watermark
+        self.manifest_hash = manifest_hash
+
+    def last_update(self):
+        return self.period.end
+
+    def last_project(self):
+        return self.project_period.end
+
+
+class SeriesStore(object):
+    """Every interval of a heatmap series, see the module docstring"""
+
+    @staticmethod
+    def open_or_new(dirpath, cell_shape):
+        counts = FrameStore.open_or_new(
+            os.path.join(dirpath, SERIES_COUNTS_DIR),
+            cell_shape,
+            SERIES_COUNT_DTYPE)
+        cumulative = FrameStore.open_or_new(
+            os.path.join(dirpath, SERIES_CUMULATIVE_DIR),
+            cell_shape,
+            SERIES_CUMULATIVE_DTYPE)
+        intervals = FrameStore.open_or_new(
+            os.path.join(dirpath, SERIES_INTERVALS_DIR),
+            (3,),
+            np.int64)
+        store = SeriesStore(dirpath, counts, cumulative, intervals)
+        store._fill_cumulative()
+        return store
+
+    def __init__(self, dirpath, counts, cumulative, intervals):
+        super().__init__()
+        self.dirpath = dirpath
+        self._counts = counts
+        self._cumulative = cumulative
+        self._intervals = intervals
+
+    def __len__(self):
+        return min(len(store) for store in self._stores())
+
+    def _stores(self):
+        return [self._intervals, self._counts, self._cumulative]
+
+    def _fill_cumulative(self):
+        '''add running sums missing from stores written without them'''
+        num_intervals = min(len(self._counts), len(self._intervals))
+        timestamps = self._counts.timestamps()
+        for idx in range(len(self._cumulative), num_intervals):
+            self._cumulative.append(from_timestamp(timestamps[idx]),
+                                    self._running_sum(idx,
+                                                      self.counts(idx)))
+
+    def _running_sum(self, idx, counts):
+        counts = np.asarray(counts, dtype=SERIES_CUMULATIVE_DTYPE)
+        if not idx:
+            return counts
+        return self._cumulative.frame(idx - 1) + counts
+
+    def starts(self):
+        return [from_timestamp(ts)
+                for ts in self._counts.timestamps()[:len(self)]]
+
+    def append(self, start, counts, count, period):
+        '''add an interval, returning its index'''
+        idx = len(self)
+        check_series_counts(counts)
+        # drop rows an interrupted append left in some of the stores
+        for store in self._stores():
+            store.truncate(idx)
+        self._intervals.append(start, interval_row(count, period))
+        self._counts.append(start, counts)
+        self._cumulative.append(start, self._running_sum(idx, counts))
+        return idx
+
+    def write(self, idx, counts, count, period):
+        '''replace an interval, updating the running sums after it'''
+        check_series_counts(counts)
+        delta = np.asarray(counts, dtype=np.int64) - \
+            np.asarray(self.counts(idx), dtype=np.int64)
+        self._counts.write(idx, counts)
+        self._intervals.write(idx, interval_row(count, period))
+        if not np.any(delta):
+            return
+        for later in range(idx, len(self)):
+            summed = self._cumulative.frame(later).astype(np.int64) + delta
+            self._cumulative.write(later, summed)
+
+    def _state_filepath(self, idx):
+        start = to_timestamp(self._counts.time_taken(idx))
+        return os.path.join(self.dirpath,
+                            SERIES_STATES_DIR,
+                            str(start) + STATE_EXTENSION)
+
+    def save_state(self, idx, hm):
+        '''keep what recording the interval at idx resumes from'''
+        filepath = self._state_filepath(idx)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        hm.save_state(filepath)
+
+    def load_state(self, idx, hm):
+        '''resume hm from the interval's saved state, if it has one'''
+        filepath = self._state_filepath(idx)
+        if os.path.isfile(filepath):
+            hm.load_state(filepath)
+
+    def counts(self, idx):
+        '''counts of one interval, memory-mapped'''
+        return self._counts.frame(idx)
+
+    def count(self, idx):
+        return int(self._intervals.frame(idx)[0])
+
+    def period(self, idx):
+        _, start, end = self._intervals.frame(idx)
+        return parse_period_timestamps(start, end)
+
+    def all_intervals(self):
+        '''(count, period) of every interval, read in one go'''
+        rows = np.array(self._intervals.frames()[:len(self)])
+        return [(int(count), parse_period_timestamps(start, end))
+                for count, start, end in rows]
+
+    def range_indices(self, start, end):
+        '''indices of the intervals starting in [start, end)'''
+        starts = self._counts.timestamps()[:len(self)]
+        inside = (starts >= to_timestamp(start)) & \
+            (starts < to_timestamp(end))
+        return np.flatnonzero(inside)
+
+    def range_counts(self, start, end):
+        '''summed counts, count and period of the intervals in a range
+
+        Intervals are appended in time order, so a range is normally
+        a run of them and costs two reads of the running sums. Runs
+        broken by late intervals are summed interval by interval.
+        '''
+        idxs = self.range_indices(start, end)
+        if not len(idxs):
+            counts = np.zeros(self._counts.frame_shape,
+                              dtype=SERIES_CUMULATIVE_DTYPE)
+        elif idxs[-1] - idxs[0] + 1 == len(idxs):
+            counts = np.array(self._cumulative.frame(idxs[-1]))
+            if idxs[0]:
+                counts -= self._cumulative.frame(idxs[0] - 1)
+        else:
+            counts = np.sum(self._counts.frames()[idxs],
+                            axis=0,
+                            dtype=SERIES_CUMULATIVE_DTYPE)
+
+        rows = np.array(self._intervals.frames()[idxs])
+        count = int(np.sum(rows[:, 0])) if len(rows) else 0
+        period = None
+        for _, period_start, period_end in rows:
+            if period_start != NULL_TIMESTAMP:
+                interval_period = parse_period_timestamps(period_start,
+                                                          period_end)
+                period = TimePeriod.union(interval_period, period)
+        return counts, count, period if period else NullTimePeriod()
+
+
 class HeatmapSeries(object):
 
     @staticmethod
@@ -345,11 +794,36 @@ class HeatmapSeries(object):
     @staticmethod
     def load(filepath):
         with open(filepath, 'rb') as f:
-            return pickle.load(f)
+            is_json = f.read(1) == b"{"
+        if not is_json:
+            series = load_pickle(filepath)
+            series.import_heatmaps()
+            return series
+
+        with open(filepath) as f:
+            series_json = json.load(f)
+        series = HeatmapSeries(Manifest(series_json[MANIFEST]),
+                               timedelta(seconds=series_json[INTERVAL]),
+                               image.parse_datetime(series_json[START]))
+        series.store_dirpath = series_json.get(STORE)
+        series.current = parse_optional_datetime(series_json.get(CURRENT))
+        series.heatmaps = {image.parse_datetime(dt_str): fp
+                           for dt_str, fp in series_json.get(HEATMAPS, [])}
+        series.import_heatmaps()
+        return series
 
     def save(self, filepath):
-        with open(filepath, 'wb') as f:
-            pickle.dump(self, f)
+        series_json = {
+            FORMAT: SERIES_FORMAT,
+            VERSION: SERIES_VERSION,
+            MANIFEST: self.manifest.json,
+            INTERVAL: self.interval.total_seconds(),
+            START: image.unparse_datetime(self.start),
+            STORE: self.store_dirpath,
+            CURRENT: unparse_optional_datetime(self.current)
+        }
+        with open(filepath, 'w') as f:
+            json.dump(series_json, f, indent=2)
 
     def __init__(self, manifest, interval, start):
         super().__init__()
@@ -357,10 +831,96 @@ class HeatmapSeries(object):
         self.interval = interval
         self.start = start
 
+        self.store_dirpath = None
+        self.current = None
+        self._store = None
+
+        # subheatmap files of older series, see import_heatmaps
         self.heatmaps = {}
 
+    def __setstate__(self, state):
+        state.setdefault("store_dirpath", None)
+        state.setdefault("current", None)
+        state.setdefault("_store", None)
+        self.__dict__.update(state)
+
+    def store(self, series_dir=None):
+        '''the SeriesStore, created in series_dir if there is none yet'''
+        if self._store is not None:
+            return self._store
+        if self.store_dirpath is None:
+            if series_dir is None:
+                return None
+            self.store_dirpath = os.path.join(series_dir,
+                                              SERIES_STORE_DIRNAME)
+        self._store = SeriesStore.open_or_new(self.store_dirpath,
+                                              cell_grid_shape(self.manifest))
+        return self._store
+
+    def import_heatmaps(self):
+        '''move the intervals of a series of heatmap files into a store'''
+        if not self.heatmaps:
+            return
+        first_fp = sorted(self.heatmaps.items())[0][1]
+        store = self.store(os.path.dirname(first_fp))
+        # a store already filled by an earlier import is kept as it is
+        if not len(store):
+            for start, fp in sorted(self.heatmaps.items()):
+                hm = Heatmap.load(fp)
+                idx = store.append(start,
+                                   hm.cell_counts(),
+                                   hm.count,
+                                   hm.period)
+                store.save_state(idx, hm)
+        self.heatmaps = {}
+
+    def __len__(self):
+        store = self.store()
+        return len(store) if store is not None else 0
+
+    def starts(self):
+        store = self.store()
+        return store.starts() if store is not None else []
+
+    def index(self, start):
+        starts = self.starts()
+        return starts.index(start) if start in starts else None
+
+    def subheatmap(self, idx):
+        '''heatmap of one interval, reading only that interval'''
+        store = self.store()
+        hm = Heatmap(self.manifest,
+                     np.array(store.counts(idx)),
+                     self.manifest.heatmap_cell())
+        hm.count = store.count(idx)
+        hm.period = store.period(idx)
+        store.load_state(idx, hm)
+        return hm
+
     def subheatmaps(self):
-        return [Heatmap.load(x) for x in self.heatmaps.values()]
+        return [self.subheatmap(idx) for idx in range(len(self))]
+
+    def range_heatmap(self, start, end):
+        '''heatmap of the intervals starting in [start, end)
+
+        Built from the store's running sums, without reading frames.
+        '''
+        store = self.store()
+        if store is None:
+            return Heatmap.new(self.manifest)
+        counts, count, period = store.range_counts(start, end)
+        hm = Heatmap(self.manifest, counts, self.manifest.heatmap_cell())
+        hm.count = count
+        hm.period = period
+        return hm
+
+    def subheatmap_headers(self):
+        store = self.store()
+        if store is None:
+            return []
+        hashed = manifest_hash(self.manifest)
+        return [HeatmapHeader(count, period, NullTimePeriod(), None, hashed)
+                for count, period in store.all_intervals()]
 
     def sequence_start(self, dt):
         incoming = dt.replace(microsecond=0,
@@ -371,16 +931,21 @@ class HeatmapSeries(object):
         record_start = self.start + (num_cycles * self.interval)
         return record_start
 
-    def _make_subheatmap(self, record_start, series_dir):
-        heatmap = Heatmap.new(self.manifest)
-        heatmap.period = heatmap.period.expand_to_include(record_start)
-        datetimestamp = image.unparse_datetime(record_start)
-        fmted_dtstamp = datetimestamp.replace(":", "-")
-        fmted_dtstamp = fmted_dtstamp.replace(" ", "_")
-        heatmap_filename = "{}.heatmap".format(fmted_dtstamp)
-        fp = os.path.join(series_dir, heatmap_filename)
-        heatmap.save(fp)
-        self.heatmaps[record_start] = fp
+    def _start_subheatmap(self, record_start, series_dir):
+        '''make the interval at record_start the one being recorded'''
+        store = self.store(series_dir)
+        idx = self.index(record_start)
+        if idx is None:
+            heatmap = Heatmap.new(self.manifest)
+            heatmap.period = heatmap.period.expand_to_include(record_start)
+            store.append(record_start,
+                         heatmap.cell_counts(),
+                         heatmap.count,
+                         heatmap.period)
+        else:
+            heatmap = self.subheatmap(idx)
+        heatmap.save(os.path.join(series_dir, CURRENT_HEATMAP_FILENAME))
+        self.current = record_start
 
     def select_subheatmap(self,
                           series_dir,
@@ -393,13 +958,21 @@ class HeatmapSeries(object):
         # belongs in
         record_start = self.sequence_start(dt)
 
-        # make sure this interval has a heatmap
-        if record_start not in self.heatmaps:
-            self._make_subheatmap(record_start, series_dir)
+        # make sure this interval is the one being recorded
+        heatmap_fp = os.path.join(series_dir, CURRENT_HEATMAP_FILENAME)
+        if record_start != self.current or not os.path.isfile(heatmap_fp):
+            self._start_subheatmap(record_start, series_dir)
 
-        heatmap_fp = self.heatmaps[record_start]
         return heatmap_fp
 
+    def store_subheatmap(self, heatmap_filepath):
+        '''copy the interval being recorded into the store'''
+        hm = Heatmap.load(heatmap_filepath)
+        idx = self.index(self.current)
+        store = self.store()
+        store.write(idx, hm.cell_counts(), hm.count, hm.period)
+        store.save_state(idx, hm)
+
 
 ###############################################################################
 # Heatmap Tools                                                               #
@@ -410,16 +983,38 @@ def new_heatmap(heatmap_filepath, manifest):
     hm.save(heatmap_filepath)
 
 
+def new_live_heatmap(heatmap_filepath, manifest, half_life):
+    hm = LiveHeatmap.new(manifest, half_life)
+    hm.save(heatmap_filepath)
+
+
 def record_heatmap(heatmap_filepath,
                    img_files,
                    period,
                    window_size=DEFAULT_WINDOW_SIZE,
-                   color_thresh=DEFAULT_COLOR_THRESH):
+                   color_thresh=DEFAULT_COLOR_THRESH,
+                   catalog_filepath=None):
     hm = Heatmap.load(heatmap_filepath)
+    catalog = FrameCatalog.load(catalog_filepath) if catalog_filepath else None
     hm.record(img_files,
               period,
               window_size,
-              color_thresh)
+              color_thresh,
+              catalog)
+    hm.save(heatmap_filepath)
+
+
+def record_heatmap_store(heatmap_filepath,
+                         store_dirpath,
+                         period,
+                         window_size=DEFAULT_WINDOW_SIZE,
+                         color_thresh=DEFAULT_COLOR_THRESH):
+    hm = Heatmap.load(heatmap_filepath)
+    store = FrameStore.load(store_dirpath)
+    hm.record_store(store,
+                    period,
+                    window_size,
+                    color_thresh)
     hm.save(heatmap_filepath)
 
 
@@ -432,11 +1027,13 @@ def view_heatmap(heatmap_filepath,
 def project_heatmap(heatmap_filepath,
                     project_filepath,
                     desired_width,
-                    moment=None):
+                    moment=None,
+                    method=projection.SPLAT):
     heatmap = Heatmap.load(heatmap_filepath)
     heatmap.project(project_filepath,
                     desired_width,
-                    moment)
+                    moment,
+                    method)
     heatmap.save(heatmap_filepath)
 
 
@@ -446,8 +1043,7 @@ def overlay_heatmap(heatmap_filepath,
                     scale,
                     blur):
     hm = Heatmap.load(heatmap_filepath)
-    img = Image.open(image_filepath)
-    hm.overlay(img, output_filepath, scale, blur)
+    render.overlay(hm, image_filepath, output_filepath, scale, blur)
 
 
 def new_series_heatmap(series_heatmap_filepath,
@@ -467,11 +1063,37 @@ def series_subheatmap(series_filepath,
     return subheatmap_fp
 
 
+def store_series_subheatmap(series_filepath, subheatmap_filepath):
+    series = HeatmapSeries.load(series_filepath)
+    series.store_subheatmap(subheatmap_filepath)
+
+
+def range_heatmap(series_filepath,
+                  start,
+                  end,
+                  output_filepath=None,
+                  heatmap_filepath=None):
+    '''heatmap of a series between start and end
+
+    Covers the intervals starting in [start, end). Optionally renders
+    it like view_heatmap and saves it as a heatmap file.
+    '''
+    series = HeatmapSeries.load(series_filepath)
+    hm = series.range_heatmap(start, end)
+    if output_filepath:
+        hm.write(output_filepath)
+    if heatmap_filepath:
+        hm.save(heatmap_filepath)
+    return hm
+
+
 ###############################################################################
 # Helpers                                                                     #
 ###############################################################################
 
-def image_obj_sequence(manifest, img_files, period):
+def image_obj_sequence(manifest, img_files, period, catalog=None):
+    if catalog is not None:
+        img_files = catalog.trim(img_files, period)
     images = [image.ImageData.create(manifest, fp)
               for fp in img_files]
     images = trim_by_date(images, period)
@@ -513,6 +1135,214 @@ def is_movement(images, coord,
     return spread > color_thresh
 
 
+def movement_mask(value_set, color_thresh=DEFAULT_COLOR_THRESH):
+    '''is_movement at every coordinate of a window at once
+
+    value_set holds each image's values(); the spread is taken over
+    the window and any per coordinate channels, as np.ptp does.
+    '''
+    high = functools.reduce(np.maximum, value_set)
+    low = functools.reduce(np.minimum, value_set)
+    channel_axes = tuple(range(2, np.ndim(high)))
+    if channel_axes:
+        high = np.max(high, axis=channel_axes)
+        low = np.min(low, axis=channel_axes)
+    spread = np.subtract(high, low, dtype=np.float64)
+    return spread > color_thresh
+
+
+def counts_dtype(max_count):
+    '''smallest of COUNT_DTYPES that holds max_count'''
+    for dtype in COUNT_DTYPES:
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    raise OverflowError("Heatmap count {} is too large".format(max_count))
+
+
+def check_series_counts(counts):
+    '''make sure an interval's counts fit SERIES_COUNT_DTYPE unwrapped'''
+    max_count = int(np.max(counts)) if np.size(counts) else 0
+    if max_count > np.iinfo(SERIES_COUNT_DTYPE).max:
+        msg = "Series interval count {} is too large".format(max_count)
+        raise OverflowError(msg)
+
+
+def compact_counts(points):
+    '''counts in an integer dtype; float64 counts came from older heatmaps'''
+    if np.issubdtype(points.dtype, np.integer):
+        return points
+    max_count = int(np.max(points)) if points.size else 0
+    return np.rint(points).astype(counts_dtype(max_count))
+
+
+###############################################################################
+# File format                                                                 #
+###############################################################################
+
+class LegacyUnpickler(pickle.Unpickler):
+    """unpickler for heatmaps and series saved before the file format
+
+    Objects pickled while heatmap.py ran as a script were saved under
+    __main__, so those classes are looked up in this module instead.
+    """
+
+    def find_class(self, module, name):
+        if module == "__main__":
+            return getattr(sys.modules[__name__], name)
+        return super().find_class(module, name)
+
+
+def load_pickle(filepath):
+    logger.info("Migrating pickled heatmap file {}".format(filepath))
+    with open(filepath, 'rb') as f:
+        return LegacyUnpickler(f).load()
+
+
+def aligned(nbytes):
+    return -(-nbytes // PAYLOAD_ALIGN) * PAYLOAD_ALIGN
+
+
+def write_heatmap_file(filepath, header, arrays):
+    '''write header and arrays in the heatmap file format
+
+    The file is written next to filepath and renamed over it, so
+    readers (and memory maps of the old file) never see a partial
+    write.
+    '''
+    arrays = {name: np.ascontiguousarray(arr)
+              for name, arr in arrays.items()}
+    table = {}
+    offset = 0
+    for name, arr in arrays.items():
+        table[name] = {
+            DTYPE: arr.dtype.str,
+            SHAPE: list(arr.shape),
+            OFFSET: offset
+        }
+        offset = aligned(offset + arr.nbytes)
+
+    header = dict(header, **{VERSION: FORMAT_VERSION, ARRAYS: table})
+    header_bytes = json.dumps(header).encode()
+    padding = aligned(PREAMBLE.size + len(header_bytes)) \
+        - PREAMBLE.size - len(header_bytes)
+    header_bytes += b" " * padding
+    payload_start = PREAMBLE.size + len(header_bytes)
+
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(payload_start + table[name][OFFSET])
+            f.write(arr.tobytes())
+    os.replace(tmp_filepath, filepath)
+
+
+def read_header(filepath):
+    '''(header, payload start) of a heatmap file, (None, None) if pickled'''
+    with open(filepath, 'rb') as f:
+        preamble = f.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size or preamble[:4] != MAGIC:
+            return None, None
+        _, header_length = PREAMBLE.unpack(preamble)
+        header = json.loads(f.read(header_length).decode())
+
+    if header[VERSION] > FORMAT_VERSION:
+        msg = "Heatmap file {} has format version {}, newer than {}"\
+            .format(filepath, header[VERSION], FORMAT_VERSION)
+        raise ValueError(msg)
+    return header, PREAMBLE.size + header_length
+
+
+def read_array(filepath, payload_start, entry, mode='c'):
+    dtype = np.dtype(entry[DTYPE])
+    shape = tuple(entry[SHAPE])
+    if not np.prod(shape):
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filepath,
+                     dtype=dtype,
+                     mode=mode,
+                     offset=payload_start + entry[OFFSET],
+                     shape=shape)
+
+
+def unparse_trailing(trailing):
+    '''header entries and arrays of a heatmap's trailing frames'''
+    entries = []
+    arrays = {}
+    for idx, img in enumerate(trailing):
+        kind, values, scale = image.image_state(img)
+        name = TRAILING_ARRAY.format(idx)
+        arrays[name] = values
+        entries.append({
+            KIND: kind,
+            ARRAYS: name,
+            TAKEN: image.unparse_datetime(img.time_taken()),
+            SCALE: scale
+        })
+    return entries, arrays
+
+
+def parse_trailing(manifest, entries, array):
+    '''trailing frames from their header entries, array(name) reads one'''
+    return [image.from_state(manifest,
+                             entry[KIND],
+                             array(entry[ARRAYS]),
+                             image.parse_datetime(entry[TAKEN]),
+                             entry[SCALE])
+            for entry in entries]
+
+
+def manifest_hash(manifest):
+    manifest_str = json.dumps(manifest.json, sort_keys=True)
+    return hashlib.sha1(manifest_str.encode()).hexdigest()
+
+
+def unparse_period(period):
+    if isinstance(period, NullTimePeriod):
+        return None
+    return [image.unparse_datetime(period.start),
+            image.unparse_datetime(period.end)]
+
+
+def parse_period(period_json):
+    if period_json is None:
+        return NullTimePeriod()
+    start, end = period_json
+    return TimePeriod(image.parse_datetime(start),
+                      image.parse_datetime(end))
+
+
+def unparse_optional_datetime(dt):
+    return image.unparse_datetime(dt) if dt is not None else None
+
+
+def parse_optional_datetime(s):
+    return image.parse_datetime(s) if s is not None else None
+
+
+def cell_grid_shape(manifest):
+    '''(rows, columns) of the cells of a heatmap for manifest'''
+    width, height = manifest.dimensions()
+    cell_width, cell_height = manifest.heatmap_cell()
+    return -(-height // cell_height), -(-width // cell_width)
+
+
+def interval_row(count, period):
+    '''[count, period start, period end] row of a SeriesStore'''
+    if isinstance(period, NullTimePeriod):
+        return np.array([count, NULL_TIMESTAMP, NULL_TIMESTAMP], np.int64)
+    return np.array([count,
+                     to_timestamp(period.start),
+                     to_timestamp(period.end)], np.int64)
+
+
+def parse_period_timestamps(start, end):
+    if start == NULL_TIMESTAMP:
+        return NullTimePeriod()
+    return TimePeriod(from_timestamp(start), from_timestamp(end))
+
+
 ###############################################################################
 # Logging                                                                     #
 ###############################################################################
@@ -577,6 +1407,26 @@ def get_args():
     record_parser.add_argument("images",
                                nargs="+",
                                help="Image files")
+    record_parser.add_argument("--catalog",
+                               help="frame catalog to skip images with")
+
+    record_store_parser = subparsers.add_parser("record_heatmap_store",
+                                                help="record frame store")
+    record_store_parser.add_argument("heatmap_filepath",
+                                     help="file containing heatmap")
+    record_store_parser.add_argument("store_dirpath",
+                                     help="directory of chunk/frame store")
+    record_store_parser.add_argument("period",
+                                     help="time period to record",
+                                     nargs=2,
+                                     type=parse_time,
+                                     action=MakeTimePeriodAction)
+    record_store_parser.add_argument("window_size",
+                                     help="size of sliding window",
+                                     type=int)
+    record_store_parser.add_argument("color_thresh",
+                                     help="RGB magnitude of color difference",
+                                     type=int)
 
     view_heatmap = subparsers.add_parser("view_heatmap",
                                          help="see heatmap img")
@@ -594,6 +1444,12 @@ def get_args():
     project_parser.add_argument("desired_width",
                                 type=int,
                                 help="intended projection pixed width")
+    project_parser.add_argument("--method",
+                                choices=sorted(projection.TABLE_TYPES),
+                                default=projection.SPLAT,
+                                help="splat image pixels onto the "
+                                "blueprint, or sample the image "
+                                "bilinearly at each blueprint pixel")
 
     overlay_parser = subparsers.add_parser("overlay_heatmap",
                                            help="overlay heatmap")
@@ -623,6 +1479,22 @@ def get_args():
                                            type=parse_time,
                                            help="starting point")
 
+    range_parser = subparsers.add_parser("range_heatmap",
+                                         help="heatmap of a series' "
+                                         "intervals within a period")
+    range_parser.add_argument("series_heatmap_filepath",
+                              help="file containing series")
+    range_parser.add_argument("period",
+                              help="intervals starting in [start, end)",
+                              nargs=2,
+                              type=parse_time,
+                              action=MakeTimePeriodAction)
+    range_parser.add_argument("output_filepath",
+                              help="file to contain heatmap img")
+    range_parser.add_argument("--heatmap",
+                              dest="heatmap_filepath",
+                              help="also save the range as a heatmap")
+
     return parser.parse_args()
 
 
@@ -645,7 +1517,15 @@ def main():
                        args.images,
                        args.period,
                        args.window_size,
-                       args.color_thresh)
+                       args.color_thresh,
+                       args.catalog)
+
+    elif args.op == "record_heatmap_store":
+        record_heatmap_store(args.heatmap_filepath,
+                             args.store_dirpath,
+                             args.period,
+                             args.window_size,
+                             args.color_thresh)
 
     elif args.op == "view_heatmap":
         view_heatmap(args.heatmap_filepath,
@@ -654,7 +1534,8 @@ def main():
     elif args.op == "project_heatmap":
         project_heatmap(args.heatmap_filepath,
                         args.project_filepath,
-                        args.desired_width)
+                        args.desired_width,
+                        method=args.method)
 
     elif args.op == "overlay_heatmap":
         overlay_heatmap(args.heatmap_filepath,
@@ -669,6 +1550,13 @@ def main():
                            args.interval,
                            args.start)
 
+    elif args.op == "range_heatmap":
+        range_heatmap(args.series_heatmap_filepath,
+                      args.period.start,
+                      args.period.end,
+                      args.output_filepath,
+                      args.heatmap_filepath)
+
 
 if __name__ == '__main__':
     main()
@@ -18,11 +18,15 @@ images.
 
 import os
 import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+import numpy as np
 from PIL import Image
 
-from chunk import PixelChunk
+from chunk import PixelChunk, draft_image
+from store import from_timestamp
 
 ###############################################################################
 # Constants                                                                   #
@@ -31,6 +35,17 @@ from chunk import PixelChunk
 DATETIME_FMT = "%Y:%m:%d %H:%M:%S"
 DATETIME_EXIF = 36867
 
+STORE_LEVEL_ATTRS = ["chunk_width", "chunk_height", "stride_x", "stride_y"]
+
+BYTES_PER_MEGABYTE = 1024 * 1024
+DEFAULT_CACHE_BYTES = 512 * BYTES_PER_MEGABYTE
+
+CHUNK_KIND = "chunks"
+FRAME_KIND = "frames"
+
+# cache shared by ImageData.create, see cached()
+_cache = None
+
 
 ###############################################################################
 # Classes                                                                     #
@@ -58,16 +73,37 @@ class ImageData(object):
 
     @staticmethod
     def create(manifest, filepath):
+        if _cache is not None:
+            return _cache.get(manifest, filepath)
+        return ImageData.create_uncached(manifest, filepath)
+
+    @staticmethod
+    def create_uncached(manifest, filepath):
         sub_type = ImageData.sub_type([filepath])
         return sub_type.create(manifest, filepath)
 
     def time_taken(self):
         raise NotImplementedError("Implement in subclass")
 
+    def nbytes(self):
+        raise NotImplementedError("Implement in subclass")
+
     @staticmethod
     def register(self, heatmap, coord):
         raise NotImplementedError("Implement in subclass")
 
+    def values(self):
+        '''array of the values at() returns, one per coordinate'''
+        raise NotImplementedError("Implement in subclass")
+
+    def register_mask(self, heatmap, mask):
+        '''register every coordinate where mask (shaped like values) is set'''
+        raise NotImplementedError("Implement in subclass")
+
+    def detached(self):
+        '''copy that holds its own data, safe to keep and pickle'''
+        raise NotImplementedError("Implement in subclass")
+
     @staticmethod
     def coordinates(manifest, dim):
         raise NotImplementedError("Implement in subclass")
@@ -81,15 +117,17 @@ class ImageData(object):
 
 class WholeImageData(ImageData):
 
-    def __init__(self, manifest, img):
+    def __init__(self, manifest, img, scale=1):
         super().__init__(manifest)
         self._img = img
         self._pa = img.load()
+        self._scale = scale
 
     @staticmethod
     def create(manifest, filepath):
         img = Image.open(filepath)
-        return WholeImageData(manifest, img)
+        scale = draft_image(img, manifest.decode_scale() if manifest else 1)
+        return WholeImageData(manifest, img, scale)
 
     def time_taken(self):
         dt_str = self._img._getexif()[DATETIME_EXIF]
@@ -99,13 +137,67 @@ class WholeImageData(ImageData):
     def register(self, heatmap, coord):
         heatmap.add(coord)
 
+    def values(self):
+        return np.asarray(self._img)
+
+    def register_mask(self, heatmap, mask):
+        if heatmap.cell != (1, 1):
+            raise ValueError("Whole images need a pixel resolution heatmap")
+        width, height = heatmap.size
+        if self._scale > 1:
+            mask = np.repeat(np.repeat(mask, self._scale, axis=0),
+                             self._scale,
+                             axis=1)
+        heatmap.add_counts(mask[:height, :width])
+
+    def detached(self):
+        return FrameImageData(self.manifest,
+                              np.array(self.values()),
+                              self.time_taken(),
+                              self._scale)
+
+    def nbytes(self):
+        width, height = self._img.size
+        return width * height * len(self._img.getbands())
+
     @staticmethod
     def coordinates(manifest, dim):
         xs, ys = range(dim[0]), range(dim[1])
         return set(itertools.product(xs, ys))
 
     def at(self, coord):
-        return self._pa[coord]
+        x, y = coord
+        return self._pa[x // self._scale, y // self._scale]
+
+
+class FrameImageData(WholeImageData):
+    """whole image backed by a (height, width, 3) array, e.g. a store view"""
+
+    @staticmethod
+    def sequence_from_store(manifest, store, period):
+        frames, timestamps = store.period_frames(period)
+        scale = store.attrs.get("scale", 1)
+        return [FrameImageData(manifest, frame, from_timestamp(ts), scale)
+                for frame, ts in zip(frames, timestamps)]
+
+    def __init__(self, manifest, pixels, taken, scale=1):
+        ImageData.__init__(self, manifest)
+        self._pixels = pixels
+        self._taken = taken
+        self._scale = scale
+
+    def time_taken(self):
+        return self._taken
+
+    def nbytes(self):
+        return self._pixels.nbytes
+
+    def values(self):
+        return self._pixels
+
+    def at(self, coord):
+        x, y = coord
+        return self._pixels[y // self._scale, x // self._scale]
 
 
 class ChunkImageData(ImageData):
@@ -114,38 +206,210 @@ class ChunkImageData(ImageData):
     def create(manifest, filepath):
         chunk_width, chunk_height = manifest.chunk_dimensions()
         chunk_obj = PixelChunk.of(filepath, chunk_width, chunk_height)
-        return ChunkImageData(manifest, chunk_obj)
+        grid = chunk_obj.luminosity_grid(*manifest.chunk_stride())
+        taken = parse_datetime(chunk_obj.file_datetime())
+        return ChunkImageData(manifest, grid, taken)
 
-    def __init__(self, manifest, chunk_obj):
+    @staticmethod
+    def from_store(manifest, store, idx):
+        """view of one frame of a chunk FrameStore; nothing is copied"""
+        return ChunkImageData(manifest,
+                              store.frame(idx),
+                              store.time_taken(idx))
+
+    @staticmethod
+    def sequence_from_store(manifest, store, period):
+        ChunkImageData.check_store_level(manifest, store)
+        frames = store.frames()
+        timestamps = store.timestamps()
+        return [ChunkImageData(manifest,
+                               frames[idx],
+                               from_timestamp(timestamps[idx]))
+                for idx in store.indices(period)]
+
+    @staticmethod
+    def check_store_level(manifest, store):
+        """make sure a chunk store was laid out with the manifest's chunks"""
+        chunk_width, chunk_height = manifest.chunk_dimensions()
+        stride_x, stride_y = manifest.chunk_stride()
+        expected = [chunk_width, chunk_height, stride_x, stride_y]
+        level = [store.attrs.get(x) for x in STORE_LEVEL_ATTRS]
+        if level != expected:
+            msg = "Chunk store level {} does not match manifest chunks {}"\
+                .format(level, expected)
+            raise ValueError(msg)
+
+    def __init__(self, manifest, grid, taken):
         super().__init__(manifest)
-        self._chunk_obj = chunk_obj
-        self._chunks = chunk_obj.rgb_chunks()
+        self._grid = grid
+        self._taken = taken
 
     def _chunk_dim(self):
         return self.manifest.chunk_dimensions()
 
     def time_taken(self):
-        dt_str = self._chunk_obj.file_datetime()
-        dt = datetime.strptime(dt_str, DATETIME_FMT)
-        return dt
+        return self._taken
+
+    def nbytes(self):
+        return self._grid.nbytes
 
     def register(self, heatmap, coord):
         chunk_width, chunk_height = self._chunk_dim()
+        width, height = heatmap.size
         x, y = coord
-        for deltax in range(chunk_width):
-            for deltay in range(chunk_height):
+        for deltax in range(min(chunk_width, width - x)):
+            for deltay in range(min(chunk_height, height - y)):
                 pos = x + deltax, y + deltay
                 heatmap.add(pos)
 
+    def values(self):
+        return self._grid
+
+    def register_mask(self, heatmap, mask):
+        chunk_width, chunk_height = self._chunk_dim()
+        stride_x, stride_y = self.manifest.chunk_stride()
+        width, height = heatmap.size
+
+        # chunks the coordinates cover, then the pixel box of each
+        rows = -(-height // stride_y)
+        cols = -(-width // stride_x)
+        ys, xs = np.nonzero(mask[:rows, :cols])
+        x0, y0 = xs * stride_x, ys * stride_y
+        x1 = np.minimum(x0 + chunk_width, width)
+        y1 = np.minimum(y0 + chunk_height, height)
+        pixel_count = np.sum((x1 - x0) * (y1 - y0))
+
+        # the same boxes in heatmap cells; box edges fall on cell edges
+        # (or the image edge, which ends the last cell)
+        cell_width, cell_height = heatmap.cell
+        x0, y0 = x0 // cell_width, y0 // cell_height
+        x1, y1 = -(-x1 // cell_width), -(-y1 // cell_height)
+        rows, cols = heatmap.cell_shape()
+
+        # boxes may overlap when strided, so sum them as a 2D difference
+        # array instead of assigning
+        diff = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+        np.add.at(diff, (y0, x0), 1)
+        np.add.at(diff, (y0, x1), -1)
+        np.add.at(diff, (y1, x0), -1)
+        np.add.at(diff, (y1, x1), 1)
+        counts = diff.cumsum(axis=0).cumsum(axis=1)
+        heatmap.add_counts(counts[:rows, :cols], pixel_count)
+
+    def detached(self):
+        return ChunkImageData(self.manifest,
+                              np.array(self._grid),
+                              self._taken)
+
     @staticmethod
     def coordinates(manifest, dim):
-        chunk_width, chunk_height = manifest.chunk_dimensions()
-        xs = range(0, dim[0], chunk_width)
-        ys = range(0, dim[1], chunk_height)
+        stride_x, stride_y = manifest.chunk_stride()
+        xs = range(0, dim[0], stride_x)
+        ys = range(0, dim[1], stride_y)
         return set(itertools.product(xs, ys))
 
     def at(self, coord):
-        return self._chunks[coord]
+        stride_x, stride_y = self.manifest.chunk_stride()
+        x, y = coord
+        return self._grid[y // stride_y, x // stride_x]
+
+
+class ImageCache(object):
+    """Bounded LRU cache of decoded ImageData objects
+
+    Entries are keyed by file path, modification time and the parts of
+    the manifest that change how a file is decoded, so a rewritten
+    file or a different chunk layout is decoded again. Least recently
+    used entries are evicted once the decoded data exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, manifest, filepath):
+        key = cache_key(manifest, filepath)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        img = ImageData.create_uncached(manifest, filepath)
+        self._entries[key] = img
+        self._bytes += img.nbytes()
+        self._evict()
+        return img
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, img = self._entries.popitem(last=False)
+            self._bytes -= img.nbytes()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "{} hits, {} misses, {} entries, {:.1f} MB"\
+            .format(self.hits,
+                    self.misses,
+                    len(self._entries),
+                    self._bytes / BYTES_PER_MEGABYTE)
+
+
+###############################################################################
+# Store tools                                                                 #
+###############################################################################
+
+def store_data_type(store):
+    '''ImageData type of a store's frames: chunk grids or whole frames'''
+    if STORE_LEVEL_ATTRS[0] in store.attrs:
+        return ChunkImageData
+    return FrameImageData
+
+
+def image_state(img):
+    '''(kind, values, scale) of a detached image, see from_state'''
+    if isinstance(img, ChunkImageData):
+        return CHUNK_KIND, img.values(), 1
+    return FRAME_KIND, img.values(), img._scale
+
+
+def from_state(manifest, kind, values, taken, scale=1):
+    if kind == CHUNK_KIND:
+        return ChunkImageData(manifest, values, taken)
+    return FrameImageData(manifest, values, taken, scale)
+
+
+###############################################################################
+# Cache tools                                                                 #
+###############################################################################
+
+@contextmanager
+def cached(max_bytes=DEFAULT_CACHE_BYTES):
+    '''share one ImageCache between every ImageData.create in a block'''
+    global _cache
+    previous = _cache
+    _cache = ImageCache(max_bytes)
+    try:
+        yield _cache
+    finally:
+        _cache = previous
+
+
+def cache_key(manifest, filepath):
+    layout = None
+    if manifest is not None:
+        if ImageData.sub_type([filepath]) is ChunkImageData:
+            layout = (manifest.chunk_dimensions(), manifest.chunk_stride())
+        else:
+            layout = manifest.decode_scale()
+    mtime = os.stat(filepath).st_mtime_ns
+    return os.path.abspath(filepath), mtime, layout
 
 
 ###############################################################################
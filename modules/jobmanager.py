@@ -26,20 +26,21 @@ function. It also provides a CLI in this file.
 ###############################################################################
 
 import argparse
+import os
 import shutil
 import logging
 from datetime import timedelta
 
-# star import required for unpickling
-# need to have all heatmap helper classes imported to
-# __main__ in this script in order for unpickling to work
-# TODO: work around this by refactoring
-from heatmap import *
+from heatmap import HeatmapHeader
 from image import ImageData
 import heatmap
+import image
 import access
+import projection
 import crowd
 import retail
+import tiles
+import output
 import log
 
 
@@ -51,6 +52,7 @@ NEW_JOB_DIRS = [
     access.DATA_DIR,
     access.IMAGES_DIR,
     access.HEATMAPS_DIR,
+    access.STORE_DIR,
     access.OUT_DIR
 ]
 
@@ -144,12 +146,12 @@ class ProcessEveryImage(Processing):
     def process(self, jobid, filename):
         heatmap_filepath = access.heatmap_filepath(jobid)
         period = self._period(filename)
-        img_files = access.image_filepaths(jobid)
-        heatmap.record_heatmap(heatmap_filepath,
-                               img_files,
-                               period,
-                               self.window_size,
-                               self.color_thresh)
+        record(jobid,
+               self.manifest,
+               heatmap_filepath,
+               period,
+               self.window_size,
+               self.color_thresh)
 
 
 class IntervalProcessing(Processing):
@@ -173,23 +175,77 @@ class IntervalProcessing(Processing):
         if not heatmap_filepath:
             heatmap_filepath = access.heatmap_filepath(jobid)
 
-        interval = UpdateIntervalChecker(self.manifest,
-                                         self.json,
-                                         filename,
-                                         heatmap_filepath)
+        record_interval(jobid,
+                        self.manifest,
+                        self.json,
+                        filename,
+                        heatmap_filepath,
+                        self.window_size,
+                        self.color_thresh)
 
-        if interval.should_update():
-            msg = "Updating for img: {}".format(interval.time_taken())
-            logger.debug(msg)
-            img_files = access.image_filepaths(jobid)
-            heatmap.record_heatmap(heatmap_filepath,
-                                   img_files,
-                                   interval.period(),
+
+class LiveProcessing(Processing):
+    """Keeps a heatmap of recent activity, see heatmap.LiveHeatmap
+
+    Records like interval_processing, into a heatmap whose counts
+    halve every half_life seconds. Whenever it records, it renders
+    the live overlay, and the live projection when project_width is
+    given.
+    """
+
+    processing_type = "live_processing"
+
+    WINDOW_SIZE = "window_size"
+    COLOR_THRESH = "color_thresh"
+    HALF_LIFE = "half_life"
+    PROJECT_WIDTH = "project_width"
+    PROJECT_METHOD = "project_method"
+
+    def __init__(self, manifest, json):
+        super().__init__(manifest, json)
+        self.window_size = json[LiveProcessing.WINDOW_SIZE]
+        self.color_thresh = json[LiveProcessing.COLOR_THRESH]
+        self.half_life = json[LiveProcessing.HALF_LIFE]
+        self.project_width = json.get(LiveProcessing.PROJECT_WIDTH)
+        self.project_method = json.get(LiveProcessing.PROJECT_METHOD,
+                                       projection.SPLAT)
+
+    def setup(self, jobid):
+        super().setup(jobid)
+        heatmap.new_live_heatmap(access.live_heatmap_filepath(jobid),
+                                 access.manifest(jobid),
+                                 self.half_life)
+
+    def process(self, jobid, filename):
+        live_filepath = access.live_heatmap_filepath(jobid)
+        recorded = record_interval(jobid,
+                                   self.manifest,
+                                   self.json,
+                                   filename,
+                                   live_filepath,
                                    self.window_size,
                                    self.color_thresh)
-        else:
-            msg = "Not updating for img: {}".format(interval.time_taken())
-            logger.debug(msg)
+        if not recorded:
+            return
+
+        overlay_fp = out_filepath(self.manifest, jobid, "live_overlay")
+        control_fp = access.specific_image(jobid, self.manifest.control_img())
+        heatmap.overlay_heatmap(live_filepath,
+                                control_fp,
+                                overlay_fp,
+                                self.manifest.scale(),
+                                self.manifest.blur())
+        write_tiles(self.manifest, jobid, overlay_fp)
+
+        if self.project_width:
+            project_fp = out_filepath(self.manifest, jobid, "live_project")
+            taken = ImageData.create(self.manifest, filename).time_taken()
+            heatmap.project_heatmap(live_filepath,
+                                    project_fp,
+                                    self.project_width,
+                                    taken,
+                                    self.project_method)
+            write_tiles(self.manifest, jobid, project_fp)
 
 
 class AllResultsProcessing(Processing):
@@ -200,17 +256,19 @@ class AllResultsProcessing(Processing):
 
         heatmap_filepath = access.heatmap_filepath(jobid)
 
-        view_heatmap_fp = access.out_filepath(jobid, "heatmap.bmp")
+        view_heatmap_fp = out_filepath(self.manifest, jobid, "heatmap")
         heatmap.view_heatmap(heatmap_filepath,
                              view_heatmap_fp)
+        write_tiles(self.manifest, jobid, view_heatmap_fp)
 
-        overlay_fp = access.out_filepath(jobid, "overlay.bmp")
+        overlay_fp = out_filepath(self.manifest, jobid, "overlay")
         control_fp = access.specific_image(jobid, self.manifest.control_img())
         heatmap.overlay_heatmap(heatmap_filepath,
                                 control_fp,
                                 overlay_fp,
                                 self.manifest.scale(),
                                 self.manifest.blur())
+        write_tiles(self.manifest, jobid, overlay_fp)
 
 
 class ProjectProcessing(Processing):
@@ -218,10 +276,13 @@ class ProjectProcessing(Processing):
     processing_type = "project_processing"
 
     PROJECT_WIDTH = "project_width"
+    PROJECT_METHOD = "project_method"
 
     def __init__(self, manifest, json):
         super().__init__(manifest, json)
         self.project_width = json[ProjectProcessing.PROJECT_WIDTH]
+        self.project_method = json.get(ProjectProcessing.PROJECT_METHOD,
+                                       projection.SPLAT)
 
     def process(self, jobid, filename):
 
@@ -232,11 +293,13 @@ class ProjectProcessing(Processing):
                                           heatmap_filepath)
 
         if interval.should_update():
-            project_fp = access.out_filepath(jobid, "project.bmp")
+            project_fp = out_filepath(self.manifest, jobid, "project")
             heatmap.project_heatmap(heatmap_filepath,
                                     project_fp,
                                     self.project_width,
-                                    interval.time_taken())
+                                    interval.time_taken(),
+                                    self.project_method)
+            write_tiles(self.manifest, jobid, project_fp)
 
 
 class CrowdProcessing(Processing):
@@ -307,6 +370,7 @@ class SeriesProcessing(Processing):
                                                   series_dir)
         interval_proc = IntervalProcessing(self.manifest, self.json)
         interval_proc.process(jobid, filename, subheatmap_fp)
+        heatmap.store_series_subheatmap(series_filepath, subheatmap_fp)
 
 
 class OutputCopyProcessing(Processing):
@@ -333,7 +397,11 @@ class OutputCopyProcessing(Processing):
     def process_out_dir(self, jobid, filepath):
         web_out_filepath = access.web_data_out_filepath(jobid)
         out_filepath = access.out_dir_filepath(jobid)
-        force_copy(out_filepath, web_out_filepath)
+        output.wait()
+        # unchanged files and tiles keep their mtime and are skipped
+        copied = tiles.sync_dir(out_filepath, web_out_filepath)
+        logger.debug("Copied {} output files to {}"
+                     .format(copied, web_out_filepath))
 
 
 class RetailProcessing(Processing):
@@ -368,7 +436,7 @@ class IntervalChecker(object):
         self.interval = timedelta(seconds=interval_sec)
 
         self.img = ImageData.create(manifest, img_fp)
-        self.hm = Heatmap.load(heatmap_fp)
+        self.hm = HeatmapHeader.load(heatmap_fp)
 
     def prev_time(self):
         raise NotImplementedError("implement")
@@ -401,7 +469,8 @@ class ProjectIntervalChecker(IntervalChecker):
 # Utilities                                                                   #
 ###############################################################################
 
-def update_job(jobid, incoming_data_filepath):
+def update_job(jobid, incoming_data_filepath,
+               cache_bytes=image.DEFAULT_CACHE_BYTES):
 
     logger.info("Updating job {} with {}"
                 .format(jobid, incoming_data_filepath))
@@ -410,7 +479,18 @@ def update_job(jobid, incoming_data_filepath):
 
     access.save_new_data(jobid, incoming_data_filepath, manifest)
 
-    Processing.process_all(manifest, jobid, incoming_data_filepath)
+    # decode each frame at most once across all processing types,
+    # keep projection tables across runs, and write outputs in the
+    # background
+    table_dir = access.projection_cache_filepath()
+    writer = output.shared_writer(manifest.output_format(),
+                                  manifest.output_quality(),
+                                  manifest.output_threads())
+    with image.cached(cache_bytes) as cache, \
+            projection.cached_on_disk(table_dir), \
+            output.writing(writer):
+        Processing.process_all(manifest, jobid, incoming_data_filepath)
+        logger.info("Image cache for job {}: {}".format(jobid, cache))
 
 
 def new_job(incoming_manifest):
@@ -447,10 +527,69 @@ logger = logging.getLogger(__name__)
 # Helper functions                                                            #
 ###############################################################################
 
-def force_copy(src, dest):
-    if (os.path.exists(dest)):
-            shutil.rmtree(dest)
-    shutil.copytree(src, dest)
+def out_filepath(manifest, jobid, name):
+    '''filepath of output image name, in the job's output format'''
+    filename = output.filename(name, manifest.output_format())
+    return access.out_filepath(jobid, filename)
+
+
+def write_tiles(manifest, jobid, image_filepath):
+    '''update the tile pyramid of an output image, if the job has tiles
+
+    The image may still be being written, so this happens once it is.
+    '''
+    if not manifest.tiles():
+        return
+    name, _ = os.path.splitext(os.path.basename(image_filepath))
+
+    def write():
+        dirty = tiles.write_tiles(image_filepath,
+                                  access.tiles_filepath(jobid, name),
+                                  manifest.tile_size())
+        logger.debug("Wrote {} changed {} tiles".format(len(dirty), name))
+
+    output.after(image_filepath, write)
+
+
+def record(jobid, manifest, heatmap_filepath, period,
+           window_size, color_thresh):
+    store = None
+    if manifest.frame_store():
+        store = access.frame_store(jobid, manifest)
+    if store is None:
+        store = access.chunk_store(jobid, manifest)
+    heatmap.record_heatmap_store(heatmap_filepath,
+                                 store.dirpath,
+                                 period,
+                                 window_size,
+                                 color_thresh)
+
+
+def record_interval(jobid, manifest, json, filename, heatmap_filepath,
+                    window_size, color_thresh):
+    '''record since the heatmap's last update, once its interval has passed
+
+    Returns whether it recorded.
+    '''
+    interval = UpdateIntervalChecker(manifest,
+                                     json,
+                                     filename,
+                                     heatmap_filepath)
+
+    if not interval.should_update():
+        msg = "Not updating for img: {}".format(interval.time_taken())
+        logger.debug(msg)
+        return False
+
+    msg = "Updating for img: {}".format(interval.time_taken())
+    logger.debug(msg)
+    record(jobid,
+           manifest,
+           heatmap_filepath,
+           interval.period(),
+           window_size,
+           color_thresh)
+    return True
 
 
 def gen_heatmap(jobid):
@@ -470,6 +609,11 @@ def get_args():
                             help="id of job")
     update_job.add_argument("data_filepath",
                             help="location of incoming data")
+    update_job.add_argument("--cache-mb",
+                            type=int,
+                            default=image.DEFAULT_CACHE_BYTES
+                            // image.BYTES_PER_MEGABYTE,
+                            help="memory cap for decoded images")
 
     new_job = subparsers.add_parser("new_job",
                                     help="add a new job")
@@ -492,7 +636,8 @@ def main():
 
     if args.op == "update_job":
         update_job(args.jobid,
-                   args.data_filepath)
+                   args.data_filepath,
+                   args.cache_mb * image.BYTES_PER_MEGABYTE)
 
     elif args.op == "new_job":
         jobid = new_job(args.manifest_filepath)
@@ -9,6 +9,7 @@ a manifest JSON and extract its JSON info.
 ###############################################################################
 
 import json
+from math import gcd
 
 
 ###############################################################################
@@ -29,12 +30,36 @@ CHUNK = "chunk"
 
 CHUNK_HEIGHT = "chunk_height"
 CHUNK_WIDTH = "chunk_width"
+CHUNK_STRIDE_X = "stride_x"
+CHUNK_STRIDE_Y = "stride_y"
+CHUNK_PYRAMID = "pyramid"
+DECODE_SCALE = "decode_scale"
+
+DEFAULT_CHUNK_PYRAMID = [10, 20, 40, 80]
 
 OVERLAY = "overlay"
 CONTROL_IMG = "control_img"
 SCALE = "scale"
 BLUR = "blur"
 
+FRAME_STORE = "frame_store"
+
+OUTPUT = "output"
+OUTPUT_FORMAT = "format"
+OUTPUT_QUALITY = "quality"
+OUTPUT_THREADS = "threads"
+DEFAULT_OUTPUT_FORMAT = "bmp"
+DEFAULT_OUTPUT_QUALITY = 90
+DEFAULT_OUTPUT_THREADS = 2
+
+TILES = "tiles"
+TILE_SIZE = "tile_size"
+DEFAULT_TILE_SIZE = 256
+
+HEATMAP_RESOLUTION = "heatmap_resolution"
+PIXEL_RESOLUTION = "pixel"
+CHUNK_RESOLUTION = "chunk"
+
 PROCESSING = "processing"
 PROCESSING_TYPE = "type"
 
@@ -93,6 +118,9 @@ class Manifest(object):
     def _geometry(self):
         return self.json[GEOMETRY]
 
+    def geometry(self):
+        return self._geometry()
+
     def _corners(self):
         geometry = self._geometry()
         return [geometry[corner] for corner in CORNERS]
@@ -121,6 +149,12 @@ class Manifest(object):
     def _chunk_width(self):
         return self._chunk()[CHUNK_WIDTH]
 
+    def _chunk_stride_x(self):
+        return self._chunk().get(CHUNK_STRIDE_X, self._chunk_width())
+
+    def _chunk_stride_y(self):
+        return self._chunk().get(CHUNK_STRIDE_Y, self._chunk_height())
+
     def dimensions(self):
         return self._width(), self._height()
 
@@ -130,6 +164,50 @@ class Manifest(object):
     def chunk_dimensions(self):
         return self._chunk_width(), self._chunk_height()
 
+    def chunk_stride(self):
+        return self._chunk_stride_x(), self._chunk_stride_y()
+
+    def chunk_pyramid(self):
+        return self._chunk().get(CHUNK_PYRAMID, DEFAULT_CHUNK_PYRAMID)
+
+    def decode_scale(self):
+        return self.json.get(CHUNK, {}).get(DECODE_SCALE, 1)
+
+    def frame_store(self):
+        return self.json.get(FRAME_STORE, False)
+
+    def _output(self):
+        return self.json.get(OUTPUT, {})
+
+    def output_format(self):
+        return self._output().get(OUTPUT_FORMAT, DEFAULT_OUTPUT_FORMAT)
+
+    def output_quality(self):
+        return self._output().get(OUTPUT_QUALITY, DEFAULT_OUTPUT_QUALITY)
+
+    def output_threads(self):
+        return self._output().get(OUTPUT_THREADS, DEFAULT_OUTPUT_THREADS)
+
+    def tiles(self):
+        return TILES in self.json
+
+    def tile_size(self):
+        return self.json.get(TILES, {}).get(TILE_SIZE, DEFAULT_TILE_SIZE)
+
+    def heatmap_cell(self):
+        '''(width, height) in pixels of one heatmap cell
+
+        Chunk resolution heatmaps get one cell per chunk, or per
+        stride step when chunks overlap. Jobs recording whole frames
+        (frame_store) always use pixel cells.
+        '''
+        resolution = self.json.get(HEATMAP_RESOLUTION, PIXEL_RESOLUTION)
+        if resolution != CHUNK_RESOLUTION or self.frame_store():
+            return 1, 1
+        chunk_width, chunk_height = self.chunk_dimensions()
+        stride_x, stride_y = self.chunk_stride()
+        return gcd(chunk_width, stride_x), gcd(chunk_height, stride_y)
+
     def processing(self):
         return self.json[PROCESSING]
 
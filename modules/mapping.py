@@ -22,6 +22,16 @@ Most of the mapping API operations are implemented using a
 Geometry object, though users of the API should consider this class
 an implementation detail.
 
+The camera model maps the image plane onto the (planar) field of
+interest, which is a projective transform. Geometry derives it in
+closed form at construction time as two 3x3 homographies, one for
+each direction, so mapping a point is one matrix product and a divide.
+
+Each mapping function has an _array variant that maps an (N, 2)
+array of coordinates at once. The array variants do the same floating
+point operations in the same order as the single coordinate functions,
+so their results are bit for bit the same.
+
 The mapping API can also be accessed using the command line interface
 defined in this file.
 
@@ -98,6 +108,41 @@ class Geometry(object):
 
         self.normal = Geometry.compute_normal(self.map_corners)
 
+        axes = self.orthonormals()
+        self.itb_homography = Geometry.compute_itb_homography(
+            self.fov, self.normal, self.top_left_map_corner, axes)
+        self.bti_homography = Geometry.compute_bti_homography(
+            self.fov, self.top_left_map_corner, axes)
+
+    @staticmethod
+    def compute_itb_homography(fov, normal, top_left, axes):
+        """homography from centered image coords to blueprint coords
+
+        An image coord c lies along the ray v = fov * [c, 1], which
+        meets the field plane at k / (n . v) * v, with k = n . top_left.
+        Each blueprint coord is that point's offset from top_left along
+        an axis, over the axis length; multiplying through by n . v
+        leaves a ratio of two linear functions of v.
+        """
+        k = np.dot(normal, top_left)
+        rows = [(k * axis - np.dot(top_left, axis) * normal) / norm(axis)
+                for axis in axes]
+        return np.vstack(rows + [normal]) * fov
+
+    @staticmethod
+    def compute_bti_homography(fov, top_left, axes):
+        """homography from blueprint coords to centered image coords
+
+        A blueprint coord (u, v) is the field point
+        top_left + u * x / |x| + v * y / |y|, which is imaged at its
+        x and y over its z, scaled by fov[2] / fov.
+        """
+        xaxis, yaxis = axes
+        field = np.column_stack([xaxis / norm(xaxis),
+                                 yaxis / norm(yaxis),
+                                 top_left])
+        return (fov[2] / fov)[:, np.newaxis] * field
+
     @staticmethod
     def compute_normal(map_corners):
         m_a, m_b, m_c = map_corners[0:3]
@@ -136,6 +181,20 @@ class Geometry(object):
     def s_to_view_plane(self, image_coord):
         return Geometry.to_view_plane(self.fov, image_coord)
 
+    def transform_itb(self, image_coord):
+        return list(apply_homography(self.itb_homography, image_coord))
+
+    def transform_itb_array(self, image_coords):
+        '''transform_itb of each row of an (N, 2) array'''
+        return apply_homography(self.itb_homography, image_coords)
+
+    def transform_bti(self, blueprint_coord):
+        return apply_homography(self.bti_homography, blueprint_coord)
+
+    def transform_bti_array(self, blueprint_coords):
+        '''transform_bti of each row of an (N, 2) array'''
+        return apply_homography(self.bti_homography, blueprint_coords)
+
     def _raw_transform_itb(self, image_coord):
         image_vector = self.s_to_view_plane(image_coord)
         scale = (np.dot(self.normal, self.top_left_map_corner) /
@@ -143,11 +202,15 @@ class Geometry(object):
         blueprint_coord = scale * image_vector
         return blueprint_coord
 
-    def transform_itb(self, image_coord):
+    def transform_itb_vectors(self, image_coord):
+        '''transform_itb by following the ray to the field plane
+
+        This is what itb_homography is derived from; transform_itb
+        should agree with it to within rounding.
+        '''
         blueprint_coord = self._raw_transform_itb(image_coord)
         translated = blueprint_coord - self.top_left_map_corner
 
-        # TODO potentially make the yaxis calculated?
         xaxis, yaxis = self.orthonormals()
 
         u = np.dot(translated, xaxis) / norm(xaxis)
@@ -163,7 +226,8 @@ class Geometry(object):
     def along_axis(pos, axis):
         return (pos / norm(axis)) * axis
 
-    def transform_bti(self, blueprint_coord):
+    def transform_bti_vectors(self, blueprint_coord):
+        '''transform_bti by walking the field axes, see bti_homography'''
 
         xaxis, yaxis = self.orthonormals()
 
@@ -210,6 +274,28 @@ def blueprint_to_image(blueprint_coord, geom, dim):
     return image_coord
 
 
+def image_to_blueprint_array(pixel_coords, geom, dim):
+    '''Map an (N, 2) array of image coordinates to blueprint coordinates'''
+
+    pixel_coords = np.asarray(pixel_coords)
+    if np.any(any_negative_array(pixel_coords)):
+        raise ValueError("All pixel positions must be positive")
+    elif np.any(pixel_out_of_bounds_array(pixel_coords, dim)):
+        raise ValueError("Pixel positions must be inside img dimensions: {}"
+                         .format(dim))
+
+    image_coords = center_img_coord_array(pixel_coords, dim)
+    return geom.transform_itb_array(image_coords)
+
+
+def blueprint_to_image_array(blueprint_coords, geom, dim):
+    '''Map an (N, 2) array of blueprint coordinates to image coordinates'''
+
+    blueprint_coords = np.asarray(blueprint_coords, dtype=np.float64)
+    image_coords = geom.transform_bti_array(blueprint_coords)
+    return uncenter_img_coord_array(image_coords, dim)
+
+
 ###############################################################################
 # Validation                                                                  #
 ###############################################################################
@@ -222,6 +308,16 @@ def pixel_out_of_bounds(pixel_coord, dim):
     return any(x > y for x, y in zip(pixel_coord, dim))
 
 
+def any_negative_array(coords):
+    '''any_negative of each row'''
+    return np.any(coords < 0, axis=1)
+
+
+def pixel_out_of_bounds_array(pixel_coords, dim):
+    '''pixel_out_of_bounds of each row'''
+    return np.any(pixel_coords > np.asarray(dim), axis=1)
+
+
 def any_same(lis):
     return any(x == y for x, y in combinations(lis, 2))
 
@@ -240,6 +336,12 @@ def center_img_coord(coord, dim):
     return [new_x, new_y]
 
 
+def center_img_coord_array(coords, dim):
+    new_x = center(coords[:, 0], dim[0])
+    new_y = -center(coords[:, 1], dim[1])
+    return np.column_stack([new_x, new_y])
+
+
 def center(value, normalization):
     half_normalization = normalization / 2
     return (value - half_normalization) / normalization
@@ -251,6 +353,12 @@ def uncenter_img_coord(coord, dim):
     return [new_x, new_y]
 
 
+def uncenter_img_coord_array(coords, dim):
+    new_x = uncenter(coords[:, 0], dim[0], 1)
+    new_y = uncenter(coords[:, 1], dim[1], -1)
+    return np.column_stack([new_x, new_y])
+
+
 def uncenter(value, normalization, direction):
     offset = normalization / 2
     difference = (value * normalization) * direction
@@ -258,6 +366,21 @@ def uncenter(value, normalization, direction):
     return result
 
 
+def apply_homography(homography, coords):
+    '''map a coord, or each row of an (N, 2) array, through a homography
+
+    Written out rather than a matrix product so single coords and
+    arrays of them round identically.
+    '''
+    coords = np.asarray(coords, dtype=np.float64)
+    h = homography
+    x, y = coords[..., 0], coords[..., 1]
+    w = h[2, 0] * x + h[2, 1] * y + h[2, 2]
+    u = (h[0, 0] * x + h[0, 1] * y + h[0, 2]) / w
+    v = (h[1, 0] * x + h[1, 1] * y + h[1, 2]) / w
+    return np.stack([u, v], axis=-1)
+
+
 def norm(vec):
     return np.linalg.norm(vec)
 
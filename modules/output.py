@@ -0,0 +1,264 @@
+'''output module
+
+The stage that encodes output images and saves them to disk.
+
+Heatmap, overlay and projection images are handed to save(). Within a
+writing() block the image is encoded and written by an OutputWriter
+on a background thread pool, so processing can go on to the next
+frame while the previous outputs are still being written; outside
+one it is saved straight away. Either way each image is encoded once,
+in the format its file extension names, and written to a temporary
+file that then replaces the output, so readers never see half an
+image.
+
+A job picks its format in the manifest's optional "output" block:
+
+    "output": {"format": "png", "quality": 90, "threads": 2}
+
+"format" is one of bmp (the default), png, webp or jpeg. "quality"
+applies to webp and jpeg. The writer keeps an ArtifactReport of the
+size and encode/write time of everything it saves.
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import io
+import logging
+import os
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+BMP = "bmp"
+PNG = "png"
+WEBP = "webp"
+JPEG = "jpeg"
+
+# format -> (PIL format name, file extension)
+FORMATS = {
+    BMP: ("BMP", ".bmp"),
+    PNG: ("PNG", ".png"),
+    WEBP: ("WEBP", ".webp"),
+    JPEG: ("JPEG", ".jpg")
+}
+
+DEFAULT_FORMAT = BMP
+DEFAULT_QUALITY = 90
+DEFAULT_THREADS = 2
+
+BYTES_PER_KILOBYTE = 1024
+
+# writer used by save(), see writing()
+_writer = None
+
+# writers kept for the life of the process, see shared_writer()
+_shared_writers = {}
+_shared_lock = threading.Lock()
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class ArtifactReport(object):
+
+    def __init__(self, filepath, nbytes, encode_seconds, write_seconds):
+        super().__init__()
+        self.filepath = filepath
+        self.nbytes = nbytes
+        self.encode_seconds = encode_seconds
+        self.write_seconds = write_seconds
+
+    def __str__(self):
+        return "{}: {:.1f} KB, encoded in {:.1f} ms, written in {:.1f} ms"\
+            .format(os.path.basename(self.filepath),
+                    self.nbytes / BYTES_PER_KILOBYTE,
+                    self.encode_seconds * 1000,
+                    self.write_seconds * 1000)
+
+
+class OutputWriter(object):
+    """Encodes and saves output images on a background thread pool
+
+    Saves of the same file run in the order they were submitted, so
+    an older image never replaces a newer one.
+    """
+
+    def __init__(self,
+                 fmt=DEFAULT_FORMAT,
+                 quality=DEFAULT_QUALITY,
+                 threads=DEFAULT_THREADS):
+        super().__init__()
+        if fmt not in FORMATS:
+            raise ValueError("Unknown output format: {}".format(fmt))
+        self.fmt = fmt
+        self.quality = quality
+        self.reports = []
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def filename(self, name):
+        return filename(name, self.fmt)
+
+    def submit(self, img, filepath):
+        '''save img to filepath in the background'''
+        return self.after(filepath, self._save, img, filepath)
+
+    def after(self, filepath, fn, *args):
+        '''run fn(*args) in the background, after pending saves of filepath
+
+        Its own completion then counts as a pending save of filepath.
+        fn runs even if the pending save failed, so one failed write
+        does not stop later saves of the file.
+        '''
+        with self._lock:
+            previous = self._pending.get(filepath)
+
+            def run():
+                if previous is not None:
+                    futures.wait([previous])
+                return fn(*args)
+
+            future = self._executor.submit(run)
+            future.add_done_callback(log_failure)
+            self._pending[filepath] = future
+        return future
+
+    def _save(self, img, filepath):
+        report = write_image(img, filepath, self.quality)
+        with self._lock:
+            self.reports.append(report)
+        logger.info("Wrote {}".format(report))
+        return report
+
+    def wait(self):
+        '''block until everything submitted so far is saved or has failed
+
+        Failures are logged as they happen, see log_failure.
+        '''
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending = {}
+        futures.wait(pending)
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+###############################################################################
+# Output Tools                                                                #
+###############################################################################
+
+def save(img, filepath):
+    '''save a PIL image, in the background within a writing() block'''
+    if _writer is not None:
+        _writer.submit(img, filepath)
+    else:
+        write_image(img, filepath)
+
+
+def after(filepath, fn, *args):
+    '''call fn(*args) once filepath has been saved'''
+    if _writer is not None:
+        _writer.after(filepath, fn, *args)
+    else:
+        fn(*args)
+
+
+def wait():
+    '''block until the writing() block's writer has saved everything'''
+    if _writer is not None:
+        _writer.wait()
+
+
+def shared_writer(fmt=DEFAULT_FORMAT,
+                  quality=DEFAULT_QUALITY,
+                  threads=DEFAULT_THREADS):
+    '''one OutputWriter per set of settings, kept between jobs'''
+    key = (fmt, quality, threads)
+    with _shared_lock:
+        if key not in _shared_writers:
+            _shared_writers[key] = OutputWriter(fmt, quality, threads)
+        return _shared_writers[key]
+
+
+@contextmanager
+def writing(writer):
+    '''send every save() in a block to writer'''
+    global _writer
+    previous = _writer
+    _writer = writer
+    try:
+        yield writer
+    finally:
+        _writer = previous
+
+
+def write_image(img, filepath, quality=DEFAULT_QUALITY):
+    '''encode img once in the format filepath names, then write it'''
+    start = time.perf_counter()
+    pil_format = format_of(filepath)
+    buf = io.BytesIO()
+    if pil_format in (FORMATS[WEBP][0], FORMATS[JPEG][0]):
+        img.save(buf, format=pil_format, quality=quality)
+    else:
+        img.save(buf, format=pil_format)
+    data = buf.getvalue()
+    encoded = time.perf_counter()
+
+    tmp_filepath = "{}.{}.tmp".format(filepath, threading.get_ident())
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filepath, filepath)
+    except OSError:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    written = time.perf_counter()
+
+    return ArtifactReport(filepath,
+                          len(data),
+                          encoded - start,
+                          written - encoded)
+
+
+def filename(name, fmt=DEFAULT_FORMAT):
+    '''filename of the output called name, saved as fmt'''
+    if fmt not in FORMATS:
+        raise ValueError("Unknown output format: {}".format(fmt))
+    _, extension = FORMATS[fmt]
+    return name + extension
+
+
+def format_of(filepath):
+    _, extension = os.path.splitext(filepath)
+    for pil_format, format_extension in FORMATS.values():
+        if extension.lower() == format_extension:
+            return pil_format
+    if extension.lower() == ".jpeg":
+        return FORMATS[JPEG][0]
+    raise ValueError("Unknown output extension: {}".format(extension))
+
+
+def log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Output write failed: {}".format(future.exception()))
+
+
+###############################################################################
+# Logging                                                                     #
+###############################################################################
+
+logger = logging.getLogger(__name__)
@@ -0,0 +1,379 @@
+'''projection module
+
+Tools for projecting heatmap values from a job's image space into its
+blueprint space.
+
+A ProjectionTable records, for every pixel in a job's field of
+interest, which cell of a blueprint grid of a given width the pixel
+lands in. Mapping a pixel is expensive, but the table only depends on
+the job's geometry and the blueprint width, so it is built once and
+kept in a small in-memory cache (see table()). Projecting a heatmap
+is then a single scatter of its values into the blueprint grid.
+
+A SampleTable works the other way round: for every blueprint pixel it
+records where that pixel lands in the image, so a heatmap can be
+sampled there with bilinear interpolation. Its cost follows the size
+of the blueprint rather than the image, and it leaves no holes where
+no image pixel happened to land.
+
+Within a cached_on_disk() block, tables are also read from and saved
+to a TableCache directory, so they survive restarts and are shared
+by every job with the same geometry. Each table is one .npy file
+named by a hash of the manifest's geometry block and the width.
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import glob
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from mapping import Geometry
+import mapping
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+MAX_CACHED_TABLES = 8
+
+# bump when the way tables are built changes, to ignore old files
+TABLE_VERSION = 1
+
+BYTES_PER_MEGABYTE = 1024 * 1024
+DEFAULT_DISK_CACHE_BYTES = 256 * BYTES_PER_MEGABYTE
+
+TABLE_EXTENSION = ".npy"
+
+# ways of rendering a heatmap onto the blueprint
+SPLAT = "splat"
+BILINEAR = "bilinear"
+
+# tables built by table(), most recently used last
+_tables = OrderedDict()
+
+# on-disk cache used by table(), see cached_on_disk()
+_disk_cache = None
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class CoordRange(object):
+
+    def __init__(self, image_corners):
+        self._min_x = min(x for x, y in image_corners)
+        self._max_x = max(x for x, y in image_corners)
+        self._min_y = min(y for x, y in image_corners)
+        self._max_y = max(y for x, y in image_corners)
+
+    def contains(self, coord):
+        x, y = coord
+        return self._min_x <= x and x <= self._max_x and \
+            self._min_y <= y and y <= self._max_y
+
+    def contains_array(self, coords):
+        '''contains of each row of an (N, 2) array'''
+        xs, ys = coords[:, 0], coords[:, 1]
+        return (self._min_x <= xs) & (xs <= self._max_x) & \
+            (self._min_y <= ys) & (ys <= self._max_y)
+
+    def clip_array(self, xs, ys):
+        return (np.clip(xs, self._min_x, self._max_x),
+                np.clip(ys, self._min_y, self._max_y))
+
+    def coordinates(self):
+        for x in range(self._min_x, self._max_x + 1):
+            for y in range(self._min_y, self._max_y + 1):
+                yield (x, y)
+
+    def coordinate_array(self):
+        '''coordinates() as an (N, 2) array, in the same order'''
+        xs, ys = np.meshgrid(np.arange(self._min_x, self._max_x + 1),
+                             np.arange(self._min_y, self._max_y + 1),
+                             indexing='ij')
+        return np.column_stack([xs.ravel(), ys.ravel()])
+
+
+class ProjectionTable(object):
+
+    @staticmethod
+    def build(manifest, desired_width):
+        geom, dim, scale, shape = blueprint_grid(manifest, desired_width)
+
+        coords = CoordRange(manifest.image_corners()).coordinate_array()
+        raw = mapping.image_to_blueprint_array(coords, geom, dim)
+        # np.rint rounds half to even, like round()
+        projected = np.rint(raw * scale).astype(np.int64)
+        p_x, p_y = projected[:, 0], projected[:, 1]
+
+        valid = (p_y >= 0) & (p_y < shape[0]) & \
+            (p_x >= 0) & (p_x < shape[1])
+        coords = coords[valid]
+        targets = p_y[valid] * shape[1] + p_x[valid]
+
+        return ProjectionTable(shape,
+                               coords[:, 0].astype(np.int32),
+                               coords[:, 1].astype(np.int32),
+                               targets)
+
+    def __init__(self, shape, xs, ys, targets):
+        super().__init__()
+        self.shape = shape
+        self.xs = xs
+        self.ys = ys
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    def to_array(self):
+        return np.vstack([self.xs, self.ys, self.targets]).astype(np.int64)
+
+    @staticmethod
+    def from_array(shape, arr):
+        return ProjectionTable(shape,
+                               arr[0].astype(np.int32),
+                               arr[1].astype(np.int32),
+                               arr[2])
+
+    def project(self, values):
+        '''blueprint grid holding the sum of values landing in each cell
+
+        values has one entry per pixel in the table, in table order.
+        '''
+        size = self.shape[0] * self.shape[1]
+        summed = np.bincount(self.targets,
+                             weights=values,
+                             minlength=size)
+        return summed.reshape(self.shape)
+
+    def render(self, at):
+        '''project the values at((xs, ys)) gives for the table's pixels'''
+        return self.project(at((self.xs, self.ys)))
+
+
+class SampleTable(object):
+
+    @staticmethod
+    def build(manifest, desired_width):
+        geom, dim, scale, shape = blueprint_grid(manifest, desired_width)
+
+        rows, cols = np.indices(shape)
+        blueprint = np.column_stack([cols.ravel(), rows.ravel()]) / scale
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coords = mapping.blueprint_to_image_array(blueprint, geom, dim)
+
+        coord_range = CoordRange(manifest.image_corners())
+        valid = np.all(np.isfinite(coords), axis=1)
+        valid[valid] = coord_range.contains_array(coords[valid])
+        targets = np.flatnonzero(valid)
+        coords = coords[valid]
+
+        x0 = np.floor(coords[:, 0])
+        y0 = np.floor(coords[:, 1])
+        x1, y1 = coord_range.clip_array(x0 + 1, y0 + 1)
+        fx = coords[:, 0] - x0
+        fy = coords[:, 1] - y0
+
+        return SampleTable(shape, targets,
+                           x0.astype(np.int64), y0.astype(np.int64),
+                           x1.astype(np.int64), y1.astype(np.int64),
+                           fx, fy)
+
+    def __init__(self, shape, targets, x0, y0, x1, y1, fx, fy):
+        super().__init__()
+        self.shape = shape
+        self.targets = targets
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.fx = fx
+        self.fy = fy
+
+    def __len__(self):
+        return len(self.targets)
+
+    def to_array(self):
+        return np.vstack([self.targets,
+                          self.x0, self.y0, self.x1, self.y1,
+                          self.fx, self.fy]).astype(np.float64)
+
+    @staticmethod
+    def from_array(shape, arr):
+        ints = arr[:5].astype(np.int64)
+        return SampleTable(shape, *ints, arr[5], arr[6])
+
+    def render(self, at):
+        '''blueprint grid sampling at((xs, ys)) bilinearly at each pixel
+
+        Pixels that land outside the field of interest are zero.
+        '''
+        top = (1 - self.fx) * at((self.x0, self.y0)) + \
+            self.fx * at((self.x1, self.y0))
+        bottom = (1 - self.fx) * at((self.x0, self.y1)) + \
+            self.fx * at((self.x1, self.y1))
+
+        rendered = np.zeros(self.shape[0] * self.shape[1])
+        rendered[self.targets] = (1 - self.fy) * top + self.fy * bottom
+        return rendered.reshape(self.shape)
+
+
+# table type for each rendering method
+TABLE_TYPES = {
+    SPLAT: ProjectionTable,
+    BILINEAR: SampleTable
+}
+
+
+class TableCache(object):
+    """ProjectionTables and SampleTables saved as .npy files in a directory
+
+    Files are named <key>_<rows>x<cols>.npy and hold the table's
+    to_array(). Reading a table touches
+    its file, and once the files exceed max_bytes the least recently
+    used are deleted.
+    """
+
+    def __init__(self, dirpath, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        super().__init__()
+        self.dirpath = dirpath
+        self.max_bytes = max_bytes
+        os.makedirs(dirpath, exist_ok=True)
+
+    def _filepaths(self, key="*"):
+        pattern = "{}_*{}".format(key, TABLE_EXTENSION)
+        return glob.glob(os.path.join(self.dirpath, pattern))
+
+    def get(self, key, table_type=ProjectionTable):
+        filepaths = self._filepaths(key)
+        if not filepaths:
+            return None
+
+        filepath = filepaths[0]
+        name = os.path.basename(filepath)[:-len(TABLE_EXTENSION)]
+        rows, cols = name.rsplit("_", 1)[1].split("x")
+        try:
+            arr = np.load(filepath)
+        except (OSError, ValueError):
+            # e.g. evicted by another process since the glob
+            return None
+        os.utime(filepath)
+        return table_type.from_array((int(rows), int(cols)), arr)
+
+    def put(self, key, projection_table):
+        rows, cols = projection_table.shape
+        filename = "{}_{}x{}{}".format(key, rows, cols, TABLE_EXTENSION)
+        filepath = os.path.join(self.dirpath, filename)
+
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, 'wb') as f:
+            np.save(f, projection_table.to_array())
+        os.replace(tmp_filepath, filepath)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for filepath in self._filepaths():
+            stat = os.stat(filepath)
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, filepath in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            os.remove(filepath)
+            total -= size
+
+    def nbytes(self):
+        return sum(os.path.getsize(fp) for fp in self._filepaths())
+
+
+###############################################################################
+# Projection Tools                                                            #
+###############################################################################
+
+def table(manifest, desired_width, method=SPLAT):
+    '''table rendering onto manifest's blueprint by method, built once
+
+    Tables are looked up in memory, then in the on-disk cache if one
+    is set, and only built when neither has them.
+    '''
+    if method not in TABLE_TYPES:
+        raise ValueError("Unknown projection method: {}".format(method))
+    table_type = TABLE_TYPES[method]
+
+    key = table_key(manifest, desired_width, method)
+    if key in _tables:
+        _tables.move_to_end(key)
+        return _tables[key]
+
+    projection_table = None
+    if _disk_cache is not None:
+        projection_table = _disk_cache.get(key, table_type)
+    if projection_table is None:
+        projection_table = table_type.build(manifest, desired_width)
+        if _disk_cache is not None:
+            _disk_cache.put(key, projection_table)
+
+    _tables[key] = projection_table
+    while len(_tables) > MAX_CACHED_TABLES:
+        _tables.popitem(last=False)
+    return projection_table
+
+
+@contextmanager
+def cached_on_disk(dirpath, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+    '''read and save projection tables under dirpath within a block'''
+    global _disk_cache
+    previous = _disk_cache
+    _disk_cache = TableCache(dirpath, max_bytes)
+    try:
+        yield _disk_cache
+    finally:
+        _disk_cache = previous
+
+
+def table_key(manifest, desired_width, method=SPLAT):
+    '''hash of everything a table depends on'''
+    parts = {
+        "geometry": manifest.geometry(),
+        "width": desired_width,
+        "method": method,
+        "version": TABLE_VERSION
+    }
+    parts_str = json.dumps(parts, sort_keys=True)
+    return hashlib.sha1(parts_str.encode()).hexdigest()
+
+
+def blueprint_grid(manifest, desired_width):
+    '''geometry, image dimensions, scale and shape of the blueprint grid
+
+    The grid is desired_width wide, and a blueprint coordinate is
+    multiplied by scale to find its pixel.
+    '''
+    geom = Geometry.from_manifest(manifest)
+    dim = manifest.dimensions()
+
+    lower_right = manifest.image_corners()[3]
+    b_x, b_y = project_point(lower_right, geom, dim, 1)
+
+    scale = desired_width / b_x
+    shape = (int(b_y * scale), int(b_x * scale))
+    return geom, dim, scale, shape
+
+
+def project_point(coord, geom, dim, scale):
+    raw = mapping.image_to_blueprint(coord, geom, dim)
+    return tuple(int(round(x * scale)) for x in raw)
@@ -0,0 +1,160 @@
+'''render module
+
+Tools for drawing a heatmap over its job's control image.
+
+Overlaying means normalising the heatmap's counts, blurring them into
+a red layer the size of the image and adding that layer to the image.
+The blur is the expensive part, and the heatmap usually has not
+changed since the last overlay, so an OverlayRenderer keeps decoded
+control images and blurred layers. Layers are keyed by the heatmap's
+version() and the scale and blur used, so a heatmap is blurred again
+only when its counts change. Everything the size of the image is
+kept as uint8.
+
+overlay(...) renders through a renderer shared by the whole process,
+see shared_renderer().
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+import output
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+MAX_CACHED_CONTROLS = 4
+MAX_CACHED_LAYERS = 8
+
+CHANNEL_MAX = 255
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class OverlayRenderer(object):
+    """Overlays heatmaps on control images, caching the slow steps
+
+    Control images are keyed by file path and modification time, and
+    blurred heat layers by heatmap version, scale and blur. Both keep
+    their most recently used entries.
+    """
+
+    def __init__(self,
+                 max_controls=MAX_CACHED_CONTROLS,
+                 max_layers=MAX_CACHED_LAYERS):
+        super().__init__()
+        self.max_controls = max_controls
+        self.max_layers = max_layers
+        self.blurs = 0
+        self._controls = OrderedDict()
+        self._layers = OrderedDict()
+
+    def control(self, filepath):
+        '''decoded RGB pixels of a control image, as uint8'''
+        key = (os.path.abspath(filepath), os.stat(filepath).st_mtime_ns)
+
+        def decode():
+            with Image.open(filepath) as img:
+                return np.asarray(img.convert("RGB"))
+
+        return lookup(self._controls, key, decode, self.max_controls)
+
+    def heat_layer(self, heatmap, scale, blur):
+        '''blurred red layer of heatmap's counts, as uint8'''
+        key = (heatmap.version(), heatmap.cell, tuple(heatmap.size),
+               scale, blur)
+
+        def build():
+            self.blurs += 1
+            return blurred_layer(heatmap, scale, blur)
+
+        return lookup(self._layers, key, build, self.max_layers)
+
+    def overlay(self, heatmap, img_points, scale, blur):
+        '''img_points with heatmap's layer added to the red channel'''
+        layer = self.heat_layer(heatmap, scale, blur)
+        return add_red(img_points, layer)
+
+    def render(self, heatmap, control_filepath, output_filepath,
+               scale, blur):
+        overlaid = self.overlay(heatmap,
+                                self.control(control_filepath),
+                                scale,
+                                blur)
+        output.save(Image.fromarray(overlaid), output_filepath)
+
+
+###############################################################################
+# Render Tools                                                                #
+###############################################################################
+
+def overlay(heatmap, control_filepath, output_filepath, scale, blur):
+    '''render an overlay with the process's OverlayRenderer'''
+    _renderer.render(heatmap, control_filepath, output_filepath, scale, blur)
+
+
+def shared_renderer():
+    '''the OverlayRenderer kept for the life of the process'''
+    return _renderer
+
+
+def blurred_layer(heatmap, scale, blur):
+    '''counts scaled to 0..scale, upsampled to pixels and blurred'''
+    # normalise at cell resolution, before upsampling
+    counts = heatmap.cell_counts()
+    maximum = np.max(counts)
+    div = maximum if maximum else 1
+    scaled = (counts / div * scale).astype(np.uint8)
+
+    layer = upsample(scaled, heatmap.cell, heatmap.size)
+    red_img = Image.fromarray(layer, 'L')
+    return np.asarray(red_img.filter(ImageFilter.GaussianBlur(blur)))
+
+
+def upsample(cells, cell, size):
+    '''repeat each cell over its pixels, cropped to size'''
+    if cell == (1, 1):
+        return np.ascontiguousarray(cells)
+    width, height = size
+    cell_width, cell_height = cell
+    pixels = np.repeat(cells, cell_height, axis=0)
+    pixels = np.repeat(pixels, cell_width, axis=1)
+    return np.ascontiguousarray(pixels[:height, :width])
+
+
+def add_red(img_points, layer):
+    '''add a uint8 layer to the red channel, saturating at 255'''
+    overlaid = np.array(img_points, dtype=np.uint8)
+    red = overlaid[:, :, 0].astype(np.uint16) + layer
+    overlaid[:, :, 0] = np.minimum(red, CHANNEL_MAX)
+    return overlaid
+
+
+def lookup(entries, key, make, max_entries):
+    if key in entries:
+        entries.move_to_end(key)
+        return entries[key]
+
+    value = make()
+    entries[key] = value
+    while len(entries) > max_entries:
+        entries.popitem(last=False)
+    return value
+
+
+###############################################################################
+# Shared renderer                                                             #
+###############################################################################
+
+_renderer = OverlayRenderer()
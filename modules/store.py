@@ -0,0 +1,217 @@
+'''store module
+
+Append-only, memory-mapped storage for per-frame arrays.
+
+A FrameStore is a directory holding one fixed-shape array per frame
+and the time each frame was taken:
+
+    header.json     dtype, frame shape and any extra attributes
+    frames.bin      raw frame payload, frames x frame shape, C order
+    timestamps.bin  int64 seconds since the epoch, one per frame
+
+Appending a frame writes to the end of the two .bin files and never
+rewrites earlier data; write() overwrites one frame in place. An
+append that was interrupted leaves bytes past len() frames, which
+the next append cuts off before writing, so the two files stay in
+step. Reads
+memory-map the files, so looking at one frame, or a slice of frames
+in a time period, does not read any of the others.
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+HEADER_FILENAME = "header.json"
+FRAMES_FILENAME = "frames.bin"
+TIMESTAMPS_FILENAME = "timestamps.bin"
+
+DTYPE = "dtype"
+FRAME_SHAPE = "frame_shape"
+ATTRS = "attrs"
+VERSION = "version"
+
+STORE_VERSION = 1
+
+TIMESTAMP_DTYPE = np.int64
+EPOCH = datetime(1970, 1, 1)
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class FrameStore(object):
+
+    @staticmethod
+    def new(dirpath, frame_shape, dtype, attrs=None):
+        os.makedirs(dirpath, exist_ok=True)
+        header = {
+            VERSION: STORE_VERSION,
+            DTYPE: np.dtype(dtype).str,
+            FRAME_SHAPE: [int(x) for x in frame_shape],
+            ATTRS: attrs if attrs else {}
+        }
+        with open(os.path.join(dirpath, HEADER_FILENAME), 'w') as f:
+            json.dump(header, f)
+        for filename in [FRAMES_FILENAME, TIMESTAMPS_FILENAME]:
+            open(os.path.join(dirpath, filename), 'wb').close()
+        return FrameStore(dirpath, header)
+
+    @staticmethod
+    def load(dirpath):
+        with open(os.path.join(dirpath, HEADER_FILENAME)) as f:
+            header = json.load(f)
+        return FrameStore(dirpath, header)
+
+    @staticmethod
+    def exists(dirpath):
+        return os.path.isfile(os.path.join(dirpath, HEADER_FILENAME))
+
+    @staticmethod
+    def open_or_new(dirpath, frame_shape, dtype, attrs=None):
+        if not FrameStore.exists(dirpath):
+            return FrameStore.new(dirpath, frame_shape, dtype, attrs)
+
+        store = FrameStore.load(dirpath)
+        if store.frame_shape != tuple(frame_shape):
+            msg = "Store {} holds frames of shape {}, not {}"\
+                .format(dirpath, store.frame_shape, tuple(frame_shape))
+            raise ValueError(msg)
+        return store
+
+    def __init__(self, dirpath, header):
+        super().__init__()
+        self.dirpath = dirpath
+        self.dtype = np.dtype(header[DTYPE])
+        self.frame_shape = tuple(header[FRAME_SHAPE])
+        self.attrs = header[ATTRS]
+
+    def _path(self, filename):
+        return os.path.join(self.dirpath, filename)
+
+    def _frame_nbytes(self):
+        return int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        num_frames = os.path.getsize(self._path(FRAMES_FILENAME)) \
+            // self._frame_nbytes()
+        num_times = os.path.getsize(self._path(TIMESTAMPS_FILENAME)) \
+            // np.dtype(TIMESTAMP_DTYPE).itemsize
+        return min(num_frames, num_times)
+
+    def append(self, dt, frame):
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if frame.shape != self.frame_shape:
+            msg = "Frame shape {} does not match store shape {}"\
+                .format(frame.shape, self.frame_shape)
+            raise ValueError(msg)
+
+        # frames first: a frame without a timestamp is ignored by len()
+        self.truncate(len(self))
+        with open(self._path(FRAMES_FILENAME), 'ab') as f:
+            f.write(frame.tobytes())
+        with open(self._path(TIMESTAMPS_FILENAME), 'ab') as f:
+            f.write(np.array([to_timestamp(dt)], TIMESTAMP_DTYPE).tobytes())
+
+    def truncate(self, num_frames):
+        '''drop every frame after the first num_frames'''
+        os.truncate(self._path(FRAMES_FILENAME),
+                    num_frames * self._frame_nbytes())
+        os.truncate(self._path(TIMESTAMPS_FILENAME),
+                    num_frames * np.dtype(TIMESTAMP_DTYPE).itemsize)
+
+    def write(self, idx, frame):
+        '''overwrite the frame at idx in place'''
+        frame = np.asarray(frame)
+        if frame.shape != self.frame_shape:
+            msg = "Frame shape {} does not match store shape {}"\
+                .format(frame.shape, self.frame_shape)
+            raise ValueError(msg)
+        if not 0 <= idx < len(self):
+            raise IndexError("No frame {} in {}".format(idx, self.dirpath))
+
+        frames = np.memmap(self._path(FRAMES_FILENAME),
+                           dtype=self.dtype,
+                           mode='r+',
+                           offset=idx * self._frame_nbytes(),
+                           shape=self.frame_shape)
+        frames[...] = frame
+        frames.flush()
+
+    def frames(self):
+        num_frames = len(self)
+        shape = (num_frames,) + self.frame_shape
+        if not num_frames:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.memmap(self._path(FRAMES_FILENAME),
+                         dtype=self.dtype,
+                         mode='r',
+                         shape=shape)
+
+    def timestamps(self):
+        num_frames = len(self)
+        if not num_frames:
+            return np.zeros(0, dtype=TIMESTAMP_DTYPE)
+        return np.memmap(self._path(TIMESTAMPS_FILENAME),
+                         dtype=TIMESTAMP_DTYPE,
+                         mode='r',
+                         shape=(num_frames,))
+
+    def frame(self, idx):
+        return self.frames()[idx]
+
+    def time_taken(self, idx):
+        return from_timestamp(self.timestamps()[idx])
+
+    def period_frames(self, period):
+        '''frames taken within period in time order, and their timestamps
+
+        When the frames are stored in time order this is a view of the
+        memory-mapped store; otherwise the frames are gathered.
+        '''
+        idxs = self.indices(period)
+        frames = self.frames()
+        timestamps = self.timestamps()
+        if len(idxs) and np.all(np.diff(idxs) == 1):
+            window = slice(idxs[0], idxs[-1] + 1)
+            return frames[window], timestamps[window]
+        return frames[idxs], timestamps[idxs]
+
+    def indices(self, period):
+        '''indices of frames taken within period, in time order'''
+        timestamps = self.timestamps()
+        start = to_timestamp(period.start)
+        end = to_timestamp(period.end)
+
+        if np.all(timestamps[1:] >= timestamps[:-1]):
+            lo = np.searchsorted(timestamps, start, side='left')
+            hi = np.searchsorted(timestamps, end, side='right')
+            return np.arange(lo, hi)
+
+        inside = np.flatnonzero((timestamps >= start) & (timestamps <= end))
+        order = np.argsort(timestamps[inside], kind='stable')
+        return inside[order]
+
+
+###############################################################################
+# Helpers                                                                     #
+###############################################################################
+
+def to_timestamp(dt):
+    return int((dt - EPOCH).total_seconds())
+
+
+def from_timestamp(ts):
+    return EPOCH + timedelta(seconds=int(ts))
@@ -0,0 +1,36 @@
+'''fixtures shared by the test modules'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import json
+from pathlib import Path
+
+from pytest import fixture
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+MANIFEST_FILEPATH = str(Path(__file__).parents[1] / "examples" /
+                        "manifest.json")
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def small_manifest_json():
+    '''the example manifest shrunk to a 12x8 image'''
+    with open(MANIFEST_FILEPATH) as f:
+        manifest_json = json.load(f)
+    geometry = manifest_json["geometry"]
+    geometry["width"], geometry["height"] = 12, 8
+    corners = {"upperleft": [2, 1], "upperright": [9, 1],
+               "lowerleft": [2, 6], "lowerright": [9, 6]}
+    for corner, position in corners.items():
+        geometry[corner]["position"] = position
+    return manifest_json
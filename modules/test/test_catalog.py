@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+from datetime import datetime, timedelta
+
+from pytest import fixture
+
+from heatmap import TimePeriod
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+from catalog import FrameCatalog
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def start():
+    return datetime(2018, 5, 8, 14, 12, 15)
+
+
+@fixture
+def catalog_fp(tmpdir):
+    return str(tmpdir.join("catalog.txt"))
+
+
+@fixture
+def data_fps(tmpdir):
+    return [str(tmpdir.join("data", "{}.txt".format(i))) for i in range(4)]
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_empty_catalog(catalog_fp, start):
+    catalog = FrameCatalog.load(catalog_fp)
+    assert 0 == len(catalog)
+    assert [] == catalog.filepaths(TimePeriod(start, start))
+
+
+def test_filepaths_in_period(catalog_fp, data_fps, start):
+    catalog = FrameCatalog.load(catalog_fp)
+    for i in [3, 0, 2, 1]:
+        catalog.add(start + timedelta(seconds=10 * i), data_fps[i])
+
+    period = TimePeriod(start + timedelta(seconds=5),
+                        start + timedelta(seconds=20))
+    assert data_fps[1:3] == catalog.filepaths(period)
+
+
+def test_reload_last_entry_wins(catalog_fp, data_fps, start):
+    catalog = FrameCatalog.load(catalog_fp)
+    catalog.add(start, data_fps[0])
+    catalog.add(start + timedelta(seconds=30), data_fps[0])
+
+    loaded = FrameCatalog.load(catalog_fp)
+    assert 1 == len(loaded)
+    assert start + timedelta(seconds=30) == loaded.time_taken(data_fps[0])
+
+
+def test_trim_keeps_unknown(catalog_fp, data_fps, start):
+    catalog = FrameCatalog.load(catalog_fp)
+    catalog.add(start, data_fps[0])
+    catalog.add(start + timedelta(seconds=30), data_fps[1])
+
+    period = TimePeriod(start, start + timedelta(seconds=10))
+    trimmed = catalog.trim(data_fps[0:3], period)
+    assert [data_fps[0], data_fps[2]] == trimmed
+    assert os.path.basename(data_fps[0]) == os.path.basename(trimmed[0])
+
+
+def test_append_without_loading(catalog_fp, data_fps, start):
+    FrameCatalog.append(catalog_fp, start, data_fps[1])
+    FrameCatalog.append(catalog_fp, start - timedelta(seconds=5), data_fps[0])
+    FrameCatalog.append(catalog_fp, start, data_fps[1])
+    assert 3 == FrameCatalog.num_added(catalog_fp)
+
+    catalog = FrameCatalog.load(catalog_fp)
+    assert data_fps[0:2] == catalog.filepaths()
+    catalog.rewrite()
+    assert 2 == FrameCatalog.num_added(catalog_fp)
+    assert data_fps[0:2] == FrameCatalog.load(catalog_fp).filepaths()
@@ -0,0 +1,233 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pytest
+from pytest import fixture
+
+from common import assert_close
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import chunk
+from chunk import PixelChunk, IntegralImage
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+JOB_DIR = str(Path(__file__).parents[2] / "jobs" / "0")
+JOB_IMAGE = os.path.join(JOB_DIR, "images", "0.jpg")
+JOB_DATA = os.path.join(JOB_DIR, "data", "0.txt")
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def pixels():
+    rng = np.random.RandomState(0)
+    return rng.randint(0, 256, size=(30, 50, 3)).astype(np.uint8)
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_chunk_color_values_shape(pixels):
+    averages, variances = chunk.chunk_color_values(pixels, 16, 16)
+    assert (2, 4) == averages.shape
+    assert (2, 4) == variances.shape
+
+
+def test_chunk_color_values_partial_edges(pixels):
+    averages, variances = chunk.chunk_color_values(pixels, 16, 16)
+    for row, col in np.ndindex(averages.shape):
+        x, y = col * 16, row * 16
+        tile = pixels[y:y + 16, x:x + 16]
+        expected_avg, expected_var = reference_color_values(tile)
+        assert_close(expected_avg, averages[row, col], atol=1e-9)
+        assert_close(expected_var, variances[row, col], atol=1e-6)
+
+
+def test_add_chunk_matches_add_all_chunks(pixels):
+    single = PixelChunk(pixels, None, 50, 30, 16, 16, None)
+    every = PixelChunk(pixels, None, 50, 30, 16, 16, None)
+    for coord in chunk.coordinates((50, 30), 16, 16):
+        single.add_chunk(coord)
+    every.add_all_chunks()
+    assert single.rgb_chunks() == every.rgb_chunks()
+
+
+def test_integral_matches_block_reduction(pixels):
+    block = chunk.chunk_color_values(pixels, 16, 16)
+    integral = IntegralImage.new(pixels).chunk_color_values(16, 16)
+    for expected, actual in zip(block, integral):
+        assert_close(expected, actual, atol=1e-9)
+
+
+def test_integral_overlapping_chunks(pixels):
+    integral = IntegralImage.new(pixels)
+    averages, variances = integral.chunk_color_values(12, 10, 5, 4)
+    assert (8, 10) == averages.shape
+    for row, col in np.ndindex(averages.shape):
+        x, y = col * 5, row * 4
+        tile = pixels[y:y + 10, x:x + 12]
+        expected_avg, expected_var = reference_color_values(tile)
+        assert_close(expected_avg, averages[row, col], atol=1e-9)
+        assert_close(expected_var, variances[row, col], atol=1e-6)
+
+
+def test_strided_chunks_match_coordinates(pixels):
+    chunk_obj = PixelChunk(pixels, None, 50, 30, 16, 16, None)
+    chunk_obj.add_all_chunks(8, 8)
+    expected = chunk.coordinates((50, 30), 16, 16, 8, 8)
+    assert expected == set(chunk_obj.rgb_chunks().keys())
+
+
+def test_with_chunk_dimensions_shares_integral(pixels):
+    chunk_obj = PixelChunk(pixels, None, 50, 30, 16, 16, None)
+    integral = chunk_obj.integral()
+    resized = chunk_obj.with_chunk_dimensions(8, 8)
+    assert integral is resized.integral()
+    resized.add_all_chunks(4, 4)
+    assert 8 * 13 == len(resized.rgb_chunks())
+
+
+def test_pyramid_matches_single_levels(pixels):
+    levels = chunk.chunk_pyramid(pixels, [4, 8, 16, 12])
+    assert [4, 8, 12, 16] == sorted(levels)
+    for chunk_size, (averages, variances) in levels.items():
+        expected = chunk.chunk_color_values(pixels, chunk_size, chunk_size)
+        assert_close(expected[0], averages, atol=1e-9)
+        assert_close(expected[1], variances, atol=1e-6)
+
+
+def test_luminosity_grid_wrong_layout(pixels):
+    chunk_obj = PixelChunk(pixels, None, 50, 30, 16, 16, None)
+    chunk_obj.add_all_chunks()
+    with pytest.raises(ValueError):
+        chunk_obj.luminosity_grid(10, 10)
+
+
+def test_chunk_output_filepath():
+    assert "/a/b/0.txt" == chunk.chunk_output_filepath("/a/b/0.jpg")
+    assert "/c/0.txt" == chunk.chunk_output_filepath("/a/b/0.jpg", "/c")
+
+
+def test_batch_chunks_skips_up_to_date(tmpdir):
+    out_dir = str(tmpdir.join("out"))
+    report = chunk.batch_chunks([JOB_IMAGE], 40, 40, out_dir, workers=1)
+    assert 1 == report.chunked
+    assert 0 == report.skipped
+
+    report = chunk.batch_chunks([JOB_IMAGE], 40, 40, out_dir, workers=1)
+    assert 0 == report.chunked
+    assert 1 == report.skipped
+
+    # chunk files of another size are not up to date
+    report = chunk.batch_chunks([JOB_IMAGE], 80, 80, out_dir, workers=1)
+    assert 1 == report.chunked
+    assert 0 == report.skipped
+
+
+def test_batch_chunks_output_collision(tmpdir):
+    other_dir = tmpdir.mkdir("other")
+    other_image = str(other_dir.join(os.path.basename(JOB_IMAGE)))
+    shutil.copy(JOB_IMAGE, other_image)
+    out_dir = str(tmpdir.join("out"))
+    with pytest.raises(ValueError):
+        chunk.batch_chunks([JOB_IMAGE, other_image], 40, 40, out_dir)
+    assert not os.path.exists(out_dir)
+
+
+def test_expand_image_filepaths():
+    images_dir = os.path.dirname(JOB_IMAGE)
+    from_dir = chunk.expand_image_filepaths([images_dir])
+    from_glob = chunk.expand_image_filepaths([os.path.join(images_dir,
+                                                           "*.jpg")])
+    assert 10 == len(from_dir)
+    assert from_dir == from_glob
+
+
+def test_decode_scale():
+    assert 8 == chunk.decode_scale(8, [40, 40])
+    assert 4 == chunk.decode_scale(4, [40, 40])
+    assert 2 == chunk.decode_scale(8, [10, 20, 40, 80])
+    assert 1 == chunk.decode_scale(8, [25])
+
+
+def test_reduced_decode_close_to_full():
+    full = PixelChunk.new(JOB_IMAGE, 40, 40)
+    reduced = PixelChunk.new(JOB_IMAGE, 40, 40, 8)
+    assert 8 == reduced.scale
+    assert (90, 160, 3) == reduced.image.shape
+    full.add_all_chunks()
+    reduced.add_all_chunks()
+    assert_close(full.luminosity_grid(), reduced.luminosity_grid(), atol=1)
+
+
+def test_decode_accuracy():
+    results = chunk.decode_accuracy([JOB_IMAGE], 40, 40, scales=(8, 1))
+    assert [1, 8] == sorted(results)
+    assert 0 == results[1][1]
+    assert 0 < results[8][1] < 1
+
+    assert [2, 4] == sorted(chunk.decode_accuracy([], 40, 40, (4, 2)))
+
+
+def test_create_chunks_matches_job_data(tmpdir):
+    out = str(tmpdir.join("0.txt"))
+    chunk.create_chunks(JOB_IMAGE, out, 40, 40)
+
+    with open(out) as f:
+        created = json.load(f)
+    with open(JOB_DATA) as f:
+        expected = json.load(f)
+
+    assert set(expected.keys()) < set(created.keys())
+    assert (40, 40, 40, 40) == PixelChunk.of(out, 40, 40).layout()
+    assert expected[chunk.FILE_DATETIME] == created[chunk.FILE_DATETIME]
+    assert len(expected[chunk.CHUNK]) == len(created[chunk.CHUNK])
+
+    created_rgb = PixelChunk.of(out, 40, 40).rgb_chunks()
+    expected_rgb = PixelChunk.of(JOB_DATA, 40, 40).rgb_chunks()
+    for coord, value in expected_rgb.items():
+        assert_close(value, created_rgb[coord], atol=1e-9)
+
+
+###############################################################################
+# Helper functions                                                            #
+###############################################################################
+
+def reference_color_values(tile):
+    rgb = tile.reshape(-1, 3).astype(np.float64)
+    red, green, blue = rgb.mean(axis=0)
+    var_red, var_green, var_blue = rgb.var(axis=0)
+    average = (red * chunk.LUMINOSITY_RED_VALUE +
+               green * chunk.LUMINOSITY_GREEN_VALUE +
+               blue * chunk.LUMINOSITY_BLUE_VALUE)
+    covariance = (2.0 / 9.0) * (red ** 2 + green ** 2 + blue ** 2 -
+                                red * green - red * blue - blue * green)
+    variance = (var_red + var_green + var_blue) / 3.0 + covariance
+    return average, variance
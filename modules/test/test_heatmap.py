@@ -14,13 +14,19 @@ if cur_dir not in sys.path:
 ###############################################################################
 
 import os
+import json
+import shutil
+import pickle
+from datetime import timedelta
 
+import numpy as np
 from PIL import Image
 
 from common import assert_close
 
 from manifest import Manifest
 from image import ImageData, WholeImageData
+from image import ChunkImageData, FrameImageData, unparse_datetime
 
 from datetime import datetime
 from pytest import fixture
@@ -34,7 +40,8 @@ from unittest.mock import MagicMock
 ###############################################################################
 
 import heatmap
-from heatmap import TimePeriod, NullTimePeriod, Heatmap
+from heatmap import TimePeriod, NullTimePeriod, Heatmap, LiveHeatmap
+from heatmap import HeatmapHeader, HeatmapSeries, SeriesStore
 from heatmap import CoordRange
 
 
@@ -103,6 +110,18 @@ points = [
 ]
 
 
+@fixture
+def small_manifest(small_manifest_json):
+    manifest_json = small_manifest_json
+    manifest_json["chunk"] = {
+        "chunk_width": 5,
+        "chunk_height": 3,
+        "stride_x": 3,
+        "stride_y": 2
+    }
+    return Manifest(manifest_json)
+
+
 @fixture
 def img_corners():
     return [[0, 0], [10, 0], [0, 10], [10, 10]]
@@ -175,6 +194,387 @@ def test_is_movement_all(point, res, images):
                                       color_thresh=50)
 
 
+def test_record_frames_matches_loop(small_manifest):
+    rand = np.random.RandomState(0)
+    frames = [FrameImageData(small_manifest,
+                             rand.randint(0, 256, (4, 6, 3), dtype=np.uint8),
+                             datetime(2018, 3, 23, 21, 15, i),
+                             scale=2)
+              for i in range(4)]
+    assert_records_like_loop(small_manifest, FrameImageData, frames)
+
+
+def test_record_chunks_matches_loop(small_manifest):
+    rand = np.random.RandomState(0)
+    chunks = [ChunkImageData(small_manifest,
+                             rand.uniform(0, 100, (4, 4)),
+                             datetime(2018, 3, 23, 21, 15, i))
+              for i in range(4)]
+    assert_records_like_loop(small_manifest, ChunkImageData, chunks)
+
+
+def test_record_incremental_matches_batch(small_manifest):
+    rand = np.random.RandomState(0)
+    chunks = [ChunkImageData(small_manifest,
+                             rand.uniform(0, 100, (4, 4)),
+                             datetime(2018, 3, 23, 21, 15, i))
+              for i in range(6)]
+    batch = Heatmap.new(small_manifest)
+    batch.record_images(ChunkImageData, chunks, 3, 50)
+
+    incremental = Heatmap.new(small_manifest)
+    for end in range(1, len(chunks) + 1):
+        # overlapping, ever growing periods
+        incremental.record_images(ChunkImageData, chunks[:end], 3, 50)
+
+    assert batch.count == incremental.count
+    assert np.array_equal(batch._points, incremental._points)
+    assert chunks[-1].time_taken() == incremental.watermark
+
+
+def test_live_decays_by_half_life(small_manifest):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    hm = LiveHeatmap.new(small_manifest, 10)
+    hm.decay_to(start)
+    hm.add_counts(np.full(hm.cell_shape(), 4, dtype=np.uint16))
+    hm.decay_to(start + timedelta(seconds=20))
+    assert_close(1, hm.cell_counts())
+    hm.decay_to(start)
+    assert_close(1, hm.cell_counts())
+
+
+def test_live_record_weights_windows(small_manifest):
+    rand = np.random.RandomState(0)
+    chunks = [ChunkImageData(small_manifest,
+                             rand.uniform(0, 100, (4, 4)),
+                             datetime(2018, 3, 23, 21, 15, 4 * i))
+              for i in range(6)]
+    live = LiveHeatmap.new(small_manifest, 8)
+    for end in range(1, len(chunks) + 1):
+        live.record_images(ChunkImageData, chunks[:end], 3, 50)
+
+    expected = np.zeros(live.cell_shape())
+    last = chunks[-1].time_taken()
+    for window in heatmap.windows(chunks, 3):
+        hm = Heatmap.new(small_manifest)
+        hm.record_images(ChunkImageData, window, 3, 50)
+        age = (last - window[-1].time_taken()).total_seconds()
+        expected += hm.cell_counts() * 0.5 ** (age / 8)
+
+    assert 0 < np.max(expected)
+    assert_close(expected, live.cell_counts(), atol=1e-4)
+
+
+def test_live_save_load_round_trip(small_manifest, tmpdir):
+    hm = LiveHeatmap.new(small_manifest, 30)
+    hm.decay_to(datetime(2018, 3, 23, 21, 15, 0))
+    hm.add_counts(np.full(hm.cell_shape(), 3, dtype=np.uint16))
+    hm.decay_to(datetime(2018, 3, 23, 21, 15, 15))
+    fp = str(tmpdir.join("0.live.heatmap"))
+    hm.save(fp)
+
+    loaded = Heatmap.load(fp)
+    assert isinstance(loaded, LiveHeatmap)
+    assert 30 == loaded.half_life
+    assert hm.decayed_at == loaded.decayed_at
+    assert np.array_equal(hm.cell_counts(), loaded.cell_counts())
+    assert np.float32 == loaded.cell_counts().dtype
+
+
+def test_save_load_round_trip(small_manifest, tmpdir):
+    hm = recorded_heatmap(small_manifest)
+    fp = str(tmpdir.join("0.heatmap"))
+    hm.save(fp)
+
+    loaded = Heatmap.load(fp)
+    assert hm.count == loaded.count
+    assert hm.period.start == loaded.period.start
+    assert hm.period.end == loaded.period.end
+    assert isinstance(loaded.project_period, NullTimePeriod)
+    assert hm.watermark == loaded.watermark
+    assert np.array_equal(hm._points, loaded._points)
+    assert np.array_equal(hm._trailing[0].values(),
+                          loaded._trailing[0].values())
+    assert small_manifest.json == loaded.manifest.json
+
+
+def test_header_only(small_manifest, tmpdir):
+    hm = recorded_heatmap(small_manifest)
+    fp = str(tmpdir.join("0.heatmap"))
+    hm.save(fp)
+
+    header = HeatmapHeader.load(fp)
+    assert hm.count == header.count
+    assert hm.last_update() == header.last_update()
+    assert HeatmapHeader.of(hm).manifest_hash == header.manifest_hash
+
+
+def test_load_legacy_pickle(small_manifest, tmpdir):
+    hm = recorded_heatmap(small_manifest)
+    fp = str(tmpdir.join("0.heatmap"))
+    with open(fp, 'wb') as f:
+        pickle.dump(hm, f)
+
+    assert hm.count == HeatmapHeader.load(fp).count
+    loaded = Heatmap.load(fp)
+    loaded.save(fp)
+    assert np.array_equal(hm._points, Heatmap.load(fp)._points)
+
+
+def test_series_round_trip(small_manifest, tmpdir):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    series = HeatmapSeries.new(small_manifest, timedelta(seconds=45), start)
+    series._start_subheatmap(start, str(tmpdir))
+    fp = str(tmpdir.join("0.series"))
+    series.save(fp)
+
+    loaded = HeatmapSeries.load(fp)
+    assert timedelta(seconds=45) == loaded.interval
+    assert start == loaded.start
+    assert start == loaded.current
+    assert [start] == loaded.starts()
+
+
+def test_series_store_reads_one_interval(small_manifest, tmpdir):
+    shape = heatmap.cell_grid_shape(small_manifest)
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    for i in range(3):
+        period = TimePeriod(start + timedelta(seconds=45 * i),
+                            start + timedelta(seconds=45 * i + 30))
+        store.append(period.start, np.full(shape, i), 10 * i, period)
+    store.write(1, np.full(shape, 7), 70, NullTimePeriod())
+
+    loaded = SeriesStore.open_or_new(str(tmpdir), shape)
+    assert 3 == len(loaded)
+    assert np.all(7 == loaded.counts(1))
+    assert np.all(2 == loaded.counts(2))
+    assert 70 == loaded.count(1)
+    assert isinstance(loaded.period(1), NullTimePeriod)
+    assert start + timedelta(seconds=120) == loaded.period(2).end
+    assert [0, 70, 20] == [c for c, _ in loaded.all_intervals()]
+
+
+def test_series_range_sums_intervals(small_manifest, tmpdir):
+    shape = heatmap.cell_grid_shape(small_manifest)
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    interval = timedelta(seconds=45)
+    rand = np.random.RandomState(0)
+    grids = [rand.randint(0, 100, shape) for _ in range(5)]
+    for i, grid in enumerate(grids):
+        interval_start = start + i * interval
+        period = TimePeriod(interval_start, interval_start + interval)
+        store.append(interval_start, grid, i + 1, period)
+    grids[1] = grids[1] // 2
+    store.write(1, grids[1], 2, TimePeriod(start + interval,
+                                           start + 2 * interval))
+
+    counts, count, period = store.range_counts(start + interval,
+                                               start + 4 * interval)
+    assert np.array_equal(sum(grids[1:4]), counts)
+    assert 2 + 3 + 4 == count
+    assert start + interval == period.start
+    assert start + 4 * interval == period.end
+
+    # late interval: the range is no longer one run of the store
+    late_start = start + 5 * interval
+    store.append(late_start, grids[0], 1, TimePeriod(late_start, late_start))
+    store.append(start - interval, grids[4], 1, NullTimePeriod())
+    counts, _, _ = store.range_counts(start - interval, start + interval)
+    assert np.array_equal(grids[4] + grids[0], counts)
+
+
+def test_series_store_rejects_overflowing_counts(small_manifest, tmpdir):
+    shape = heatmap.cell_grid_shape(small_manifest)
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    store.append(start, np.ones(shape, dtype=np.uint64), 1, NullTimePeriod())
+
+    too_many = np.full(shape, 2 ** 32, dtype=np.uint64)
+    with pytest.raises(OverflowError):
+        store.append(start, too_many, 1, NullTimePeriod())
+    with pytest.raises(OverflowError):
+        store.write(0, too_many, 1, NullTimePeriod())
+    assert 1 == len(store)
+    assert np.all(1 == store.counts(0))
+
+
+def test_series_store_append_after_interrupted_append(small_manifest,
+                                                      tmpdir):
+    shape = heatmap.cell_grid_shape(small_manifest)
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    store.append(start, np.full(shape, 1), 1, NullTimePeriod())
+    # only the interval row of the second append was written
+    store._intervals.append(start + timedelta(seconds=45),
+                            heatmap.interval_row(2, NullTimePeriod()))
+    assert 1 == len(store)
+
+    later = start + timedelta(seconds=90)
+    assert 1 == store.append(later, np.full(shape, 3), 3, NullTimePeriod())
+    assert 2 == len(store)
+    assert 3 == store.count(1)
+    assert np.all(3 == store.counts(1))
+    counts, count, _ = store.range_counts(start,
+                                          later + timedelta(seconds=1))
+    assert np.all(4 == counts)
+    assert 4 == count
+
+
+def test_series_store_fills_running_sums(small_manifest, tmpdir):
+    shape = heatmap.cell_grid_shape(small_manifest)
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    for i in range(3):
+        store.append(start + timedelta(seconds=45 * i),
+                     np.full(shape, i + 1), 1, NullTimePeriod())
+    shutil.rmtree(str(tmpdir.join(heatmap.SERIES_CUMULATIVE_DIR)))
+
+    store = SeriesStore.open_or_new(str(tmpdir), shape)
+    assert 3 == len(store)
+    counts, _, _ = store.range_counts(start, start + timedelta(seconds=90))
+    assert np.all(3 == counts)
+
+
+def test_range_heatmap(small_manifest, tmpdir):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    interval = timedelta(seconds=45)
+    series = HeatmapSeries.new(small_manifest, interval, start)
+    series_fp = str(tmpdir.join("0.series"))
+    current_fp = str(tmpdir.join(heatmap.CURRENT_HEATMAP_FILENAME))
+    for i in range(3):
+        series._start_subheatmap(start + i * interval, str(tmpdir))
+        hm = Heatmap.load(current_fp)
+        hm.add_counts(np.full(hm.cell_shape(), i + 1, dtype=np.uint16))
+        hm.save(current_fp)
+        series.store_subheatmap(current_fp)
+    series.save(series_fp)
+
+    out_fp = str(tmpdir.join("range.bmp"))
+    hm = heatmap.range_heatmap(series_fp, start + interval,
+                               start + 3 * interval, out_fp)
+    assert np.all(5 == hm.cell_counts())
+    assert hm.count == 5 * hm.cell_counts().size
+    assert os.path.isfile(out_fp)
+
+
+def test_series_stores_recorded_interval(small_manifest, tmpdir):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    series = HeatmapSeries.new(small_manifest, timedelta(seconds=45), start)
+    series._start_subheatmap(start, str(tmpdir))
+
+    current_fp = str(tmpdir.join(heatmap.CURRENT_HEATMAP_FILENAME))
+    hm = Heatmap.load(current_fp)
+    hm.add_counts(np.ones(hm.cell_shape(), dtype=np.uint16))
+    hm.save(current_fp)
+    series.store_subheatmap(current_fp)
+
+    stored = series.subheatmap(0)
+    assert np.array_equal(hm.cell_counts(), stored.cell_counts())
+    assert hm.count == series.subheatmap_headers()[0].count
+
+
+def test_series_resumes_earlier_interval(small_manifest, tmpdir):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    interval = timedelta(seconds=45)
+    series = HeatmapSeries.new(small_manifest, interval, start)
+    current_fp = str(tmpdir.join(heatmap.CURRENT_HEATMAP_FILENAME))
+    rand = np.random.RandomState(0)
+    chunks = [ChunkImageData(small_manifest,
+                             rand.uniform(0, 100, (4, 4)),
+                             start + timedelta(seconds=i))
+              for i in range(8)]
+
+    def record(record_start, images):
+        series._start_subheatmap(record_start, str(tmpdir))
+        hm = Heatmap.load(current_fp)
+        hm.record_images(ChunkImageData, images, 3, 50)
+        hm.save(current_fp)
+        series.store_subheatmap(current_fp)
+
+    # a late frame arrives after the next interval was started
+    record(start, chunks[:5])
+    record(start + interval, [])
+    record(start, chunks)
+
+    batch = Heatmap.new(small_manifest)
+    batch.record_images(ChunkImageData, chunks, 3, 50)
+    resumed = series.subheatmap(0)
+    assert batch.count == resumed.count
+    assert np.array_equal(batch.cell_counts(), resumed.cell_counts())
+    assert chunks[-1].time_taken() == resumed.watermark
+
+
+def test_series_imports_heatmap_files(small_manifest, tmpdir):
+    start = datetime(2018, 3, 23, 21, 15, 0)
+    heatmaps = []
+    for i in range(2):
+        hm = recorded_heatmap(small_manifest)
+        hm.period = TimePeriod(start + timedelta(seconds=45 * i),
+                               start + timedelta(seconds=45 * i + 40))
+        fp = str(tmpdir.join("{}.heatmap".format(i)))
+        hm.save(fp)
+        heatmaps.append([unparse_datetime(hm.period.start), fp])
+
+    series_fp = str(tmpdir.join("0.series"))
+    with open(series_fp, 'w') as f:
+        json.dump({"manifest": small_manifest.json,
+                   "interval": 45,
+                   "start": unparse_datetime(start),
+                   "heatmaps": heatmaps}, f)
+
+    for _ in range(2):
+        series = HeatmapSeries.load(series_fp)
+        assert 2 == len(series)
+    assert np.array_equal(hm.cell_counts(),
+                          series.subheatmap(1).cell_counts())
+    assert hm.period.end == series.subheatmap_headers()[1].period.end
+
+
+def test_counts_promote(small_manifest):
+    hm = Heatmap.new(small_manifest)
+    assert np.uint16 == hm._points.dtype
+    counts = np.zeros((8, 12), dtype=np.int64)
+    counts[1, 2] = 65535
+    hm.add_counts(counts)
+    assert np.uint16 == hm._points.dtype
+    hm.add((2, 1))
+    assert np.uint32 == hm._points.dtype
+    assert 65536 == hm.at((2, 1))
+    assert 65536 == hm.count
+
+
+@pytest.mark.parametrize("chunk", [(5, 3, 5, 3), (4, 4, 2, 2)])
+def test_chunk_cells_match_pixels(small_manifest, chunk):
+    chunk_json = dict(zip(["chunk_width", "chunk_height",
+                           "stride_x", "stride_y"], chunk))
+    pixel_manifest = Manifest(dict(small_manifest.json, chunk=chunk_json))
+    cell_manifest = Manifest(dict(pixel_manifest.json,
+                                  heatmap_resolution="chunk"))
+    assert (chunk[2], chunk[3]) == cell_manifest.heatmap_cell()
+
+    rows, cols = -(-8 // chunk[3]), -(-12 // chunk[2])
+    rand = np.random.RandomState(0)
+    grids = [rand.uniform(0, 100, (rows, cols)) for i in range(4)]
+
+    def recorded(manifest):
+        hm = Heatmap.new(manifest)
+        chunks = [ChunkImageData(manifest,
+                                 grid,
+                                 datetime(2018, 3, 23, 21, 15, i))
+                  for i, grid in enumerate(grids)]
+        hm.record_images(ChunkImageData, chunks, 2, 50)
+        return hm
+
+    pixels = recorded(pixel_manifest)
+    cells = recorded(cell_manifest)
+    assert (rows, cols) == cells.cell_shape()
+    assert pixels.count == cells.count
+    assert np.array_equal(pixels.pixel_counts(), cells.pixel_counts())
+    assert pixels.at((11, 7)) == cells.at((11, 7))
+
+
 def test_include_in_period(manifest, filtered_images):
     hm = Heatmap.new(manifest)
     hm.include_in_period(filtered_images)
@@ -215,6 +615,17 @@ def test_coord_range_outside(coord_range):
 # Helper functions                                                            #
 ###############################################################################
 
+def recorded_heatmap(manifest):
+    rand = np.random.RandomState(0)
+    chunks = [ChunkImageData(manifest,
+                             rand.uniform(0, 100, (4, 4)),
+                             datetime(2018, 3, 23, 21, 15, i))
+              for i in range(4)]
+    hm = Heatmap.new(manifest)
+    hm.record_images(ChunkImageData, chunks, 2, 50)
+    return hm
+
+
 def pairwise(lis):
     return zip(lis, lis[1:])
 
@@ -223,6 +634,23 @@ def pairwise(lis):
 # Asserts                                                                          #
 ###############################################################################
 
+def assert_records_like_loop(manifest, data_type, images):
+    hm = Heatmap.new(manifest)
+    hm.record_images(data_type, images, 3, 50)
+
+    expected = Heatmap.new(manifest)
+    for image_set in heatmap.windows(images, 3):
+        for coord in data_type.coordinates(manifest, expected.size):
+            expected.include_in_period(image_set)
+            if heatmap.is_movement(image_set, coord, 50):
+                image_set[0].register(expected, coord)
+
+    assert 0 < hm.count
+    assert expected.count == hm.count
+    assert np.array_equal(expected._points, hm._points)
+    assert expected.period.start == hm.period.start
+    assert expected.period.end == hm.period.end
+
 
 
 ###############################################################################
@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+import shutil
+
+from pytest import fixture
+
+from manifest import Manifest
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import image
+from image import ImageData, ImageCache
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+JOB_DATA_DIR = str(Path(__file__).parents[2] / "jobs" / "0" / "data")
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def manifest():
+    return Manifest({
+        "chunk": {
+            "chunk_width": 40,
+            "chunk_height": 40
+        }
+    })
+
+
+@fixture
+def data_fps():
+    return [os.path.join(JOB_DATA_DIR, "{}.txt".format(i)) for i in range(3)]
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_cache_hits(manifest, data_fps):
+    cache = ImageCache()
+    first = cache.get(manifest, data_fps[0])
+    assert first is cache.get(manifest, data_fps[0])
+    assert 1 == cache.hits
+    assert 1 == cache.misses
+
+
+def test_cache_evicts_least_recent(manifest, data_fps):
+    one_frame = ImageData.create_uncached(manifest, data_fps[0]).nbytes()
+    cache = ImageCache(2 * one_frame)
+    first = cache.get(manifest, data_fps[0])
+    cache.get(manifest, data_fps[1])
+    cache.get(manifest, data_fps[0])
+    cache.get(manifest, data_fps[2])
+    assert 2 == len(cache)
+    assert first is cache.get(manifest, data_fps[0])
+    assert 3 == cache.misses
+
+
+def test_cache_rereads_modified_file(manifest, data_fps, tmpdir):
+    fp = str(tmpdir.join("0.txt"))
+    shutil.copy(data_fps[0], fp)
+    cache = ImageCache()
+    first = cache.get(manifest, fp)
+    os.utime(fp, ns=(0, 0))
+    assert first is not cache.get(manifest, fp)
+    assert 2 == cache.misses
+
+
+def test_cached_scopes_create(manifest, data_fps):
+    with image.cached() as cache:
+        first = ImageData.create(manifest, data_fps[0])
+        assert first is ImageData.create(manifest, data_fps[0])
+        assert 1 == cache.hits
+    assert first is not ImageData.create(manifest, data_fps[0])
@@ -260,6 +260,55 @@ def test_transform_itb_corners(sample_geom,
         assert_close(map_corner, transformed)
 
 
+def test_itb_array_matches_scalar():
+    manifest = Manifest.from_filepath("examples/manifest.json")
+    geom = Geometry.from_manifest(manifest)
+    dim = manifest.dimensions()
+    rand = np.random.RandomState(0)
+    coords = np.column_stack([rand.randint(0, dim[0], 500),
+                              rand.randint(0, dim[1], 500)])
+
+    expected = [mapping.image_to_blueprint(list(c), geom, dim)
+                for c in coords]
+    transformed = mapping.image_to_blueprint_array(coords, geom, dim)
+    assert np.array_equal(np.array(expected), transformed)
+
+
+def test_bti_array_matches_scalar():
+    manifest = Manifest.from_filepath("examples/manifest.json")
+    geom = Geometry.from_manifest(manifest)
+    dim = manifest.dimensions()
+    rand = np.random.RandomState(0)
+    coords = rand.uniform(-5, 25, (500, 2))
+
+    expected = [mapping.blueprint_to_image(list(c), geom, dim)
+                for c in coords]
+    transformed = mapping.blueprint_to_image_array(coords, geom, dim)
+    assert np.array_equal(np.array(expected), transformed)
+
+
+def test_homographies_match_vectors():
+    manifest = Manifest.from_filepath("examples/manifest.json")
+    geom = Geometry.from_manifest(manifest)
+    rand = np.random.RandomState(0)
+
+    for image_coord in rand.uniform(-0.5, 0.5, (200, 2)).tolist():
+        assert_close(geom.transform_itb_vectors(image_coord),
+                     geom.transform_itb(image_coord),
+                     atol=1e-9)
+    for blueprint_coord in rand.uniform(-5, 25, (200, 2)).tolist():
+        assert_close(geom.transform_bti_vectors(blueprint_coord),
+                     geom.transform_bti(blueprint_coord),
+                     atol=1e-9)
+
+
+def test_itb_array_invalid_coords(geom, dim):
+    with pytest.raises(ValueError):
+        mapping.image_to_blueprint_array([[5, 5], [-5, 5]], geom, dim)
+    with pytest.raises(ValueError):
+        mapping.image_to_blueprint_array([[5, 5], [5, 1001]], geom, dim)
+
+
 def test_compute_normal(raw_3d):
     assert_close(np.array([0, 0, -1]),
                  Geometry.compute_normal(raw_3d))
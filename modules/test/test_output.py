@@ -0,0 +1,134 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+
+import numpy as np
+from PIL import Image
+from pytest import fixture
+import pytest
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import output
+from output import OutputWriter
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def img():
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(24, 40, 3)).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+###############################################################################
+# Helpers                                                                     #
+###############################################################################
+
+class Unencodable(object):
+
+    def save(self, *args, **kwargs):
+        raise OSError("cannot encode")
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+@pytest.mark.parametrize("fmt", [output.BMP, output.PNG])
+def test_lossless_formats_round_trip(img, tmpdir, fmt):
+    fp = str(tmpdir.join(output.filename("heatmap", fmt)))
+    report = output.write_image(img, fp)
+    assert os.path.getsize(fp) == report.nbytes
+    with Image.open(fp) as saved:
+        assert np.array_equal(np.asarray(img), np.asarray(saved))
+
+
+@pytest.mark.parametrize("fmt", [output.WEBP, output.JPEG])
+def test_quality_sets_size(img, tmpdir, fmt):
+    low = output.write_image(img, str(tmpdir.join(
+        output.filename("low", fmt))), quality=10)
+    high = output.write_image(img, str(tmpdir.join(
+        output.filename("high", fmt))), quality=95)
+    assert low.nbytes < high.nbytes
+
+
+def test_unknown_format(tmpdir):
+    with pytest.raises(ValueError):
+        output.filename("heatmap", "gif")
+    with pytest.raises(ValueError):
+        output.format_of(str(tmpdir.join("heatmap.gif")))
+
+
+def test_saves_to_same_file_keep_order(img, tmpdir):
+    writer = OutputWriter(output.PNG, threads=4)
+    fp = str(tmpdir.join("overlay.png"))
+    last = img.transpose(Image.FLIP_LEFT_RIGHT)
+    with output.writing(writer):
+        for _ in range(5):
+            output.save(img, fp)
+        output.save(last, fp)
+        output.wait()
+    writer.close()
+
+    assert 6 == len(writer.reports)
+    with Image.open(fp) as saved:
+        assert np.array_equal(np.asarray(last), np.asarray(saved))
+
+
+def test_after_runs_once_saved(img, tmpdir):
+    writer = OutputWriter(output.PNG)
+    fp = str(tmpdir.join("project.png"))
+    sizes = []
+    with output.writing(writer):
+        output.save(img, fp)
+        output.after(fp, lambda: sizes.append(os.path.getsize(fp)))
+        output.wait()
+    writer.close()
+    assert [writer.reports[0].nbytes] == sizes
+
+
+def test_save_outside_writer_is_immediate(img, tmpdir):
+    fp = str(tmpdir.join("heatmap.bmp"))
+    output.save(img, fp)
+    assert os.path.isfile(fp)
+
+
+def test_failed_save_does_not_block_later_saves(img, tmpdir):
+    writer = OutputWriter(output.PNG)
+    fp = str(tmpdir.join("heatmap.png"))
+    with output.writing(writer):
+        output.save(Unencodable(), fp)
+        output.save(img, fp)
+        output.save(img, fp)
+        output.wait()
+    writer.close()
+
+    assert 2 == len(writer.reports)
+    assert ["heatmap.png"] == os.listdir(str(tmpdir))
+
+
+def test_failed_write_removes_tmp_file(img, tmpdir):
+    fp = str(tmpdir.join("heatmap.bmp"))
+    os.mkdir(fp)
+    with pytest.raises(OSError):
+        output.write_image(img, fp)
+    assert ["heatmap.bmp"] == os.listdir(str(tmpdir))
@@ -0,0 +1,195 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from pytest import fixture
+
+from common import assert_close
+
+from manifest import Manifest
+from mapping import Geometry
+import mapping
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import projection
+from projection import ProjectionTable, SampleTable, CoordRange, TableCache
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+MANIFEST_FILEPATH = str(Path(__file__).parents[1] / "examples" /
+                        "manifest.json")
+
+PROJECT_WIDTH = 60
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def manifest():
+    manifest = Manifest.from_filepath(MANIFEST_FILEPATH)
+    geometry = manifest.json["geometry"]
+    geometry["width"], geometry["height"] = 64, 36
+    corners = {"upperleft": [12, 12], "upperright": [36, 12],
+               "lowerleft": [12, 36], "lowerright": [35, 35]}
+    for corner, position in corners.items():
+        geometry[corner]["position"] = position
+    return manifest
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_table_matches_point_mapping(manifest):
+    table = ProjectionTable.build(manifest, PROJECT_WIDTH)
+    geom = Geometry.from_manifest(manifest)
+    dim = manifest.dimensions()
+
+    lower_right = manifest.image_corners()[3]
+    b_x, _ = projection.project_point(lower_right, geom, dim, 1)
+    scale = PROJECT_WIDTH / b_x
+
+    expected = {}
+    for coord in CoordRange(manifest.image_corners()).coordinates():
+        p_x, p_y = projection.project_point(coord, geom, dim, scale)
+        if 0 <= p_y < table.shape[0] and 0 <= p_x < table.shape[1]:
+            expected[coord] = p_y * table.shape[1] + p_x
+
+    assert 0 < len(table)
+    assert expected == dict(zip(zip(table.xs.tolist(), table.ys.tolist()),
+                                table.targets.tolist()))
+
+
+def test_project_sums_values(manifest):
+    table = ProjectionTable.build(manifest, PROJECT_WIDTH)
+    values = np.arange(len(table), dtype=np.float64)
+
+    expected = np.zeros(table.shape)
+    for target, value in zip(table.targets, values):
+        expected.flat[target] += value
+    assert np.array_equal(expected, table.project(values))
+
+
+def test_table_is_cached(manifest):
+    table = projection.table(manifest, PROJECT_WIDTH)
+    assert table is projection.table(manifest, PROJECT_WIDTH)
+    assert table is not projection.table(manifest, PROJECT_WIDTH + 1)
+
+
+def test_sample_table_matches_point_mapping(manifest):
+    table = SampleTable.build(manifest, PROJECT_WIDTH)
+    geom = Geometry.from_manifest(manifest)
+    dim = manifest.dimensions()
+    _, _, scale, _ = projection.blueprint_grid(manifest, PROJECT_WIDTH)
+
+    assert 0 < len(table)
+    for i in range(0, len(table), 97):
+        p_y, p_x = divmod(table.targets[i], table.shape[1])
+        x, y = mapping.blueprint_to_image((p_x / scale, p_y / scale),
+                                          geom, dim)
+        assert_close(x, table.x0[i] + table.fx[i], atol=1e-9)
+        assert_close(y, table.y0[i] + table.fy[i], atol=1e-9)
+
+
+def test_bilinear_has_no_holes(manifest):
+    # wider than the field of interest, so splatting leaves holes
+    desired_width = 4 * PROJECT_WIDTH
+    splat = ProjectionTable.build(manifest, desired_width)
+    bilinear = SampleTable.build(manifest, desired_width)
+
+    def ones(coord):
+        return np.ones(len(coord[0]))
+
+    rendered = bilinear.render(ones)
+    assert splat.shape == bilinear.shape
+    assert np.all(rendered.flat[bilinear.targets] == 1)
+    assert len(np.unique(splat.targets)) < len(bilinear)
+
+
+def test_bilinear_interpolates(manifest):
+    table = SampleTable.build(manifest, PROJECT_WIDTH)
+
+    def xs(coord):
+        return coord[0].astype(np.float64)
+
+    rendered = table.render(xs)
+    expected = table.x0 + table.fx * (table.x1 - table.x0)
+    assert_close(expected, rendered.flat[table.targets], atol=1e-9)
+
+
+def test_disk_cache_round_trip(manifest, tmpdir):
+    built = ProjectionTable.build(manifest, PROJECT_WIDTH)
+    cache = TableCache(str(tmpdir))
+    assert cache.get("key") is None
+
+    cache.put("key", built)
+    loaded = cache.get("key")
+    assert built.shape == loaded.shape
+    assert np.array_equal(built.xs, loaded.xs)
+    assert np.array_equal(built.ys, loaded.ys)
+    assert np.array_equal(built.targets, loaded.targets)
+
+
+def test_table_reads_disk_cache(manifest, tmpdir, monkeypatch):
+    monkeypatch.setattr(projection, "_tables", OrderedDict())
+    with projection.cached_on_disk(str(tmpdir)) as cache:
+        built = projection.table(manifest, PROJECT_WIDTH)
+        assert 0 < cache.nbytes()
+
+    # as if restarted: nothing in memory, so the table comes from disk
+    monkeypatch.setattr(projection, "_tables", OrderedDict())
+    monkeypatch.setattr(ProjectionTable, "build", None)
+    with projection.cached_on_disk(str(tmpdir)):
+        loaded = projection.table(manifest, PROJECT_WIDTH)
+    assert np.array_equal(built.targets, loaded.targets)
+
+
+def test_disk_cache_evicts_least_recent(manifest, tmpdir):
+    built = ProjectionTable.build(manifest, PROJECT_WIDTH)
+    one_table = TableCache(str(tmpdir.join("sizing")))
+    one_table.put("a", built)
+
+    cache = TableCache(str(tmpdir.join("cache")), 2 * one_table.nbytes())
+    cache.put("a", built)
+    cache.put("b", built)
+    os.utime(cache._filepaths("a")[0], (0, 0))
+    os.utime(cache._filepaths("b")[0], (1, 1))
+    cache.get("a")
+    cache.put("c", built)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+def test_disk_cache_round_trips_sample_table(manifest, tmpdir):
+    built = SampleTable.build(manifest, PROJECT_WIDTH)
+    cache = TableCache(str(tmpdir))
+    cache.put("key", built)
+
+    loaded = cache.get("key", SampleTable)
+    assert built.shape == loaded.shape
+    assert np.array_equal(built.to_array(), loaded.to_array())
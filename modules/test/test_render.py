@@ -0,0 +1,134 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import numpy as np
+from PIL import Image, ImageFilter
+from pytest import fixture
+
+from manifest import Manifest
+from heatmap import Heatmap
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import render
+from render import OverlayRenderer
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+SCALE = 100
+BLUR = 2
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def manifest(small_manifest_json):
+    return Manifest(small_manifest_json)
+
+
+@fixture
+def hm(manifest):
+    hm = Heatmap.new(manifest)
+    counts = np.zeros(hm.cell_shape(), dtype=np.uint16)
+    counts[2:5, 3:8] = 1
+    counts[3, 5] = 3
+    hm.add_counts(counts)
+    return hm
+
+
+@fixture
+def control_fp(tmpdir):
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(8, 12, 3)).astype(np.uint8)
+    pixels[0, 0] = 255
+    fp = str(tmpdir.join("control.png"))
+    Image.fromarray(pixels).save(fp)
+    return fp
+
+
+###############################################################################
+# Helpers                                                                     #
+###############################################################################
+
+def float_overlay(hm, img_points, scale, blur):
+    '''the float64 overlay the renderer replaces'''
+    counts = hm.pixel_counts()
+    maximum = np.max(counts)
+    points = counts / (maximum if maximum else 1) * scale
+
+    red_points_8bit = np.zeros(counts.shape + (3,), dtype='uint8')
+    red_points_8bit[:, :, 0] = points.astype('uint8')
+    red_img = Image.fromarray(red_points_8bit)
+    red_points = np.asarray(red_img.filter(ImageFilter.GaussianBlur(blur)),
+                            dtype='float64')
+
+    combined = np.asarray(img_points, dtype='float64') + red_points
+    return np.clip(combined, 0, 255).astype('uint8')
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_overlay_matches_float_overlay(hm, control_fp):
+    renderer = OverlayRenderer()
+    img_points = renderer.control(control_fp)
+    assert np.array_equal(float_overlay(hm, img_points, SCALE, BLUR),
+                          renderer.overlay(hm, img_points, SCALE, BLUR))
+
+
+def test_layer_blurred_once_per_version(hm, control_fp):
+    renderer = OverlayRenderer()
+    img_points = renderer.control(control_fp)
+    first = renderer.overlay(hm, img_points, SCALE, BLUR)
+    assert np.array_equal(first, renderer.overlay(hm, img_points,
+                                                  SCALE, BLUR))
+    assert 1 == renderer.blurs
+
+    renderer.overlay(hm, img_points, SCALE, BLUR + 1)
+    assert 2 == renderer.blurs
+
+    hm.add_counts(np.ones(hm.cell_shape(), dtype=np.uint16))
+    renderer.overlay(hm, img_points, SCALE, BLUR)
+    assert 3 == renderer.blurs
+
+
+def test_control_decoded_once(control_fp):
+    renderer = OverlayRenderer()
+    assert renderer.control(control_fp) is renderer.control(control_fp)
+
+
+def test_add_red_saturates():
+    img_points = np.full((2, 2, 3), 200, dtype=np.uint8)
+    layer = np.array([[0, 55], [56, 255]], dtype=np.uint8)
+    overlaid = render.add_red(img_points, layer)
+    assert [[200, 255], [255, 255]] == overlaid[:, :, 0].tolist()
+    assert np.all(overlaid[:, :, 1:] == 200)
+
+
+def test_heatmap_overlay_uses_shared_renderer(hm, control_fp, tmpdir):
+    renderer = render.shared_renderer()
+    blurs = renderer.blurs
+    with Image.open(control_fp) as img:
+        for name in ["first.png", "second.png"]:
+            hm.overlay(img, str(tmpdir.join(name)), SCALE, BLUR)
+    assert blurs + 1 == renderer.blurs
@@ -0,0 +1,263 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from pytest import fixture
+
+from manifest import Manifest
+from heatmap import TimePeriod
+from image import ChunkImageData, FrameImageData, store_data_type
+from chunk import PixelChunk
+import access
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import store
+from store import FrameStore
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+JOB_DIR = str(Path(__file__).parents[2] / "jobs" / "0")
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def start():
+    return datetime(2018, 5, 8, 14, 12, 15)
+
+
+@fixture
+def frames():
+    return [np.full((2, 3), i, dtype=np.float32) for i in range(4)]
+
+
+@fixture
+def manifest():
+    return Manifest({
+        "chunk": {
+            "chunk_width": 40,
+            "chunk_height": 40
+        }
+    })
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_empty_store(tmpdir):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    assert 0 == len(s)
+    assert (0, 2, 3) == s.frames().shape
+
+
+def test_append_and_reload(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32, {"a": 1})
+    for i, frame in enumerate(frames):
+        s.append(start + timedelta(seconds=i), frame)
+
+    loaded = FrameStore.load(str(tmpdir))
+    assert 4 == len(loaded)
+    assert {"a": 1} == loaded.attrs
+    assert np.array_equal(frames[2], loaded.frame(2))
+    assert start + timedelta(seconds=3) == loaded.time_taken(3)
+
+
+def test_append_after_interrupted_append(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    s.append(start, frames[0])
+    # the frame was written but not its timestamp
+    with open(str(tmpdir.join(store.FRAMES_FILENAME)), 'ab') as f:
+        f.write(frames[1].tobytes())
+    assert 1 == len(s)
+
+    s.append(start + timedelta(seconds=2), frames[2])
+    assert 2 == len(s)
+    assert np.array_equal(frames[2], s.frame(1))
+    assert start + timedelta(seconds=2) == s.time_taken(1)
+
+
+def test_truncate(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    for i, frame in enumerate(frames):
+        s.append(start + timedelta(seconds=i), frame)
+    s.truncate(2)
+    assert 2 == len(s)
+    assert np.array_equal(frames[1], s.frame(1))
+
+
+def test_append_wrong_shape(tmpdir):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    with pytest.raises(ValueError):
+        s.append(datetime(2018, 1, 1), np.zeros((3, 2)))
+
+
+def test_write_in_place(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    for i, frame in enumerate(frames):
+        s.append(start + timedelta(seconds=i), frame)
+    s.write(1, frames[3])
+
+    loaded = FrameStore.load(str(tmpdir))
+    assert 4 == len(loaded)
+    assert np.array_equal(frames[3], loaded.frame(1))
+    assert np.array_equal(frames[2], loaded.frame(2))
+    with pytest.raises(IndexError):
+        s.write(4, frames[0])
+
+
+def test_open_or_new_shape_mismatch(tmpdir):
+    FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    with pytest.raises(ValueError):
+        FrameStore.open_or_new(str(tmpdir), (3, 3), np.float32)
+
+
+def test_indices_sorted(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    for i, frame in enumerate(frames):
+        s.append(start + timedelta(seconds=10 * i), frame)
+    period = TimePeriod(start + timedelta(seconds=5),
+                        start + timedelta(seconds=20))
+    assert [1, 2] == list(s.indices(period))
+
+
+def test_indices_out_of_order(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    for i, frame in zip([3, 0, 2, 1], frames):
+        s.append(start + timedelta(seconds=i), frame)
+    period = TimePeriod(start, start + timedelta(seconds=2))
+    assert [1, 3, 2] == list(s.indices(period))
+
+
+def test_timestamp_round_trip(start):
+    assert start == store.from_timestamp(store.to_timestamp(start))
+
+
+def test_chunk_image_data_from_store(tmpdir, start, manifest):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32, level_attrs(40))
+    grid = np.arange(6, dtype=np.float32).reshape(2, 3)
+    s.append(start, grid)
+
+    img = ChunkImageData.from_store(manifest, s, 0)
+    assert start == img.time_taken()
+    assert 5 == img.at((80, 40))
+    assert 1 == img.at((40, 0))
+
+
+def test_sequence_from_store_wrong_level(tmpdir, start, manifest):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32, level_attrs(20))
+    period = TimePeriod(start, start)
+    with pytest.raises(ValueError):
+        ChunkImageData.sequence_from_store(manifest, s, period)
+
+
+def test_period_frames_is_view(tmpdir, start, frames):
+    s = FrameStore.new(str(tmpdir), (2, 3), np.float32)
+    for i, frame in enumerate(frames):
+        s.append(start + timedelta(seconds=i), frame)
+    period = TimePeriod(start + timedelta(seconds=1),
+                        start + timedelta(seconds=2))
+    period_frames, timestamps = s.period_frames(period)
+    assert isinstance(period_frames, np.memmap)
+    assert [1, 2] == [int(f[0, 0]) for f in period_frames]
+    assert 2 == len(timestamps)
+
+
+def test_frame_image_data_from_store(tmpdir, start, manifest):
+    s = FrameStore.new(str(tmpdir), (2, 3, 3), np.uint8, {"scale": 2})
+    pixels = np.arange(18, dtype=np.uint8).reshape(2, 3, 3)
+    s.append(start, pixels)
+    assert FrameImageData is store_data_type(s)
+
+    period = TimePeriod(start, start)
+    img, = FrameImageData.sequence_from_store(manifest, s, period)
+    assert start == img.time_taken()
+    assert list(pixels[1, 2]) == list(img.at((5, 3)))
+
+
+def test_chunk_store_rechunks_changed_layout(tmpdir, monkeypatch):
+    monkeypatch.setattr(access, "PATHFINDER_DIR", str(tmpdir))
+    for subdir in [access.DATA_DIR, access.IMAGES_DIR]:
+        os.makedirs(access.sub_dir(0, subdir))
+    shutil.copy(os.path.join(JOB_DIR, "images", "0.jpg"),
+                access.specific_image(0, 0))
+    # chunked at 40x40 before chunk files recorded their layout
+    data_fp = os.path.join(access.sub_dir(0, access.DATA_DIR), "0.txt")
+    shutil.copy(os.path.join(JOB_DIR, "data", "0.txt"), data_fp)
+
+    with open(os.path.join(JOB_DIR, "manifest.json")) as f:
+        manifest_json = json.load(f)
+    manifest_json["chunk"] = {"chunk_width": 80, "chunk_height": 80}
+    s = access.chunk_store(0, Manifest(manifest_json))
+
+    assert 1 == len(s)
+    assert (9, 16) == s.frame_shape
+    assert (80, 80, 80, 80) == PixelChunk.of(data_fp, 80, 80).layout()
+
+
+def test_frame_store_rebuilds_missing_frames(tmpdir, monkeypatch):
+    monkeypatch.setattr(access, "PATHFINDER_DIR", str(tmpdir))
+    for subdir in [access.DATA_DIR, access.IMAGES_DIR, access.STORE_DIR]:
+        os.makedirs(access.sub_dir(0, subdir))
+    with open(os.path.join(JOB_DIR, "manifest.json")) as f:
+        manifest_json = json.load(f)
+    manifest_json["frame_store"] = True
+    manifest_json["chunk"]["decode_scale"] = 8
+    manifest = Manifest(manifest_json)
+    for i in range(2):
+        image_fp = access.specific_image(0, i)
+        shutil.copy(os.path.join(JOB_DIR, "images", "{}.jpg".format(i)),
+                    image_fp)
+        access.save_new_data(0, image_fp, manifest)
+    frames = access.frame_store(0, manifest)
+    expected = np.array(frames.frames())
+
+    # the second frame's append failed
+    frames.truncate(1)
+    rebuilt = access.frame_store(0, manifest)
+    assert 2 == len(rebuilt)
+    assert np.array_equal(expected, rebuilt.frames())
+
+    # without the images there is nothing to rebuild from
+    rebuilt.truncate(1)
+    os.remove(access.specific_image(0, 1))
+    assert access.frame_store(0, manifest) is None
+
+
+###############################################################################
+# Helper functions                                                            #
+###############################################################################
+
+def level_attrs(chunk_size):
+    return {
+        "chunk_width": chunk_size,
+        "chunk_height": chunk_size,
+        "stride_x": chunk_size,
+        "stride_y": chunk_size
+    }
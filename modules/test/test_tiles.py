@@ -0,0 +1,109 @@
+import sys
+from pathlib import Path
+cur_dir = Path(__file__).parents[0]
+parent_dir = Path(__file__).parents[1]
+if parent_dir not in sys.path:
+    sys.path.insert(0, str(parent_dir))
+if cur_dir not in sys.path:
+    sys.path.insert(0, str(cur_dir))
+
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import os
+
+import numpy as np
+from PIL import Image
+from pytest import fixture
+
+
+###############################################################################
+# Unit under test                                                             #
+###############################################################################
+
+import tiles
+from tiles import TilePyramid
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+TILE_SIZE = 16
+IMAGE_SIZE = (40, 24)
+
+
+###############################################################################
+# Fixtures                                                                    #
+###############################################################################
+
+@fixture
+def pixels():
+    rng = np.random.RandomState(0)
+    width, height = IMAGE_SIZE
+    return rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+
+
+@fixture
+def tile_dir(tmpdir):
+    return str(tmpdir.join("tiles"))
+
+
+###############################################################################
+# Helpers                                                                     #
+###############################################################################
+
+def write(pixels, tile_dir):
+    pyramid = TilePyramid.load(tile_dir, IMAGE_SIZE, TILE_SIZE)
+    return pyramid.write(Image.fromarray(pixels))
+
+
+###############################################################################
+# TestCases                                                                   #
+###############################################################################
+
+def test_pyramid_layout(pixels, tile_dir):
+    dirty = write(pixels, tile_dir)
+
+    # 40x24 -> 20x12 -> 10x6 with 16 px tiles
+    assert 2 == tiles.max_zoom(IMAGE_SIZE, TILE_SIZE)
+    assert 3 * 2 + 2 * 1 + 1 == len(dirty)
+    with Image.open(os.path.join(tile_dir, "2", "2", "1.png")) as tile:
+        assert (8, 8) == tile.size
+    with Image.open(os.path.join(tile_dir, "0", "0", "0.png")) as tile:
+        assert (10, 6) == tile.size
+
+
+def test_rewrite_only_dirty_tiles(pixels, tile_dir):
+    write(pixels, tile_dir)
+    assert [] == write(pixels, tile_dir)
+
+    pixels[20, 35] = 255 - pixels[20, 35]
+    assert ["2/2/1", "1/1/0", "0/0/0"] == write(pixels, tile_dir)
+
+
+def test_resized_image_starts_over(pixels, tile_dir):
+    write(pixels, tile_dir)
+    pyramid = TilePyramid.load(tile_dir, (32, 32), TILE_SIZE)
+    assert {} == pyramid.digests
+    assert not os.path.exists(os.path.join(tile_dir, "2"))
+
+
+def test_sync_dir_copies_changes(pixels, tile_dir, tmpdir):
+    dest = str(tmpdir.join("web"))
+    write(pixels, tile_dir)
+    tiles.sync_dir(tile_dir, dest)
+    assert 0 == tiles.sync_dir(tile_dir, dest)
+
+    pixels[0, 0] = 255 - pixels[0, 0]
+    write(pixels, tile_dir)
+    open(os.path.join(dest, "stale.png"), 'w').close()
+
+    # three tiles and the index
+    assert 4 == tiles.sync_dir(tile_dir, dest)
+    assert not os.path.exists(os.path.join(dest, "stale.png"))
+    with open(os.path.join(tile_dir, "2", "0", "0.png"), 'rb') as f:
+        with open(os.path.join(dest, "2", "0", "0.png"), 'rb') as g:
+            assert f.read() == g.read()
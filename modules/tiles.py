@@ -0,0 +1,197 @@
+'''tiles module
+
+Tools for cutting an output image into a pyramid of XYZ tiles, so the
+web client can fetch only the part of an image it shows, and only
+the tiles that changed since it last looked.
+
+A pyramid for an image lives in its own directory:
+
+    tiles.json      tile size, image size, zoom levels, the digest of
+                    every tile and which tiles the last write changed
+    {z}/{x}/{y}.png one tile; zoom max_zoom is the image at full size
+                    and each lower zoom halves it, down to one tile
+
+Tiles are tile_size pixels square, except along the right and bottom
+edges where they are cropped to the image. Writing a pyramid again
+only encodes the tiles whose pixels changed, and leaves the other
+files untouched, so copying the directory by modification time only
+moves the changed tiles.
+'''
+
+###############################################################################
+# Imports                                                                     #
+###############################################################################
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+
+###############################################################################
+# Constants                                                                   #
+###############################################################################
+
+DEFAULT_TILE_SIZE = 256
+
+INDEX_FILENAME = "tiles.json"
+TILE_EXTENSION = ".png"
+
+TILE_SIZE = "tile_size"
+SIZE = "size"
+MAX_ZOOM = "max_zoom"
+TILES = "tiles"
+DIRTY = "dirty"
+
+
+###############################################################################
+# Classes                                                                     #
+###############################################################################
+
+class TilePyramid(object):
+    """XYZ tiles of one image, see the module docstring for the layout"""
+
+    @staticmethod
+    def load(dirpath, size, tile_size=DEFAULT_TILE_SIZE):
+        '''pyramid in dirpath, emptied if it was cut differently'''
+        index = {}
+        index_fp = os.path.join(dirpath, INDEX_FILENAME)
+        if os.path.isfile(index_fp):
+            with open(index_fp) as f:
+                index = json.load(f)
+
+        pyramid = TilePyramid(dirpath, size, tile_size)
+        if index.get(SIZE) == list(size) and \
+                index.get(TILE_SIZE) == tile_size:
+            pyramid.digests = index[TILES]
+        elif os.path.isdir(dirpath):
+            shutil.rmtree(dirpath)
+        return pyramid
+
+    def __init__(self, dirpath, size, tile_size=DEFAULT_TILE_SIZE):
+        super().__init__()
+        self.dirpath = dirpath
+        self.size = tuple(size)
+        self.tile_size = tile_size
+        self.max_zoom = max_zoom(size, tile_size)
+        self.digests = {}
+        self.dirty = []
+
+    def write(self, img):
+        '''write the tiles of img that changed, returning their names'''
+        img = img.convert("RGB")
+        if img.size != self.size:
+            msg = "Image size {} does not match pyramid size {}"\
+                .format(img.size, self.size)
+            raise ValueError(msg)
+
+        self.dirty = []
+        for zoom in range(self.max_zoom, -1, -1):
+            for name, tile in self.level_tiles(img, zoom):
+                digest = hashlib.sha1(np.asarray(tile).data).hexdigest()
+                if self.digests.get(name) == digest:
+                    continue
+                filepath = os.path.join(self.dirpath, name + TILE_EXTENSION)
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                tile.save(filepath)
+                self.digests[name] = digest
+                self.dirty.append(name)
+            img = halve(img)
+
+        self.save_index()
+        return self.dirty
+
+    def level_tiles(self, img, zoom):
+        '''(name, tile) for every tile of img, the image at zoom'''
+        width, height = img.size
+        for x in range(0, width, self.tile_size):
+            for y in range(0, height, self.tile_size):
+                box = (x, y,
+                       min(x + self.tile_size, width),
+                       min(y + self.tile_size, height))
+                name = tile_name(zoom, x // self.tile_size,
+                                 y // self.tile_size)
+                yield name, img.crop(box)
+
+    def save_index(self):
+        index = {
+            TILE_SIZE: self.tile_size,
+            SIZE: list(self.size),
+            MAX_ZOOM: self.max_zoom,
+            TILES: self.digests,
+            DIRTY: self.dirty
+        }
+        os.makedirs(self.dirpath, exist_ok=True)
+        index_fp = os.path.join(self.dirpath, INDEX_FILENAME)
+        tmp_fp = index_fp + ".tmp"
+        with open(tmp_fp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_fp, index_fp)
+
+
+###############################################################################
+# Tile Tools                                                                  #
+###############################################################################
+
+def write_tiles(image_filepath, dirpath, tile_size=DEFAULT_TILE_SIZE):
+    '''update the tile pyramid in dirpath from an image file'''
+    with Image.open(image_filepath) as img:
+        pyramid = TilePyramid.load(dirpath, img.size, tile_size)
+        return pyramid.write(img)
+
+
+def max_zoom(size, tile_size):
+    '''zoom at which the image is full size, zoom 0 being one tile'''
+    zoom = 0
+    while max(size) > tile_size << zoom:
+        zoom += 1
+    return zoom
+
+
+def halve(img):
+    width, height = img.size
+    half = ((width + 1) // 2, (height + 1) // 2)
+    return img.resize(half, Image.BOX)
+
+
+def tile_name(zoom, x, y):
+    return "{}/{}/{}".format(zoom, x, y)
+
+
+def sync_dir(src, dest):
+    '''make dest a copy of src, copying only new or modified files'''
+    os.makedirs(dest, exist_ok=True)
+    copied = 0
+    for src_root, dirnames, filenames in os.walk(src):
+        dest_root = os.path.join(dest, os.path.relpath(src_root, src))
+        os.makedirs(dest_root, exist_ok=True)
+
+        for filename in filenames:
+            src_fp = os.path.join(src_root, filename)
+            dest_fp = os.path.join(dest_root, filename)
+            if not same_file_stats(src_fp, dest_fp):
+                shutil.copy2(src_fp, dest_fp)
+                copied += 1
+
+        # drop what is no longer in src
+        for entry in os.listdir(dest_root):
+            if entry in filenames or entry in dirnames:
+                continue
+            dest_fp = os.path.join(dest_root, entry)
+            if os.path.isdir(dest_fp):
+                shutil.rmtree(dest_fp)
+            else:
+                os.remove(dest_fp)
+    return copied
+
+
+def same_file_stats(src_fp, dest_fp):
+    if not os.path.isfile(dest_fp):
+        return False
+    src_stat = os.stat(src_fp)
+    dest_stat = os.stat(dest_fp)
+    return src_stat.st_size == dest_stat.st_size and \
+        src_stat.st_mtime_ns == dest_stat.st_mtime_ns